@@ -115,12 +115,50 @@ CREATE TABLE repromon.message_log (
     event_on timestamp without time zone NOT NULL,
     registered_on timestamp without time zone NOT NULL,
     recorded_on timestamp without time zone NOT NULL,
-    recorded_by character varying(15) NOT NULL
+    recorded_by character varying(15) NOT NULL,
+    client_key character varying(64)
 );
 
 
 ALTER TABLE repromon.message_log OWNER TO postgres;
 
+--
+-- Name: message_log_client_key; Type: TABLE; Schema: repromon; Owner: postgres
+--
+
+CREATE TABLE repromon.message_log_client_key (
+    recorded_by character varying(15) NOT NULL,
+    client_key character varying(64) NOT NULL,
+    message_id integer NOT NULL,
+    event_on timestamp without time zone NOT NULL
+);
+
+
+ALTER TABLE repromon.message_log_client_key OWNER TO postgres;
+
+--
+-- Name: message_log_recent; Type: TABLE; Schema: repromon; Owner: postgres
+--
+
+CREATE TABLE repromon.message_log_recent (
+    id integer NOT NULL,
+    level_id integer NOT NULL,
+    category_id integer NOT NULL,
+    device_id integer NOT NULL,
+    provider_id integer NOT NULL,
+    study_id integer,
+    study_name character varying(255),
+    description character varying(255),
+    event_on timestamp without time zone NOT NULL,
+    registered_on timestamp without time zone NOT NULL,
+    recorded_on timestamp without time zone NOT NULL,
+    recorded_by character varying(15) NOT NULL,
+    client_key character varying(64)
+);
+
+
+ALTER TABLE repromon.message_log_recent OWNER TO postgres;
+
 --
 -- TOC entry 220 (class 1259 OID 16535)
 -- Name: message_log_id_seq; Type: SEQUENCE; Schema: repromon; Owner: postgres
@@ -440,14 +478,14 @@ COPY repromon.message_level (id, level) FROM stdin;
 -- Data for Name: message_log; Type: TABLE DATA; Schema: repromon; Owner: postgres
 --
 
-COPY repromon.message_log (id, level_id, category_id, device_id, provider_id, study_id, study_name, is_visible, visible_updated_on, visible_updated_by, description, payload, event_on, registered_on, recorded_on, recorded_by) FROM stdin;
-1	1	1	1	2	\N	\N	Y	\N	\N	stimuli display dis-connected	\N	2023-06-07 10:49:31	2023-06-07 10:50:01	2023-06-07 10:50:31	reprostim
-2	1	1	1	2	\N	\N	Y	\N	\N	stimuli display connected(1024x768, …)\n	\N	2023-06-07 10:50:22	2023-06-07 10:51:02	2023-06-07 10:51:22	reprostim
-3	3	1	1	5	1	Halchenko/Horea/1020_animal_mri	Y	\N	\N	subject “John” is not conformant, must match [0-9]{6} regular expression. [link to screen with highlight]\n	\N	2023-06-07 10:51:44	2023-06-07 10:52:04	2023-06-07 10:52:44	noisseur
-4	1	1	1	5	1	Halchenko/Horea/1020_animal_mri	Y	\N	\N	proceeded with compliant data on study Halchenko/Horea/1020_animal_mri	\N	2023-06-07 10:54:17	2023-06-07 10:55:07	2023-06-07 10:55:17	noisseur
-5	1	1	1	3	\N	\N	Y	\N	\N	MRI trigger event received	\N	2023-06-07 10:55:45	2023-06-07 10:56:05	2023-06-07 10:56:45	reproevt
-6	3	1	1	6	\N	\N	Y	\N	\N	MRI data lacks rear head coils data [link to PACS recording to review]	\N	2023-06-07 10:58:01	2023-06-07 10:59:00	2023-06-07 10:59:01	dicomqa
-7	1	1	1	3	\N	\N	Y	\N	\N	MRI trigger event received	null	2023-09-05 23:32:10.244539	2023-09-05 23:34:52.263282	2023-09-05 23:34:52.26329	poweruser
+COPY repromon.message_log (id, level_id, category_id, device_id, provider_id, study_id, study_name, is_visible, visible_updated_on, visible_updated_by, description, payload, event_on, registered_on, recorded_on, recorded_by, client_key) FROM stdin;
+1	1	1	1	2	\N	\N	Y	\N	\N	stimuli display dis-connected	\N	2023-06-07 10:49:31	2023-06-07 10:50:01	2023-06-07 10:50:31	reprostim	\N
+2	1	1	1	2	\N	\N	Y	\N	\N	stimuli display connected(1024x768, …)\n	\N	2023-06-07 10:50:22	2023-06-07 10:51:02	2023-06-07 10:51:22	reprostim	\N
+3	3	1	1	5	1	Halchenko/Horea/1020_animal_mri	Y	\N	\N	subject “John” is not conformant, must match [0-9]{6} regular expression. [link to screen with highlight]\n	\N	2023-06-07 10:51:44	2023-06-07 10:52:04	2023-06-07 10:52:44	noisseur	\N
+4	1	1	1	5	1	Halchenko/Horea/1020_animal_mri	Y	\N	\N	proceeded with compliant data on study Halchenko/Horea/1020_animal_mri	\N	2023-06-07 10:54:17	2023-06-07 10:55:07	2023-06-07 10:55:17	noisseur	\N
+5	1	1	1	3	\N	\N	Y	\N	\N	MRI trigger event received	\N	2023-06-07 10:55:45	2023-06-07 10:56:05	2023-06-07 10:56:45	reproevt	\N
+6	3	1	1	6	\N	\N	Y	\N	\N	MRI data lacks rear head coils data [link to PACS recording to review]	\N	2023-06-07 10:58:01	2023-06-07 10:59:00	2023-06-07 10:59:01	dicomqa	\N
+7	1	1	1	3	\N	\N	Y	\N	\N	MRI trigger event received	null	2023-09-05 23:32:10.244539	2023-09-05 23:34:52.263282	2023-09-05 23:34:52.26329	poweruser	\N
 \.
 
 
@@ -639,6 +677,22 @@ ALTER TABLE ONLY repromon.message_log
     ADD CONSTRAINT message_log_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: message_log_client_key message_log_client_key_pkey; Type: CONSTRAINT; Schema: repromon; Owner: postgres
+--
+
+ALTER TABLE ONLY repromon.message_log_client_key
+    ADD CONSTRAINT message_log_client_key_pkey PRIMARY KEY (recorded_by, client_key);
+
+
+--
+-- Name: message_log_recent message_log_recent_pkey; Type: CONSTRAINT; Schema: repromon; Owner: postgres
+--
+
+ALTER TABLE ONLY repromon.message_log_recent
+    ADD CONSTRAINT message_log_recent_pkey PRIMARY KEY (id);
+
+
 --
 -- TOC entry 3502 (class 2606 OID 16547)
 -- Name: role role_pkey; Type: CONSTRAINT; Schema: repromon; Owner: postgres
@@ -747,59 +801,73 @@ CREATE INDEX idx_data_provider_provider ON repromon.data_provider USING btree (p
 
 
 --
--- TOC entry 3508 (class 1259 OID 16593)
--- Name: idx_message_log_category_id; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_category_event; Type: INDEX; Schema: repromon; Owner: postgres
+--
+
+CREATE INDEX idx_message_log_category_event ON repromon.message_log USING btree (category_id, event_on, recorded_on);
+
+
+--
+-- Name: idx_message_log_client_key; Type: INDEX; Schema: repromon; Owner: postgres
+--
+
+CREATE UNIQUE INDEX idx_message_log_client_key ON repromon.message_log USING btree (recorded_by, client_key);
+
+
+--
+-- Name: idx_message_log_client_key_event_on; Type: INDEX; Schema: repromon; Owner: postgres
+--
+
+CREATE INDEX idx_message_log_client_key_event_on ON repromon.message_log_client_key USING btree (event_on);
+
+
+--
+-- Name: idx_message_log_client_key_message_id; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_category_id ON repromon.message_log USING btree (category_id);
+CREATE INDEX idx_message_log_client_key_message_id ON repromon.message_log_client_key USING btree (message_id);
 
 
 --
--- TOC entry 3509 (class 1259 OID 16599)
--- Name: idx_message_log_device_id; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_event_key; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_device_id ON repromon.message_log USING btree (device_id);
+CREATE INDEX idx_message_log_event_key ON repromon.message_log USING btree (event_on, recorded_on, id);
 
 
 --
--- TOC entry 3510 (class 1259 OID 16595)
--- Name: idx_message_log_event_on; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_recent_category_event; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_event_on ON repromon.message_log USING btree (event_on);
+CREATE INDEX idx_message_log_recent_category_event ON repromon.message_log_recent USING btree (category_id, event_on);
 
 
 --
--- TOC entry 3511 (class 1259 OID 16594)
--- Name: idx_message_log_is_visible; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_recent_event_on; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_is_visible ON repromon.message_log USING btree (is_visible);
+CREATE INDEX idx_message_log_recent_event_on ON repromon.message_log_recent USING btree (event_on);
 
 
 --
--- TOC entry 3512 (class 1259 OID 16598)
--- Name: idx_message_log_provider_id; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_recent_study_event; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_provider_id ON repromon.message_log USING btree (provider_id);
+CREATE INDEX idx_message_log_recent_study_event ON repromon.message_log_recent USING btree (study_id, category_id, event_on);
 
 
 --
--- TOC entry 3513 (class 1259 OID 16596)
--- Name: idx_message_log_study_id; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_study_visible; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_study_id ON repromon.message_log USING btree (study_id);
+CREATE INDEX idx_message_log_study_visible ON repromon.message_log USING btree (study_id, event_on, recorded_on) WHERE ((is_visible)::text = 'Y'::text);
 
 
 --
--- TOC entry 3514 (class 1259 OID 16597)
--- Name: idx_message_log_study_name; Type: INDEX; Schema: repromon; Owner: postgres
+-- Name: idx_message_log_visible_updated_on; Type: INDEX; Schema: repromon; Owner: postgres
 --
 
-CREATE INDEX idx_message_log_study_name ON repromon.message_log USING btree (study_name);
+CREATE INDEX idx_message_log_visible_updated_on ON repromon.message_log USING btree (visible_updated_on);
 
 
 --
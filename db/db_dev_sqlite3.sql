@@ -148,14 +148,38 @@ CREATE TABLE IF NOT EXISTS "message_log" (
 	"registered_on"	TIMESTAMP,
 	"recorded_on"	TIMESTAMP,
 	"recorded_by"	VARCHAR(15),
+	"client_key"	VARCHAR(64),
 	PRIMARY KEY("id" AUTOINCREMENT)
 );
-INSERT INTO message_log VALUES(1,1,1,1,2,NULL,NULL,'Y',NULL,NULL,'stimuli display dis-connected',NULL,'2023-06-07 10:49:31','2023-06-07 10:50:01','2023-06-07 10:50:31','reprostim');
-INSERT INTO message_log VALUES(2,1,1,1,2,NULL,NULL,'Y',NULL,NULL,replace('stimuli display connected(1024x768, …)\n','\n',char(10)),NULL,'2023-06-07 10:50:22','2023-06-07 10:51:02','2023-06-07 10:51:22','reprostim');
-INSERT INTO message_log VALUES(3,3,1,1,5,1,'Halchenko/Horea/1020_animal_mri','Y',NULL,NULL,replace('subject “John” is not conformant, must match [0-9]{6} regular expression. [link to screen with highlight]\n','\n',char(10)),NULL,'2023-06-07 10:51:44','2023-06-07 10:52:04','2023-06-07 10:52:44','noisseur');
-INSERT INTO message_log VALUES(4,1,1,1,5,1,'Halchenko/Horea/1020_animal_mri','Y',NULL,NULL,'proceeded with compliant data on study Halchenko/Horea/1020_animal_mri',NULL,'2023-06-07 10:54:17','2023-06-07 10:55:07','2023-06-07 10:55:17','noisseur');
-INSERT INTO message_log VALUES(5,1,1,1,3,NULL,NULL,'Y',NULL,NULL,'MRI trigger event received',NULL,'2023-06-07 10:55:45','2023-06-07 10:56:05','2023-06-07 10:56:45','reproevt');
-INSERT INTO message_log VALUES(6,3,1,1,6,NULL,NULL,'Y',NULL,NULL,'MRI data lacks rear head coils data [link to PACS recording to review]',NULL,'2023-06-07 10:58:01','2023-06-07 10:59:00','2023-06-07 10:59:01','dicomqa');
+INSERT INTO message_log VALUES(1,1,1,1,2,NULL,NULL,'Y',NULL,NULL,'stimuli display dis-connected',NULL,'2023-06-07 10:49:31','2023-06-07 10:50:01','2023-06-07 10:50:31','reprostim',NULL);
+INSERT INTO message_log VALUES(2,1,1,1,2,NULL,NULL,'Y',NULL,NULL,replace('stimuli display connected(1024x768, …)\n','\n',char(10)),NULL,'2023-06-07 10:50:22','2023-06-07 10:51:02','2023-06-07 10:51:22','reprostim',NULL);
+INSERT INTO message_log VALUES(3,3,1,1,5,1,'Halchenko/Horea/1020_animal_mri','Y',NULL,NULL,replace('subject “John” is not conformant, must match [0-9]{6} regular expression. [link to screen with highlight]\n','\n',char(10)),NULL,'2023-06-07 10:51:44','2023-06-07 10:52:04','2023-06-07 10:52:44','noisseur',NULL);
+INSERT INTO message_log VALUES(4,1,1,1,5,1,'Halchenko/Horea/1020_animal_mri','Y',NULL,NULL,'proceeded with compliant data on study Halchenko/Horea/1020_animal_mri',NULL,'2023-06-07 10:54:17','2023-06-07 10:55:07','2023-06-07 10:55:17','noisseur',NULL);
+INSERT INTO message_log VALUES(5,1,1,1,3,NULL,NULL,'Y',NULL,NULL,'MRI trigger event received',NULL,'2023-06-07 10:55:45','2023-06-07 10:56:05','2023-06-07 10:56:45','reproevt',NULL);
+INSERT INTO message_log VALUES(6,3,1,1,6,NULL,NULL,'Y',NULL,NULL,'MRI data lacks rear head coils data [link to PACS recording to review]',NULL,'2023-06-07 10:58:01','2023-06-07 10:59:00','2023-06-07 10:59:01','dicomqa',NULL);
+CREATE TABLE IF NOT EXISTS "message_log_client_key" (
+	"recorded_by"	VARCHAR(15) NOT NULL,
+	"client_key"	VARCHAR(64) NOT NULL,
+	"message_id"	INTEGER NOT NULL,
+	"event_on"	TIMESTAMP NOT NULL,
+	PRIMARY KEY("recorded_by","client_key")
+);
+CREATE TABLE IF NOT EXISTS "message_log_recent" (
+	"id"	INTEGER NOT NULL UNIQUE,
+	"level_id"	INTEGER NOT NULL,
+	"category_id"	INTEGER NOT NULL,
+	"device_id"	INTEGER NOT NULL,
+	"provider_id"	INTEGER NOT NULL,
+	"study_id"	INTEGER,
+	"study_name"	VARCHAR(255),
+	"description"	VARCHAR(255),
+	"event_on"	TIMESTAMP NOT NULL,
+	"registered_on"	TIMESTAMP NOT NULL,
+	"recorded_on"	TIMESTAMP NOT NULL,
+	"recorded_by"	VARCHAR(15) NOT NULL,
+	"client_key"	VARCHAR(64),
+	PRIMARY KEY("id")
+);
 DELETE FROM sqlite_sequence;
 INSERT INTO sqlite_sequence VALUES('sec_user_role',10);
 INSERT INTO sqlite_sequence VALUES('message_category',1);
@@ -169,6 +193,46 @@ INSERT INTO sqlite_sequence VALUES('user',9);
 INSERT INTO sqlite_sequence VALUES('role',6);
 INSERT INTO sqlite_sequence VALUES('study_data',1);
 INSERT INTO sqlite_sequence VALUES('message_log',6);
+CREATE INDEX "idx_message_log_category_event" ON "message_log" (
+	"category_id",
+	"event_on",
+	"recorded_on"
+);
+CREATE UNIQUE INDEX "idx_message_log_client_key" ON "message_log" (
+	"recorded_by",
+	"client_key"
+);
+CREATE INDEX "idx_message_log_client_key_event_on" ON "message_log_client_key" (
+	"event_on"
+);
+CREATE INDEX "idx_message_log_client_key_message_id" ON "message_log_client_key" (
+	"message_id"
+);
+CREATE INDEX "idx_message_log_event_key" ON "message_log" (
+	"event_on",
+	"recorded_on",
+	"id"
+);
+CREATE INDEX "idx_message_log_recent_category_event" ON "message_log_recent" (
+	"category_id",
+	"event_on"
+);
+CREATE INDEX "idx_message_log_recent_event_on" ON "message_log_recent" (
+	"event_on"
+);
+CREATE INDEX "idx_message_log_recent_study_event" ON "message_log_recent" (
+	"study_id",
+	"category_id",
+	"event_on"
+);
+CREATE INDEX "idx_message_log_study_visible" ON "message_log" (
+	"study_id",
+	"event_on",
+	"recorded_on"
+) WHERE "is_visible" = 'Y';
+CREATE INDEX "idx_message_log_visible_updated_on" ON "message_log" (
+	"visible_updated_on"
+);
 CREATE INDEX "idx_user_name" ON "user" (
 	"username"
 );
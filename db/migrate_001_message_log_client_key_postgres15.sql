@@ -0,0 +1,11 @@
+--
+-- Migration 001: idempotency key for message_log
+--
+-- Messages sent with optional client_key are written once per
+-- (recorded_by, client_key), retries return the original message.
+--
+
+ALTER TABLE repromon.message_log ADD COLUMN IF NOT EXISTS client_key character varying(64);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_message_log_client_key
+    ON repromon.message_log USING btree (recorded_by, client_key);
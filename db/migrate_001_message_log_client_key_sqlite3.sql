@@ -0,0 +1,11 @@
+--
+-- Migration 001: idempotency key for message_log
+--
+-- Messages sent with optional client_key are written once per
+-- (recorded_by, client_key), retries return the original message.
+--
+
+ALTER TABLE message_log ADD COLUMN client_key VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_message_log_client_key
+    ON message_log (recorded_by, client_key);
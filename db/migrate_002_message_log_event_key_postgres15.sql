@@ -0,0 +1,9 @@
+--
+-- Migration 002: message log page key index
+--
+-- Keyset pagination seeks message_log by (event_on, recorded_on, id)
+-- rather than OFFSET, so each page costs the same.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_message_log_event_key
+    ON repromon.message_log USING btree (event_on, recorded_on, id);
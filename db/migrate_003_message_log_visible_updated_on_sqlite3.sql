@@ -0,0 +1,8 @@
+--
+-- Migration 003: message log visibility change index
+--
+-- Delta fetch returns rows with visibility updated after watermark.
+--
+
+CREATE INDEX IF NOT EXISTS idx_message_log_visible_updated_on
+    ON message_log (visible_updated_on);
@@ -0,0 +1,34 @@
+--
+-- Migration 004: message log composite and partial indexes
+--
+-- Feedback log is filtered by category or study and ordered by event
+-- time, so composite indexes replace single column ones, and study
+-- screens only read visible rows, so their index is partial. Old
+-- single column indexes are dropped to reduce ingest write cost, both
+-- idx_ names from DDL dump and ix_ ones created by setup_db are listed.
+-- New indexes are created before old ones are dropped, all without
+-- locking writes, run outside of transaction block.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_message_log_category_event
+    ON repromon.message_log USING btree (category_id, event_on, recorded_on);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_message_log_study_visible
+    ON repromon.message_log USING btree (study_id, event_on, recorded_on)
+    WHERE is_visible = 'Y';
+
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_category_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_device_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_event_on;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_is_visible;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_provider_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_study_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.idx_message_log_study_name;
+
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_category_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_device_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_event_on;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_is_visible;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_provider_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_study_id;
+DROP INDEX CONCURRENTLY IF EXISTS repromon.ix_message_log_study_name;
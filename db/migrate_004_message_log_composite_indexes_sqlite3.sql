@@ -0,0 +1,24 @@
+--
+-- Migration 004: message log composite and partial indexes
+--
+-- Feedback log is filtered by category or study and ordered by event
+-- time, so composite indexes replace single column ones, and study
+-- screens only read visible rows, so their index is partial. Old
+-- single column indexes created by setup_db are dropped to reduce
+-- ingest write cost.
+--
+
+CREATE INDEX IF NOT EXISTS idx_message_log_category_event
+    ON message_log (category_id, event_on, recorded_on);
+
+CREATE INDEX IF NOT EXISTS idx_message_log_study_visible
+    ON message_log (study_id, event_on, recorded_on)
+    WHERE is_visible = 'Y';
+
+DROP INDEX IF EXISTS ix_message_log_category_id;
+DROP INDEX IF EXISTS ix_message_log_device_id;
+DROP INDEX IF EXISTS ix_message_log_event_on;
+DROP INDEX IF EXISTS ix_message_log_is_visible;
+DROP INDEX IF EXISTS ix_message_log_provider_id;
+DROP INDEX IF EXISTS ix_message_log_study_id;
+DROP INDEX IF EXISTS ix_message_log_study_name;
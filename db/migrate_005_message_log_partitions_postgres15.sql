@@ -0,0 +1,79 @@
+--
+-- Migration 005: message_log range partitioning on event_on
+--
+-- Optional, Postgres only, SQLite databases keep plain message_log.
+-- Table is rebuilt as declarative range partitioned one with monthly
+-- partitions for existing rows and the next 3 months, and default
+-- partition for rows out of range. Then [maintenance] partition_enabled
+-- job in repromon.ini creates partitions ahead of time and drops whole
+-- old partitions by retention, interval can be changed to week there.
+--
+-- Rows are copied in single transaction and writes are blocked until
+-- it is committed, so run it in maintenance window.
+--
+-- Primary key and unique indexes of partitioned table must include
+-- event_on, so unique index on (recorded_by, client_key, event_on)
+-- does not catch retries without explicit event_on, apply migration
+-- 007 to keep client_key idempotency enforced by DB.
+--
+
+BEGIN;
+
+ALTER TABLE repromon.message_log RENAME TO message_log_unpartitioned;
+ALTER TABLE repromon.message_log_unpartitioned
+    RENAME CONSTRAINT message_log_pkey TO message_log_unpartitioned_pkey;
+
+CREATE TABLE repromon.message_log (
+    LIKE repromon.message_log_unpartitioned INCLUDING DEFAULTS
+) PARTITION BY RANGE (event_on);
+
+ALTER TABLE repromon.message_log
+    ADD CONSTRAINT message_log_pkey PRIMARY KEY (id, event_on);
+
+ALTER SEQUENCE repromon.message_log_id_seq OWNED BY repromon.message_log.id;
+
+CREATE TABLE repromon.message_log_default
+    PARTITION OF repromon.message_log DEFAULT;
+
+DO $$
+DECLARE
+    p_start timestamp without time zone;
+    p_end timestamp without time zone;
+BEGIN
+    SELECT date_trunc('month', coalesce(min(event_on), localtimestamp))
+        INTO p_start FROM repromon.message_log_unpartitioned;
+    WHILE p_start < date_trunc('month', localtimestamp) + interval '4 months'
+    LOOP
+        p_end := p_start + interval '1 month';
+        EXECUTE format(
+            'CREATE TABLE repromon.%I PARTITION OF repromon.message_log '
+            'FOR VALUES FROM (%L) TO (%L)',
+            'message_log_p' || to_char(p_start, 'YYYYMMDD'), p_start, p_end);
+        p_start := p_end;
+    END LOOP;
+END $$;
+
+INSERT INTO repromon.message_log
+    SELECT * FROM repromon.message_log_unpartitioned;
+
+DROP TABLE repromon.message_log_unpartitioned;
+
+CREATE INDEX idx_message_log_category_event
+    ON repromon.message_log USING btree (category_id, event_on, recorded_on);
+
+CREATE UNIQUE INDEX idx_message_log_client_key
+    ON repromon.message_log USING btree (recorded_by, client_key, event_on);
+
+CREATE INDEX idx_message_log_event_key
+    ON repromon.message_log USING btree (event_on, recorded_on, id);
+
+CREATE INDEX idx_message_log_study_visible
+    ON repromon.message_log USING btree (study_id, event_on, recorded_on)
+    WHERE is_visible = 'Y';
+
+CREATE INDEX idx_message_log_visible_updated_on
+    ON repromon.message_log USING btree (visible_updated_on);
+
+COMMIT;
+
+ANALYZE repromon.message_log;
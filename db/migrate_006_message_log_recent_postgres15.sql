@@ -0,0 +1,35 @@
+--
+-- Migration 006: message log recent hot table
+--
+-- Copy of visible message_log rows of the last [feedback] recent_hours,
+-- kept in the same transaction as message_log by send_message and
+-- visibility updates and pruned by background job, so feedback screens
+-- polling short intervals read a small table. Existing rows are copied
+-- by the first prune job run after the table is created.
+--
+
+CREATE TABLE IF NOT EXISTS repromon.message_log_recent (
+    id integer NOT NULL,
+    level_id integer NOT NULL,
+    category_id integer NOT NULL,
+    device_id integer NOT NULL,
+    provider_id integer NOT NULL,
+    study_id integer,
+    study_name character varying(255),
+    description character varying(255),
+    event_on timestamp without time zone NOT NULL,
+    registered_on timestamp without time zone NOT NULL,
+    recorded_on timestamp without time zone NOT NULL,
+    recorded_by character varying(15) NOT NULL,
+    client_key character varying(64),
+    CONSTRAINT message_log_recent_pkey PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_log_recent_category_event
+    ON repromon.message_log_recent USING btree (category_id, event_on);
+
+CREATE INDEX IF NOT EXISTS idx_message_log_recent_event_on
+    ON repromon.message_log_recent USING btree (event_on);
+
+CREATE INDEX IF NOT EXISTS idx_message_log_recent_study_event
+    ON repromon.message_log_recent USING btree (study_id, category_id, event_on);
@@ -0,0 +1,41 @@
+--
+-- Migration 006: message log recent hot table
+--
+-- Copy of visible message_log rows of the last [feedback] recent_hours,
+-- kept in the same transaction as message_log by send_message and
+-- visibility updates and pruned by background job, so feedback screens
+-- polling short intervals read a small table. Existing rows are copied
+-- by the first prune job run after the table is created.
+--
+
+CREATE TABLE IF NOT EXISTS "message_log_recent" (
+	"id"	INTEGER NOT NULL UNIQUE,
+	"level_id"	INTEGER NOT NULL,
+	"category_id"	INTEGER NOT NULL,
+	"device_id"	INTEGER NOT NULL,
+	"provider_id"	INTEGER NOT NULL,
+	"study_id"	INTEGER,
+	"study_name"	VARCHAR(255),
+	"description"	VARCHAR(255),
+	"event_on"	TIMESTAMP NOT NULL,
+	"registered_on"	TIMESTAMP NOT NULL,
+	"recorded_on"	TIMESTAMP NOT NULL,
+	"recorded_by"	VARCHAR(15) NOT NULL,
+	"client_key"	VARCHAR(64),
+	PRIMARY KEY("id")
+);
+
+CREATE INDEX IF NOT EXISTS "idx_message_log_recent_category_event" ON "message_log_recent" (
+	"category_id",
+	"event_on"
+);
+
+CREATE INDEX IF NOT EXISTS "idx_message_log_recent_event_on" ON "message_log_recent" (
+	"event_on"
+);
+
+CREATE INDEX IF NOT EXISTS "idx_message_log_recent_study_event" ON "message_log_recent" (
+	"study_id",
+	"category_id",
+	"event_on"
+);
@@ -0,0 +1,41 @@
+--
+-- Migration 007: idempotency keys table
+--
+-- Keys of messages sent with client_key are also written to separate
+-- message_log_client_key table in the same transaction when message_log
+-- is partitioned. Unique indexes of partitioned message_log must include
+-- event_on (see migration 005), so this not partitioned table keeps
+-- retries detected by DB per (recorded_by, client_key). Keys of existing
+-- rows are copied if message_log is partitioned, otherwise its own
+-- unique index detects retries and the table stays empty.
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS repromon.message_log_client_key (
+    recorded_by character varying(15) NOT NULL,
+    client_key character varying(64) NOT NULL,
+    message_id integer NOT NULL,
+    event_on timestamp without time zone NOT NULL,
+    CONSTRAINT message_log_client_key_pkey
+        PRIMARY KEY (recorded_by, client_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_log_client_key_event_on
+    ON repromon.message_log_client_key USING btree (event_on);
+
+CREATE INDEX IF NOT EXISTS idx_message_log_client_key_message_id
+    ON repromon.message_log_client_key USING btree (message_id);
+
+INSERT INTO repromon.message_log_client_key
+    (recorded_by, client_key, message_id, event_on)
+    SELECT recorded_by, client_key, id, event_on
+    FROM repromon.message_log WHERE client_key IS NOT NULL
+        AND EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relname = 'message_log' AND n.nspname = 'repromon')
+    ON CONFLICT DO NOTHING;
+
+COMMIT;
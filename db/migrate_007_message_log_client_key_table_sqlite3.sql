@@ -0,0 +1,26 @@
+--
+-- Migration 007: idempotency keys table
+--
+-- Keys of messages sent with client_key are also written to separate
+-- message_log_client_key table in the same transaction when message_log
+-- is partitioned, so retries are detected by DB per (recorded_by,
+-- client_key) there too. SQLite message_log is never partitioned and
+-- its unique index detects retries, so the table stays empty and is
+-- created for the same schema only.
+--
+
+CREATE TABLE IF NOT EXISTS "message_log_client_key" (
+	"recorded_by"	VARCHAR(15) NOT NULL,
+	"client_key"	VARCHAR(64) NOT NULL,
+	"message_id"	INTEGER NOT NULL,
+	"event_on"	TIMESTAMP NOT NULL,
+	PRIMARY KEY("recorded_by","client_key")
+);
+
+CREATE INDEX IF NOT EXISTS "idx_message_log_client_key_event_on" ON "message_log_client_key" (
+	"event_on"
+);
+
+CREATE INDEX IF NOT EXISTS "idx_message_log_client_key_message_id" ON "message_log_client_key" (
+	"message_id"
+);
@@ -0,0 +1,342 @@
+import logging
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+############################################
+# Feedback read caching
+
+
+def _max_on(*values: datetime) -> datetime:
+    """ The latest of timestamps ignoring None ones """
+    return max((v for v in values if v is not None), default=None)
+
+
+def _sizeof(items: list) -> int:
+    """ Approximate memory size of list of DTOs in bytes """
+    res: int = sys.getsizeof(items)
+    for o in items:
+        values: dict = o.__dict__
+        res += sys.getsizeof(o) + sys.getsizeof(values) + \
+            sum(sys.getsizeof(v) for v in values.values())
+    return res
+
+
+# in-memory version counters of message log content per
+# (category_id, study_id), None in key means any category or study,
+# so a query without filters has own version too. Versions are used to
+# build ETag values, epoch is regenerated on start so tags issued by
+# previous process never match
+class LogVersions:
+    def __init__(self):
+        self._epoch: str = uuid.uuid4().hex[:8]
+        self._versions: dict[tuple[int, int], int] = {}
+        # category wide changes, None key is bumped by any category
+        self._categories: dict[int, int] = {}
+        self._version_all: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def bump(self, category_id: int, study_id: int):
+        """ Register change of messages in (category_id, study_id) """
+        with self._lock:
+            for key in {(category_id, study_id), (category_id, None),
+                        (None, study_id), (None, None)}:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def bump_all(self):
+        """ Register change which can affect any message """
+        with self._lock:
+            self._version_all += 1
+
+    def bump_category(self, category_id: int):
+        """ Register change of messages in any study of category """
+        with self._lock:
+            for key in {category_id, None}:
+                self._categories[key] = self._categories.get(key, 0) + 1
+
+    def get(self, category_id: int = None, study_id: int = None) -> str:
+        """ Get version of messages selected by category_id and study_id
+        filter, None means no filter """
+        with self._lock:
+            return f"{self._epoch}-{self._version_all}" \
+                   f"-{self._categories.get(category_id, 0)}" \
+                   f"-{self._versions.get((category_id, study_id), 0)}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._versions),
+                "categories": len(self._categories),
+            }
+
+
+# LRU cache of message log query results with memory budget, entries
+# are stored with log version at the time query was started, so stale
+# ones are detected on lookup, including results of queries that were
+# running while messages changed
+class LogCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self._entries: OrderedDict = OrderedDict()
+        self._max_bytes: int = max(0, max_bytes)
+        self._bytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._count_hits: int = 0
+        self._count_misses: int = 0
+        self._count_evicted: int = 0
+        self._count_invalidated: int = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get(self, key: tuple, version: str) -> list:
+        """ Get cached result by key if it matches current version """
+        with self._lock:
+            entry: tuple[str, list, int] = self._entries.get(key)
+            if entry is not None and entry[0] != version:
+                self._remove(key)
+                self._count_invalidated += 1
+                entry = None
+            if entry is None:
+                self._count_misses += 1
+                return None
+            self._count_hits += 1
+            self._entries.move_to_end(key)
+            return list(entry[1])
+
+    def put(self, key: tuple, version: str, items: list):
+        size: int = _sizeof(items)
+        with self._lock:
+            self._remove(key)
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (version, list(items), size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._count_evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hits": self._count_hits,
+                "misses": self._count_misses,
+                "evicted": self._count_evicted,
+                "invalidated": self._count_invalidated,
+            }
+
+    def _remove(self, key: tuple):
+        entry: Any = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
+class _Flight:
+    def __init__(self):
+        self.done: threading.Event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+# coalesces identical concurrent calls, the first caller for a key runs
+# the function and others wait and share its result or exception
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[Any, _Flight] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._count_calls: int = 0
+        self._count_coalesced: int = 0
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight: _Flight = self._flights.get(key)
+            leader: bool = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._count_calls += 1
+            else:
+                self._count_coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "calls": self._count_calls,
+                "coalesced": self._count_coalesced,
+            }
+
+
+# fixed size array of (category_id, level_id, message_log_info) entries
+# of one study in insertion order, the oldest entry is overwritten when
+# full and hidden entries are replaced with None in place
+class _Ring:
+    __slots__ = ("slots", "head", "count", "evicted_on")
+
+    def __init__(self, capacity: int):
+        self.slots: list[tuple] = [None] * capacity
+        self.head: int = 0
+        self.count: int = 0
+        # the latest event_on of overwritten entries, rows after it are
+        # all in the ring
+        self.evicted_on: datetime = None
+
+    def append(self, entry: tuple) -> bool:
+        """ :return: True if visible entry was overwritten """
+        old: tuple = self.slots[self.head]
+        self.slots[self.head] = entry
+        self.head = (self.head + 1) % len(self.slots)
+        if old is None:
+            self.count += 1
+            return False
+        self.evicted_on = _max_on(self.evicted_on, old[2].event_on)
+        return True
+
+    def remove(self, ids: set) -> int:
+        res: int = 0
+        for i, entry in enumerate(self.slots):
+            if entry is not None and entry[2].id in ids:
+                self.slots[i] = None
+                self.count -= 1
+                res += 1
+        return res
+
+
+# bounded in-memory copy of recently written visible messages kept per
+# study, so "last N minutes" message log queries are answered without DB.
+# Query is served only when buffer is known to have all matching rows,
+# i.e. interval is within horizon and starts after the buffer was reset
+# and after event_on of any row dropped due to memory caps. Messages are
+# expected to be written by this process with event_on not in future
+class RecentLogBuffer:
+    def __init__(self, horizon_sec: int = 900, study_max_rows: int = 2000,
+                 max_studies: int = 256):
+        self._horizon_sec: int = max(0, horizon_sec)
+        self._study_max_rows: int = max(1, study_max_rows)
+        self._max_studies: int = max(1, max_studies)
+        self._rings: OrderedDict = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._started_on: datetime = datetime.now()
+        # the latest event_on of rows of dropped studies
+        self._dropped_on: datetime = None
+        self._count_hits: int = 0
+        self._count_misses: int = 0
+        self._count_evicted: int = 0
+        self._count_dropped: int = 0
+
+    def add(self, entries: list[tuple]):
+        """ Add visible messages as (category_id, level_id,
+        message_log_info) tuples """
+        with self._lock:
+            for entry in entries:
+                study_id: int = entry[2].study_id
+                ring: _Ring = self._rings.get(study_id)
+                if ring is None:
+                    ring = self._rings[study_id] = \
+                        _Ring(self._study_max_rows)
+                    self._drop_studies()
+                else:
+                    self._rings.move_to_end(study_id)
+                if ring.append(entry):
+                    self._count_evicted += 1
+
+    def get(self, category_id: int, study_id: int,
+            interval_sec: int, limit: int = 10000) -> list:
+        """ Get messages of the last interval_sec ordered by event_on and
+        recorded_on as DB query does, None if buffer can't answer """
+        if not interval_sec or not 0 < interval_sec <= self._horizon_sec:
+            return None
+        start_event_on: datetime = \
+            datetime.now() - timedelta(seconds=interval_sec)
+        with self._lock:
+            rings: list[_Ring] = list(self._rings.values()) \
+                if study_id is None else \
+                [o for o in [self._rings.get(study_id)] if o is not None]
+            complete_on: datetime = _max_on(
+                self._started_on, self._dropped_on,
+                *[o.evicted_on for o in rings])
+            if start_event_on < complete_on:
+                self._count_misses += 1
+                return None
+            self._count_hits += 1
+            res: list = [
+                entry[2] for ring in rings for entry in ring.slots
+                if entry is not None
+                if category_id is None or entry[0] == category_id
+                if entry[2].event_on >= start_event_on
+            ]
+        res.sort(key=lambda o: (o.event_on, o.recorded_on, o.id))
+        return res[:limit]
+
+    def load(self, entries: list[tuple], started_on: datetime):
+        """ Reset buffer to entries read from DB ordered by event_on,
+        which include all visible messages after started_on """
+        self.reset()
+        with self._lock:
+            self._started_on = started_on
+        self.add(entries)
+
+    def remove(self, ids: list[int]) -> int:
+        """ Remove hidden messages by IDs """
+        ids_set: set = set(ids)
+        with self._lock:
+            return sum(ring.remove(ids_set)
+                       for ring in self._rings.values())
+
+    def reset(self):
+        """ Forget all messages, e.g. after bulk visibility change, so
+        only intervals started after reset are served """
+        with self._lock:
+            self._rings.clear()
+            self._started_on = datetime.now()
+            self._dropped_on = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total: int = self._count_hits + self._count_misses
+            return {
+                "studies": len(self._rings),
+                "rows": sum(o.count for o in self._rings.values()),
+                "horizon_sec": self._horizon_sec,
+                "study_max_rows": self._study_max_rows,
+                "max_studies": self._max_studies,
+                "hits": self._count_hits,
+                "misses": self._count_misses,
+                "hit_ratio": round(self._count_hits / total, 4)
+                if total else 0.0,
+                "evicted": self._count_evicted,
+                "dropped": self._count_dropped,
+            }
+
+    def _drop_studies(self):
+        while len(self._rings) > self._max_studies:
+            _, ring = self._rings.popitem(last=False)
+            self._count_dropped += 1
+            self._dropped_on = _max_on(
+                self._dropped_on, ring.evicted_on,
+                *[o[2].event_on for o in ring.slots if o is not None])
@@ -0,0 +1,345 @@
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Callable, Iterator, Type
+
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import ListError
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+# Compact binary wire format support. Lists of DTOs are encoded in
+# column-oriented layout, i.e. {"columns": [...], "data": [[...], ...]}
+# where data contains one list of values per column, so field names are
+# not repeated per row
+
+MSGPACK_MEDIA_TYPE: str = "application/msgpack"
+MSGPACK_MEDIA_TYPES: tuple = (MSGPACK_MEDIA_TYPE,
+                              "application/x-msgpack",
+                              "application/vnd.msgpack")
+
+# streaming export formats and their media types
+EXPORT_MEDIA_TYPES: dict[str, str] = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+# Arrow IPC stream and Parquet export formats
+ARROW_MEDIA_TYPES: dict[str, str] = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _csv_value(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Enum):
+        return v.value
+    return v
+
+
+def _default(o: Any) -> Any:
+    # keep the same datetime representation as in JSON responses
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Enum):
+        return o.value
+    if isinstance(o, BaseModel):
+        return o.dict()
+    raise TypeError(f"Can't encode object of type {type(o).__name__}")
+
+
+def _export_arrow(batches: Iterator, schema, fmt: str) -> Iterator[bytes]:
+    sink: _ChunkSink = _ChunkSink()
+    writer = pyarrow.ipc.new_stream(sink, schema) if fmt == "arrow" \
+        else pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for batch in batches:
+            # Parquet row group is written per batch
+            writer.write_batch(batch)
+            chunk: bytes = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def _export_rows(batches: Iterator[list[BaseModel]], fmt: str,
+                 model: Type[BaseModel]) -> Iterator[str]:
+    columns: list[str] = list(model.__fields__.keys())
+    if fmt == "csv":
+        buf: io.StringIO = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows([[_csv_value(getattr(o, c)) for c in columns]
+                              for o in batch])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            # header only, no rows
+            yield buf.getvalue()
+        return
+    if fmt == "ndjson":
+        for batch in batches:
+            yield "".join(json.dumps(o.dict(), default=_default) + "\n"
+                          for o in batch)
+        return
+    sep: str = ""
+    yield "["
+    for batch in batches:
+        if batch:
+            yield sep + ",".join(json.dumps(o.dict(), default=_default)
+                                 for o in batch)
+            sep = ","
+    yield "]"
+
+
+def _media_types(value: str) -> list[str]:
+    res: list[str] = []
+    for item in value.split(","):
+        parts: list[str] = [p.strip() for p in item.split(";")]
+        if any(p.replace(" ", "") in ("q=0", "q=0.0") for p in parts[1:]):
+            continue
+        res.append(parts[0].lower())
+    return res
+
+
+def accepts_msgpack(request: Request) -> bool:
+    """ Check if client asked for MessagePack response via Accept header,
+    JSON is used by default """
+    if msgpack is None:
+        return False
+    accept: str = request.headers.get("accept")
+    if not accept:
+        return False
+    return any(t in MSGPACK_MEDIA_TYPES for t in _media_types(accept))
+
+
+def body_list(model: Type[BaseModel]) -> Callable:
+    """ Create dependency to read list of DTOs from JSON or MessagePack
+    request body, MessagePack body can be in column-oriented layout """
+
+    async def _body_list(request: Request) -> list[BaseModel]:
+        body: bytes = await request.body()
+        if is_msgpack(request):
+            data: Any = unpack_rows(unpack(body))
+        else:
+            try:
+                data = json.loads(body)
+            except json.JSONDecodeError as e:
+                raise RequestValidationError(
+                    [ErrorWrapper(e, ("body", e.pos))], body=e.doc)
+        if not isinstance(data, list):
+            raise RequestValidationError([ErrorWrapper(ListError(),
+                                                       ("body",))])
+        items: list[BaseModel] = []
+        errors: list[ErrorWrapper] = []
+        for index, item in enumerate(data):
+            try:
+                items.append(model.parse_obj(item))
+            except ValidationError as e:
+                errors.append(ErrorWrapper(e, ("body", index)))
+        if errors:
+            raise RequestValidationError(errors)
+        return items
+
+    return _body_list
+
+
+def body_list_openapi(model: Type[BaseModel]) -> dict:
+    """ OpenAPI request body spec for body_list dependency """
+    schema: dict = {"type": "array", "items": model.schema()}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": schema},
+                MSGPACK_MEDIA_TYPE: {"schema": schema},
+            }
+        }
+    }
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """ Check if If-None-Match request header matches ETag value,
+    weak comparison is used as for GET requests """
+    value: str = request.headers.get("if-none-match")
+    if not value:
+        return False
+    if value.strip() == "*":
+        return True
+    tags: list[str] = [t.strip().removeprefix("W/") for t in value.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+def export_arrow(batches: Iterator, schema, fmt: str) -> Iterator[bytes]:
+    """ Encode Arrow record batches as Arrow IPC stream or Parquet file,
+    bytes written for each batch are produced as one chunk, so only one
+    batch is kept in memory """
+    if fmt not in ARROW_MEDIA_TYPES:
+        raise ValueError(f"Invalid export format: {fmt}")
+    if pyarrow is None:
+        raise ImportError("Arrow support requires pyarrow, install it "
+                          "with: pip install repromon[arrow]")
+    return _export_arrow(batches, schema, fmt)
+
+
+def export_rows(batches: Iterator[list[BaseModel]], fmt: str,
+                model: Type[BaseModel]) -> Iterator[str]:
+    """ Encode batches of DTOs as CSV with header, NDJSON or JSON array,
+    one text chunk is produced per batch, so only one batch is kept in
+    memory """
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise ValueError(f"Invalid export format: {fmt}")
+    return _export_rows(batches, fmt, model)
+
+
+def is_msgpack(request: Request) -> bool:
+    """ Check if request body is MessagePack encoded """
+    content_type: str = request.headers.get("content-type")
+    if not content_type:
+        return False
+    return _media_types(content_type)[0] in MSGPACK_MEDIA_TYPES
+
+
+def negotiate(request: Request, content: Any,
+              model: Type[BaseModel] = None,
+              status_code: int = status.HTTP_200_OK,
+              response: Response = None,
+              prepared: bool = False) -> Any:
+    """ Encode response content as MessagePack when client accepts it,
+    otherwise content is returned as is to be rendered as JSON. Headers
+    set on injected response are kept for MessagePack response too
+
+    :param prepared: content is built from already validated DTOs, so
+                     it is rendered as JSON here, for routes without
+                     response model validation
+    """
+    if not accepts_msgpack(request):
+        if prepared:
+            return PreparedJSONResponse(content, status_code=status_code,
+                                        headers=dict(response.headers)
+                                        if response else None)
+        return content
+    if isinstance(content, list):
+        content = pack_columns(content, model)
+    return MsgpackResponse(content, status_code=status_code,
+                           headers=dict(response.headers)
+                           if response else None)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={"ETag": etag})
+
+
+def pack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+def pack_columns(items: list[BaseModel], model: Type[BaseModel]) -> dict:
+    """ Convert list of DTOs to column-oriented layout """
+    columns: list[str] = list(model.__fields__.keys())
+    rows: list[dict] = [o if isinstance(o, dict) else o.dict()
+                        for o in items]
+    return {
+        "columns": columns,
+        "data": [[row.get(c) for row in rows] for c in columns]
+    }
+
+
+def unpack(body: bytes) -> Any:
+    """ Decode MessagePack body, msgpack timestamps are returned as
+    timezone aware datetime """
+    if msgpack is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="MessagePack encoding is not supported"
+        )
+    try:
+        return msgpack.unpackb(body, raw=False, timestamp=3)
+    except BaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid MessagePack body: {str(e)}")
+
+
+def unpack_rows(data: Any) -> Any:
+    """ Convert column-oriented layout back to list of dicts, other
+    values are returned as is """
+    if not isinstance(data, dict) or "columns" not in data:
+        return data
+    columns: list[str] = data["columns"]
+    values: list[list] = data.get("data") or []
+    if len(values) != len(columns):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Column count mismatch in data")
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+# JSON response of already validated DTOs rendered without FastAPI
+# response model validation, datetime representation is the same
+class PreparedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return json.dumps(content, default=_default, ensure_ascii=False,
+                          allow_nan=False, indent=None,
+                          separators=(",", ":")).encode("utf-8")
+
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return pack(content)
+
+
+# write-only file object collecting written bytes until taken, position
+# is kept over takes, so writers relying on tell() produce valid files
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._pos: int = 0
+
+    def take(self) -> bytes:
+        res: bytes = b"".join(self._chunks)
+        self._chunks.clear()
+        return res
+
+    def tell(self) -> int:
+        return self._pos
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data: bytes = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
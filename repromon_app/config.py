@@ -24,11 +24,95 @@ class DbConfig(BaseSectionConfig):
 
     url: str = None
     arg_schema: str = None
+    # reference data registry TTL in seconds, 0 means no expiration
+    arg_ref_data_ttl_sec: int = 300
     echo: bool = False
     pool_size: int = 5
     pool_recycle: int = 3600
 
 
+class FeedbackConfig(BaseSectionConfig):
+    """Feedback read path configuration under [feedback] section"""
+
+    # in-process message log query result cache, memory budget in bytes,
+    # requires single writer process: writes of other workers do not
+    # invalidate it and stale results are served; message log ETag is
+    # issued only when it is enabled for the same reason
+    cache_enabled: bool = False
+    cache_max_bytes: int = 64 * 1024 * 1024
+    # in-memory per study ring buffer of recent messages serving
+    # interval queries up to buffer_horizon_sec, requires single writer
+    # process as cache does: messages of other workers are never seen
+    buffer_enabled: bool = False
+    buffer_horizon_sec: int = 900
+    buffer_study_max_rows: int = 2000
+    buffer_max_studies: int = 256
+    # rows fetched from DB cursor per chunk of streaming export
+    export_batch_size: int = 1000
+    # rows per Arrow record batch and Parquet row group of Arrow export
+    export_arrow_batch_size: int = 50000
+    # hot table of visible messages of the last recent_hours, 0 - disabled
+    recent_hours: int = 0
+    recent_prune_interval_sec: int = 60
+    # get_message_log_delta watermark is moved back by this overlap, so
+    # rows committed out of ID order are returned again, not lost
+    delta_overlap_sec: int = 5
+
+
+class IngestConfig(BaseSectionConfig):
+    """Message ingest pipeline configuration under [ingest] section"""
+
+    # write-behind queue, when enabled send_message only enqueues
+    # messages and background writer commits them in batches
+    queue_enabled: bool = False
+    queue_max_size: int = 10000
+    batch_max_size: int = 500
+    batch_linger_ms: int = 5
+    # NDJSON stream ingest micro-batch size and max line length in bytes
+    stream_batch_size: int = 100
+    stream_max_line_size: int = 65536
+    # max number of recently used idempotency keys kept in memory
+    recent_keys_max_size: int = 100000
+    # durable disk spool used when DB is unavailable or slow
+    spool_enabled: bool = False
+    spool_path: str = None
+    spool_segment_max_bytes: int = 16 * 1024 * 1024
+    spool_fsync: str = "interval"
+    spool_fsync_interval_ms: int = 1000
+    spool_latency_threshold_ms: int = 1000
+    spool_replay_batch_size: int = 500
+    spool_replay_interval_ms: int = 1000
+    # per user token bucket rate limit, messages per second and burst
+    rate_limit_enabled: bool = False
+    rate_limit_rate: float = 100
+    rate_limit_burst: float = 200
+    rate_limit_roles: str = None
+    rate_limit_users: str = None
+    # local Unix socket/UDP listener for length-prefixed message frames
+    listener_enabled: bool = False
+    listener_socket_path: str = None
+    listener_udp_host: str = "127.0.0.1"
+    listener_udp_port: int = 0
+    listener_max_frame_size: int = 65536
+
+
+class MaintenanceConfig(BaseSectionConfig):
+    """Background DB maintenance configuration under [maintenance] section"""
+
+    # Postgres message_log range partitions on event_on, interval is
+    # month or week, retention 0 means partitions are never dropped
+    partition_enabled: bool = False
+    partition_interval: str = "month"
+    partition_premake: int = 3
+    partition_retention_days: int = 0
+    partition_run_interval_sec: int = 3600
+    # message_log archive of Parquet files, rows older than age are moved
+    # there by repromon_tools archive_messages job
+    archive_path: str = None
+    archive_age_days: int = 365
+    archive_batch_size: int = 10000
+
+
 class SettingsConfig(BaseSectionConfig):
     """Basic configuration for [system] section"""
 
@@ -81,6 +165,9 @@ class AppConfig:
     SECTION_SETTINGS = "settings"
     SECTION_UVICORN = "uvicorn"
     SECTION_DB = "db"
+    SECTION_FEEDBACK = "feedback"
+    SECTION_INGEST = "ingest"
+    SECTION_MAINTENANCE = "maintenance"
 
     # AppConfig members
     def __init__(self):
@@ -92,6 +179,9 @@ class AppConfig:
         self.settings: SettingsConfig = SettingsConfig()
         self.uvicorn: UvicornConfig = UvicornConfig()
         self.db: DbConfig = DbConfig()
+        self.feedback: FeedbackConfig = FeedbackConfig()
+        self.ingest: IngestConfig = IngestConfig()
+        self.maintenance: MaintenanceConfig = MaintenanceConfig()
 
     def to_dict(self):
         return {
@@ -103,6 +193,9 @@ class AppConfig:
             "[settings]": self.settings.dict(),
             "[db]": self.db.dict(),
             "[uvicorn]": self.uvicorn.dict(),
+            "[feedback]": self.feedback.dict(),
+            "[ingest]": self.ingest.dict(),
+            "[maintenance]": self.maintenance.dict(),
         }
 
 
@@ -203,6 +296,13 @@ def app_config_init() -> None:
             cfg.settings = SettingsConfig(**cp[AppConfig.SECTION_SETTINGS])
             cfg.uvicorn = UvicornConfig(**cp[AppConfig.SECTION_UVICORN])
             cfg.db = DbConfig(**cp[AppConfig.SECTION_DB])
+            if cp.has_section(AppConfig.SECTION_FEEDBACK):
+                cfg.feedback = FeedbackConfig(**cp[AppConfig.SECTION_FEEDBACK])
+            if cp.has_section(AppConfig.SECTION_INGEST):
+                cfg.ingest = IngestConfig(**cp[AppConfig.SECTION_INGEST])
+            if cp.has_section(AppConfig.SECTION_MAINTENANCE):
+                cfg.maintenance = MaintenanceConfig(
+                    **cp[AppConfig.SECTION_MAINTENANCE])
 
             break
 
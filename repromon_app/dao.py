@@ -1,14 +1,34 @@
+import heapq
+import itertools
+import json
 import logging
+import os
+import re
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Iterator
 
-from sqlalchemy.sql import func, text
+from sqlalchemy import TIMESTAMP, Integer, String, insert
+from sqlalchemy.sql import bindparam, column, func, text
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
 
 from repromon_app.model import (BaseDTO, DataProviderEntity, DeviceEntity,
-                                MessageLevelEntity, MessageLogEntity,
-                                MessageLogInfoDTO, RoleEntity, RoleInfoDTO,
-                                SecUserDeviceEntity, SecUserRoleEntity,
-                                StudyDataEntity, StudyInfoDTO, UserEntity,
-                                UserInfoDTO)
+                                MessageCategoryEntity, MessageLevelEntity,
+                                MessageLogClientKeyEntity, MessageLogEntity,
+                                MessageLogInfoDTO, MessageLogRecentEntity,
+                                RoleEntity, RoleInfoDTO, SecUserDeviceEntity,
+                                SecUserRoleEntity, StudyDataEntity,
+                                StudyInfoDTO, UserEntity, UserInfoDTO)
 
 logger = logging.getLogger(__name__)
 logger.debug(f"name={__name__}")
@@ -18,6 +38,15 @@ logger.debug(f"name={__name__}")
 # DAO
 
 
+def _construct(cls, values: dict):
+    """ Create pydantic DTO from trusted values without validation, like
+    construct() but values must have all fields of right types """
+    o = cls.__new__(cls)
+    object.__setattr__(o, "__dict__", values)
+    object.__setattr__(o, "__fields_set__", set(values))
+    return o
+
+
 def _dto(cls, proxy):
     if proxy:
         return cls.parse_obj(proxy._mapping)
@@ -36,6 +65,68 @@ def _list_scalar(cls, proxy):
     return []
 
 
+def _batches(items: Iterator, size: int) -> Iterator[list]:
+    """ Split iterator into lists of up to size items """
+    it: Iterator = iter(items)
+    while batch := list(itertools.islice(it, size)):
+        yield batch
+
+
+def _int_list(values: list[int]) -> str:
+    """ Format list of integers to be used in SQL "in" condition """
+    return ", ".join(str(int(v)) for v in values)
+
+
+def message_log_schema(columns: list[str] = None):
+    """ Arrow schema of message_log columns, all columns by default
+
+    :raise ImportError: if pyarrow is not installed
+    :raise ValueError: on unknown column name
+    """
+    if pyarrow is None:
+        raise ImportError("Arrow support requires pyarrow, install it "
+                          "with: pip install repromon[arrow]")
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("level_id", pyarrow.int32()),
+        ("category_id", pyarrow.int32()),
+        ("device_id", pyarrow.int32()),
+        ("provider_id", pyarrow.int32()),
+        ("study_id", pyarrow.int32()),
+        ("study_name", pyarrow.string()),
+        ("is_visible", pyarrow.string()),
+        ("visible_updated_on", pyarrow.timestamp("us")),
+        ("visible_updated_by", pyarrow.string()),
+        ("description", pyarrow.string()),
+        ("payload", pyarrow.string()),
+        ("event_on", pyarrow.timestamp("us")),
+        ("registered_on", pyarrow.timestamp("us")),
+        ("recorded_on", pyarrow.timestamp("us")),
+        ("recorded_by", pyarrow.string()),
+        ("client_key", pyarrow.string()),
+    ])
+    if not columns:
+        return schema
+    unknown: list[str] = [c for c in columns if c not in schema.names]
+    if unknown:
+        raise ValueError(f"Unknown message_log columns: {', '.join(unknown)}")
+    return pyarrow.schema([schema.field(c) for c in columns])
+
+
+def _message_log_filter(category_id: int, study_id: int,
+                        start_event_on: datetime) -> str:
+    """ Message log filter with conditions for specified parameters
+    only, so query planner can match them to composite indexes """
+    conditions: list[str] = ["1 = 1"]
+    if study_id is not None:
+        conditions.append("ml.study_id = :study_id")
+    if category_id is not None:
+        conditions.append("ml.category_id = :category_id")
+    if start_event_on is not None:
+        conditions.append("ml.event_on >= :start_event_on")
+    return " and ".join(conditions)
+
+
 def _scalar(cls, proxy):
     if proxy:
         return cls(proxy[0])
@@ -44,6 +135,94 @@ def _scalar(cls, proxy):
 
 _prefix_: str = ''
 
+# typed result columns of message log info queries, so DB values are
+# converted to field types, e.g. SQLite timestamps stored as text, and
+# rows can be mapped to DTOs without validation
+_MESSAGE_LOG_INFO_COLUMNS: list = [
+    column("study", String) if c == "study"
+    else MessageLogEntity.__table__.c[c]
+    for c in ("id", "study_id", "study", "event_on", "registered_on",
+              "recorded_on", "recorded_by", "category_id", "level_id",
+              "device_id", "provider_id", "description", "client_key")
+]
+
+
+class RefData:
+    """Immutable snapshot of reference data tables: message_category,
+    message_level, device and data_provider, entities are detached copies
+    """
+
+    def __init__(self, version: int,
+                 categories: list[MessageCategoryEntity],
+                 devices: list[DeviceEntity],
+                 levels: list[MessageLevelEntity],
+                 providers: list[DataProviderEntity]):
+        self.version: int = version
+        self.loaded_on: datetime = datetime.now()
+        self.loaded_at: float = time.monotonic()
+        self.categories: list[MessageCategoryEntity] = categories
+        self.devices: list[DeviceEntity] = devices
+        self.levels: list[MessageLevelEntity] = levels
+        self.providers: list[DataProviderEntity] = providers
+        self._category_names: dict = {o.id: o.category for o in categories}
+        self._device_kinds: dict = {o.id: o.kind for o in devices}
+        self._level_names: dict = {o.id: o.level for o in levels}
+        self._provider_names: dict = {o.id: o.provider for o in providers}
+
+    def category_name(self, category_id: int) -> str:
+        return self._category_names.get(category_id)
+
+    def device_kind(self, device_id: int) -> str:
+        return self._device_kinds.get(device_id)
+
+    def parse_device(self, v: str) -> int:
+        """ Resolve device ID or kind, e.g. "MRI", to device ID, kind
+        must be unique """
+        if v.isdigit():
+            if int(v) not in self._device_kinds:
+                raise ValueError(f"'{v}' is not a valid device ID")
+            return int(v)
+        ids: list[int] = [k for k, kind in self._device_kinds.items()
+                          if kind.upper() == v.upper()]
+        if not ids:
+            raise ValueError(f"'{v}' is not a valid device")
+        if len(ids) > 1:
+            raise ValueError(f"'{v}' device is ambiguous, use device ID")
+        return ids[0]
+
+    def level_name(self, level_id: int) -> str:
+        return self._level_names.get(level_id)
+
+    def provider_name(self, provider_id: int) -> str:
+        return self._provider_names.get(provider_id)
+
+    def message_log_info(self, row,
+                         trusted: bool = False) -> MessageLogInfoDTO:
+        """ Map message_log row to info DTO resolving reference names
+
+        :param trusted: skip validation, row values must have field
+                        types, e.g. row of _MESSAGE_LOG_INFO_COLUMNS
+        """
+        values: dict = {
+            "id": row.id,
+            "study_id": row.study_id,
+            "study": row.study,
+            "event_on": row.event_on,
+            "registered_on": row.registered_on,
+            "recorded_on": row.recorded_on,
+            "recorded_by": row.recorded_by,
+            "category": self._category_names.get(row.category_id),
+            "level": self._level_names.get(row.level_id),
+            "device_id": row.device_id,
+            "device": self._device_kinds.get(row.device_id),
+            "provider": self._provider_names.get(row.provider_id),
+            "description": row.description,
+            "client_key": row.client_key,
+        }
+        if trusted:
+            return _construct(MessageLogInfoDTO, values)
+        return MessageLogInfoDTO(**values)
+
 
 class BaseDAO:
     """Base class for all DAO objects"""
@@ -57,6 +236,10 @@ class BaseDAO:
     def add(self, o: BaseDTO):
         return self.session().add(o)
 
+    def begin_nested(self):
+        """ Begin SAVEPOINT, to be used as context manager """
+        return self.session().begin_nested()
+
     def commit(self):
         self.session().commit()
 
@@ -69,6 +252,9 @@ class BaseDAO:
     def flush(self):
         self.session().flush()
 
+    def rollback(self):
+        self.session().rollback()
+
     @classmethod
     def set_default_schema(cls, db_schema: str):
         if db_schema is not None and len(db_schema) > 0:
@@ -224,28 +410,402 @@ class AccountDAO(BaseDAO):
         return o
 
 
+# Message archive DAO, old message_log rows are kept in zstd compressed
+# Parquet files under month=YYYY-MM/study=<study_id or none> folders,
+# and _boundary.json holds event_on boundary, rows before it can be in
+# archive only. Archive is read-only and requires optional pyarrow
+class ArchiveDAO(BaseDAO):
+    BOUNDARY_FILE: str = "_boundary.json"
+    path: str = None
+
+    def __init__(self):
+        pass
+
+    def add_message_logs(self, rows: list[dict]) -> list[str]:
+        """ Write message_log rows to new archive files, one per month
+        and study
+
+        :return: list of written file paths
+        """
+        groups: dict[tuple[str, str], list[dict]] = {}
+        for row in rows:
+            groups.setdefault((f"{row['event_on']:%Y-%m}",
+                               str(row["study_id"])
+                               if row["study_id"] is not None else "none"),
+                              []).append(row)
+        res: list[str] = []
+        for (month, study), items in sorted(groups.items()):
+            folder: str = os.path.join(ArchiveDAO.path, f"month={month}",
+                                       f"study={study}")
+            os.makedirs(folder, exist_ok=True)
+            name: str = f"part-{uuid.uuid4().hex}.parquet"
+            # files starting with "." are not visible to readers
+            # until they are complete
+            tmp_path: str = os.path.join(folder, f".{name}")
+            pyarrow.parquet.write_table(
+                pyarrow.Table.from_pylist(
+                    [{**o, "payload": json.dumps(o["payload"])
+                      if o["payload"] is not None else None}
+                     for o in items],
+                    schema=message_log_schema()),
+                tmp_path, compression="zstd")
+            os.replace(tmp_path, os.path.join(folder, name))
+            res.append(os.path.join(folder, name))
+        return res
+
+    def get_boundary(self) -> datetime:
+        """ Get archive boundary, None if archive is not used """
+        if not self.is_enabled():
+            return None
+        try:
+            with open(os.path.join(ArchiveDAO.path,
+                                   ArchiveDAO.BOUNDARY_FILE)) as f:
+                return datetime.fromisoformat(json.load(f)["boundary"])
+        except FileNotFoundError:
+            return None
+
+    def get_message_log_infos(self, category_id: int,
+                              study_id: int,
+                              start_event_on: datetime,
+                              limit: int = 10000) -> list[MessageLogInfoDTO]:
+        """ Get first visible archived message log rows ordered by
+        event_on and recorded_on, filters are pushed down to Parquet
+        reader and month/study folders, months are read in ascending
+        order until limit is reached """
+        start_month: str = f"{start_event_on:%Y-%m}" \
+            if start_event_on is not None else ""
+        months: list[str] = [o for o in self._months() if o >= start_month]
+        dataset = self._dataset()
+        f = self._filter(category_id, study_id, start_event_on)
+        ref: RefData = DAO.ref_data.get_ref_data()
+        res: list[MessageLogInfoDTO] = []
+        for month in months:
+            if len(res) >= limit:
+                break
+            table = dataset.to_table(
+                columns=message_log_schema().names,
+                filter=f & (pyarrow.dataset.field("month") == month))
+            table = table.sort_by([("event_on", "ascending"),
+                                   ("recorded_on", "ascending")]
+                                  ).slice(0, limit - len(res))
+            res += [ref.message_log_info(
+                SimpleNamespace(**o, study=o["study_name"]))
+                for o in table.to_pylist()]
+        return res
+
+    def iter_message_log_batches(self, columns: list[str],
+                                 category_id: int,
+                                 study_id: int,
+                                 start_event_on: datetime,
+                                 end_event_on: datetime,
+                                 visible_only: bool,
+                                 late,
+                                 batch_size: int):
+        """ Iterate over archived message_log rows as Arrow record
+        batches of specified columns, month by month ordered by event_on,
+        filters are pushed down to Parquet reader and month folders
+
+        :param late: Arrow table of all DB rows before archive boundary,
+                     they replace archived rows with the same ID
+        """
+        start_month: str = f"{start_event_on:%Y-%m}" \
+            if start_event_on is not None else ""
+        late_months = pyarrow.compute.strftime(late["event_on"],
+                                               format="%Y-%m")
+        months: set[str] = {o for o in self._months() if o >= start_month}
+        months.update(late_months.unique().to_pylist())
+        dataset = self._dataset()
+        f = self._filter(category_id, study_id, start_event_on,
+                         end_event_on, visible_only)
+        names: list[str] = message_log_schema().names
+        for month in sorted(months):
+            table = dataset.to_table(
+                columns=names,
+                filter=f & (pyarrow.dataset.field("month") == month))
+            table_late = late.filter(
+                pyarrow.compute.equal(late_months, month))
+            table = table.filter(pyarrow.compute.invert(
+                pyarrow.compute.is_in(table["id"],
+                                      value_set=table_late["id"])))
+            if visible_only:
+                table_late = table_late.filter(
+                    pyarrow.compute.equal(table_late["is_visible"], "Y"))
+            table = pyarrow.concat_tables([table, table_late]).sort_by(
+                [("event_on", "ascending"), ("recorded_on", "ascending"),
+                 ("id", "ascending")])
+            yield from table.select(columns).to_batches(batch_size)
+
+    def iter_message_log_infos(self, category_id: int,
+                               study_id: int,
+                               start_event_on: datetime,
+                               batch_size: int = 1000
+                               ) -> Iterator[list[MessageLogInfoDTO]]:
+        """ Iterate over visible archived message log rows in batches
+        ordered by event_on and recorded_on, only one month of matching
+        rows is read in memory at a time """
+        start_month: str = f"{start_event_on:%Y-%m}" \
+            if start_event_on is not None else ""
+        months: list[str] = [o for o in self._months() if o >= start_month]
+        dataset = self._dataset()
+        f = self._filter(category_id, study_id, start_event_on)
+        ref: RefData = DAO.ref_data.get_ref_data()
+        for month in months:
+            table = dataset.to_table(
+                columns=message_log_schema().names,
+                filter=f & (pyarrow.dataset.field("month") == month))
+            table = table.sort_by([("event_on", "ascending"),
+                                   ("recorded_on", "ascending")])
+            for batch in table.to_batches(batch_size):
+                yield [ref.message_log_info(
+                    SimpleNamespace(**o, study=o["study_name"]))
+                    for o in batch.to_pylist()]
+
+    def is_enabled(self) -> bool:
+        return pyarrow is not None and bool(ArchiveDAO.path)
+
+    def set_boundary(self, boundary: datetime):
+        path: str = os.path.join(ArchiveDAO.path, ArchiveDAO.BOUNDARY_FILE)
+        os.makedirs(ArchiveDAO.path, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"boundary": boundary.isoformat()}, f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def set_path(cls, path: str):
+        cls.path = path
+
+    def _dataset(self):
+        folders = pyarrow.schema([("month", pyarrow.string()),
+                                  ("study", pyarrow.string())])
+        return pyarrow.dataset.dataset(
+            ArchiveDAO.path, format="parquet",
+            schema=pyarrow.unify_schemas([message_log_schema(), folders]),
+            partitioning=pyarrow.dataset.partitioning(folders, flavor="hive"))
+
+    def _filter(self, category_id: int, study_id: int,
+                start_event_on: datetime, end_event_on: datetime = None,
+                visible_only: bool = True):
+        ds = pyarrow.dataset
+        f = ds.field("is_visible") == "Y" if visible_only \
+            else ds.scalar(True)
+        if end_event_on is not None:
+            f = f & (ds.field("month") <= f"{end_event_on:%Y-%m}") & \
+                (ds.field("event_on") < pyarrow.scalar(
+                    end_event_on, type=pyarrow.timestamp("us")))
+        if study_id is not None:
+            f = f & (ds.field("study") == str(study_id))
+        if category_id is not None:
+            f = f & (ds.field("category_id") == category_id)
+        if start_event_on is not None:
+            f = f & (ds.field("month") >= f"{start_event_on:%Y-%m}") & \
+                (ds.field("event_on") >= pyarrow.scalar(
+                    start_event_on, type=pyarrow.timestamp("us")))
+        return f
+
+    def _months(self) -> list[str]:
+        """ Get archived months in YYYY-MM format in ascending order """
+        if not os.path.isdir(ArchiveDAO.path):
+            return []
+        return sorted(o[len("month="):] for o in os.listdir(ArchiveDAO.path)
+                      if o.startswith("month="))
+
+
 # Message system DAO
 class MessageDAO(BaseDAO):
+    # visible rows of the last recent_hours are also kept in
+    # message_log_recent table in the same transaction, 0 - disabled
+    recent_hours: int = 0
+    # map typed message log info rows to DTOs without pydantic
+    # validation, False - validate every row
+    fast_dto: bool = True
+    # idempotency keys are kept in message_log_client_key table only
+    # when message_log is partitioned, unique index of not partitioned
+    # one detects duplicate keys itself, None - not resolved yet
+    client_key_table: bool = None
+
     def __init__(self):
         pass
 
+    def add_message_log_partition(self, name: str, start: datetime,
+                                  end: datetime, default_name: str = None):
+        """ Create message_log partition for [start, end) event_on range,
+        rows of this range are moved from default partition if any,
+        Postgres only
+
+        :param name: partition table name without schema
+        :param default_name: default partition name, None if there is
+                             no default partition
+        """
+        bound: str = f"'{start:%Y-%m-%d %H:%M:%S}'"
+        bound_end: str = f"'{end:%Y-%m-%d %H:%M:%S}'"
+        self.session().execute(text(
+            f"create table {_prefix_}{name} (like {_prefix_}message_log "
+            f"including defaults including constraints)"))
+        if default_name:
+            self.session().execute(text(
+                f"""
+                with moved as (
+                    delete from {_prefix_}{default_name}
+                    where event_on >= {bound} and event_on < {bound_end}
+                    returning *
+                )
+                insert into {_prefix_}{name} select * from moved
+                """))
+        self.session().execute(text(
+            f"alter table {_prefix_}message_log attach partition "
+            f"{_prefix_}{name} for values from ({bound}) to ({bound_end})"))
+
+    def add_message_logs(self, values: list[dict]) -> list[int]:
+        if not values:
+            return []
+        # single multi-row insert, IDs are returned in values order
+        ids: list[int] = list(
+            self.session()
+            .scalars(
+                insert(MessageLogEntity).returning(
+                    MessageLogEntity.id, sort_by_parameter_order=True),
+                values
+            )
+        )
+        # idempotency keys table is not partitioned, so duplicate key
+        # fails the whole insert whatever event_on is
+        keys: list[dict] = [
+            {"recorded_by": v["recorded_by"], "client_key": v["client_key"],
+             "message_id": message_id, "event_on": v["event_on"]}
+            for message_id, v in zip(ids, values) if v.get("client_key")
+        ]
+        if keys and self._use_client_key_table():
+            self.session().execute(insert(MessageLogClientKeyEntity), keys)
+        if MessageDAO.recent_hours > 0:
+            start_event_on: datetime = self._recent_start()
+            columns: list[str] = self._recent_columns()
+            recent: list[dict] = [
+                {"id": message_id, **{c: v.get(c) for c in columns}}
+                for message_id, v in zip(ids, values)
+                if v.get("is_visible", "Y") == "Y"
+                if v["event_on"] >= start_event_on
+            ]
+            if recent:
+                self.session().execute(insert(MessageLogRecentEntity),
+                                       recent)
+        return ids
+
+    def delete_message_logs_before(self, table_name: str,
+                                   event_on: datetime) -> int:
+        """ Delete rows with event_on before specified time from
+        message_log table or its partition """
+        return self.session().execute(
+            text(f"delete from {_prefix_}{table_name} "
+                 f"where event_on < :event_on")
+            .bindparams(bindparam("event_on", event_on, type_=TIMESTAMP))
+        ).rowcount
+
+    def delete_message_log_client_keys_before(self,
+                                              event_on: datetime) -> int:
+        """ Delete idempotency keys of messages with event_on before
+        specified time, e.g. dropped by retention """
+        return self.session().query(MessageLogClientKeyEntity) \
+            .filter(MessageLogClientKeyEntity.event_on < event_on) \
+            .delete(synchronize_session=False)
+
+    def delete_message_logs(self, ids: list[int]) -> int:
+        self.session().query(MessageLogClientKeyEntity) \
+            .filter(MessageLogClientKeyEntity.message_id.in_(ids)) \
+            .delete(synchronize_session=False)
+        if MessageDAO.recent_hours > 0:
+            self.session().query(MessageLogRecentEntity) \
+                .filter(MessageLogRecentEntity.id.in_(ids)) \
+                .delete(synchronize_session=False)
+        return self.session().query(MessageLogEntity) \
+            .filter(MessageLogEntity.id.in_(ids)) \
+            .delete(synchronize_session=False)
+
+    def delete_message_logs_recent_before(self, event_on: datetime) -> int:
+        """ Prune message_log_recent rows older than event_on """
+        return self.session().query(MessageLogRecentEntity) \
+            .filter(MessageLogRecentEntity.event_on < event_on) \
+            .delete(synchronize_session=False)
+
+    def drop_message_log_partition(self, name: str):
+        """ Detach message_log partition and drop it, Postgres only """
+        self.session().execute(text(
+            f"alter table {_prefix_}message_log detach partition "
+            f"{_prefix_}{name}"))
+        self.session().execute(text(f"drop table {_prefix_}{name}"))
+
     def get_data_providers(self) -> list[DataProviderEntity]:
         return self.session().query(DataProviderEntity).all()
 
     def get_devices(self) -> list[DeviceEntity]:
         return self.session().query(DeviceEntity).all()
 
+    def get_message_categories(self) -> list[MessageCategoryEntity]:
+        return self.session().query(MessageCategoryEntity).all()
+
     def get_message_levels(self) -> list[MessageLevelEntity]:
         return self.session().query(MessageLevelEntity).all()
 
+    def get_message_log(self, message_id: int) -> MessageLogEntity:
+        return self.session().get(MessageLogEntity, message_id)
+
+    def get_message_log_client_keys(self, client_keys: list[str]
+                                    ) -> list[tuple[str, str, int]]:
+        if not client_keys:
+            return []
+        if not self._use_client_key_table():
+            return [
+                (row[0], row[1], row[2]) for row in
+                self.session()
+                .query(MessageLogEntity.recorded_by,
+                       MessageLogEntity.client_key,
+                       MessageLogEntity.id)
+                .filter(MessageLogEntity.client_key.in_(client_keys))
+                .all()
+            ]
+        return [
+            (row[0], row[1], row[2]) for row in
+            self.session()
+            .query(MessageLogClientKeyEntity.recorded_by,
+                   MessageLogClientKeyEntity.client_key,
+                   MessageLogClientKeyEntity.message_id)
+            .filter(MessageLogClientKeyEntity.client_key.in_(client_keys))
+            .all()
+        ]
+
+    def get_message_log_keys(self, ids: list[int]
+                             ) -> list[tuple[int, int]]:
+        """ Get distinct (category_id, study_id) of messages by IDs """
+        if not ids:
+            return []
+        return [
+            (row[0], row[1]) for row in
+            self.session()
+            .query(MessageLogEntity.category_id,
+                   MessageLogEntity.study_id)
+            .filter(MessageLogEntity.id.in_(ids))
+            .distinct()
+            .all()
+        ]
+
     def get_message_log_infos(self, category_id: int,
                               study_id: int,
-                              interval_sec: int) -> list[MessageLogInfoDTO]:
+                              interval_sec: int,
+                              include_archive: bool = False
+                              ) -> list[MessageLogInfoDTO]:
+        """ Get first visible message log rows ordered by event_on and
+        recorded_on, archive is read only when interval starts before
+        its boundary or, for all rows, when include_archive is set """
         start_event_on: datetime.datetime = \
             (datetime.now() - timedelta(seconds=interval_sec)) \
             if interval_sec else None
-        return _list_dto(
-            MessageLogInfoDTO,
+        # recent table holds visible rows only
+        recent: bool = bool(interval_sec) and \
+            0 < interval_sec <= MessageDAO.recent_hours * 3600
+        table: str = "message_log_recent" if recent else "message_log"
+        visible: str = "" if recent else "and ml.is_visible = 'Y'"
+        ref: RefData = DAO.ref_data.get_ref_data()
+        rows: list[MessageLogInfoDTO] = [
+            ref.message_log_info(r, MessageDAO.fast_dto) for r in
             self.session()
             .execute(
                 text(
@@ -258,40 +818,270 @@ class MessageDAO(BaseDAO):
                     ml.registered_on,
                     ml.recorded_on,
                     ml.recorded_by,
-                    mc.category,
-                    ll.level,
+                    ml.category_id,
+                    ml.level_id,
                     ml.device_id,
-                    dv.kind as device,
-                    dp.provider,
-                    ml.description
+                    ml.provider_id,
+                    ml.description,
+                    ml.client_key
                 from
-                    {_prefix_} message_log ml
-                    left join {_prefix_} message_category mc on ml.category_id = mc.id
-                    left join {_prefix_} message_level ll on ml.level_id = ll.id
-                    left join {_prefix_} device dv on ml.device_id = dv.id
-                    left join {_prefix_} data_provider dp on ml.provider_id = dp.id
+                    {_prefix_} {table} ml
                 where
-                    (:study_id is null or ml.study_id = :study_id) and
-                    (:category_id is null or ml.category_id = :category_id) and
-                    (:start_event_on is null or
-                        ml.event_on >= :start_event_on) and
-                    ml.is_visible = 'Y'
+                    {_message_log_filter(category_id, study_id,
+                                         start_event_on)}
+                    {visible}
                 order by ml.event_on, ml.recorded_on asc
                 limit 10000
                 """
-                ),
+                ).columns(*_MESSAGE_LOG_INFO_COLUMNS),
                 {
                     "study_id": study_id,
                     "category_id": category_id,
                     "start_event_on": start_event_on,
                 },
             )
-            .all(),
+            .all()
+        ]
+        # union with archive, rows being archived can be in both places
+        boundary: datetime = None if recent else DAO.archive.get_boundary()
+        if boundary is None:
+            return rows
+        if not (include_archive if start_event_on is None
+                else start_event_on < boundary):
+            return rows
+        ids: set[int] = {o.id for o in rows}
+        rows += [o for o in DAO.archive.get_message_log_infos(
+            category_id, study_id, start_event_on, 10000)
+            if o.id not in ids]
+        rows.sort(key=lambda o: (o.event_on, o.recorded_on))
+        return rows[:10000]
+
+    def get_message_log_page(self, category_id: int,
+                             study_id: int,
+                             interval_sec: int,
+                             key: tuple = None,
+                             backward: bool = False,
+                             limit: int = 100) -> list[MessageLogInfoDTO]:
+        """ Get page of visible message log rows ordered by (event_on,
+        recorded_on, id) key, rows after specified key or before it
+        when backward, seek uses key index rather than OFFSET
+
+        :param key: (event_on, recorded_on, id) to start after/before,
+                    None for the first or, when backward, the last page
+        :param backward: fetch rows before key
+        :param limit: max number of rows
+        :return: rows in ascending key order
+        """
+        start_event_on: datetime.datetime = \
+            (datetime.now() - timedelta(seconds=interval_sec)) \
+            if interval_sec else None
+        op: str = "<" if backward else ">"
+        order: str = "desc" if backward else "asc"
+        seek: str = f"(ml.event_on, ml.recorded_on, ml.id) {op} " \
+                    f"(:key_event_on, :key_recorded_on, :key_id) and" \
+            if key else ""
+        params: dict = {
+            "study_id": study_id,
+            "category_id": category_id,
+            "start_event_on": start_event_on,
+            "limit": limit,
+        }
+        stmt = text(
+            f"""
+                select
+                    ml.id,
+                    ml.study_id,
+                    ml.study_name as study,
+                    ml.event_on,
+                    ml.registered_on,
+                    ml.recorded_on,
+                    ml.recorded_by,
+                    ml.category_id,
+                    ml.level_id,
+                    ml.device_id,
+                    ml.provider_id,
+                    ml.description,
+                    ml.client_key
+                from
+                    {_prefix_} message_log ml
+                where
+                    {seek}
+                    {_message_log_filter(category_id, study_id,
+                                         start_event_on)} and
+                    ml.is_visible = 'Y'
+                order by
+                    ml.event_on {order},
+                    ml.recorded_on {order},
+                    ml.id {order}
+                limit :limit
+                """
         )
+        if key:
+            # bind timestamps with column type, so SQLite compares them
+            # in the same text format they are stored in
+            stmt = stmt.bindparams(
+                bindparam("key_event_on", key[0], type_=TIMESTAMP),
+                bindparam("key_recorded_on", key[1], type_=TIMESTAMP),
+                bindparam("key_id", key[2], type_=Integer))
+        ref: RefData = DAO.ref_data.get_ref_data()
+        stmt = stmt.columns(*_MESSAGE_LOG_INFO_COLUMNS)
+        rows: list = [ref.message_log_info(r, MessageDAO.fast_dto) for r in
+                      self.session().execute(stmt, params).all()]
+        if backward:
+            rows.reverse()
+        return rows
+
+    def get_message_log_partitions(self) -> list[tuple]:
+        """ Get message_log partitions as (name, start, end), default
+        partition goes first with None start and end, others by start
+
+        :return: empty list if table is not partitioned
+        """
+        if not self.is_message_log_partitioned():
+            return []
+        res: list[tuple[str, datetime, datetime]] = []
+        for name, bound in self.session().execute(
+                text(
+                    """
+                select
+                    c.relname,
+                    pg_get_expr(c.relpartbound, c.oid)
+                from
+                    pg_inherits i
+                    join pg_class c on c.oid = i.inhrelid
+                    join pg_class p on p.oid = i.inhparent
+                    join pg_namespace n on n.oid = p.relnamespace
+                where
+                    p.relname = 'message_log' and
+                    n.nspname = coalesce(:schema, current_schema())
+                """
+                ),
+                {"schema": BaseDAO.default_schema}).all():
+            m = re.search(r"FROM \('([^']+)'\) TO \('([^']+)'\)", bound)
+            res.append((name, datetime.fromisoformat(m.group(1)),
+                        datetime.fromisoformat(m.group(2)))
+                       if m else (name, None, None))
+        res.sort(key=lambda o: (o[1] is not None, o[1]))
+        return res
+
+    def get_message_logs(self, ids: list[int]) -> list[dict]:
+        """ Get message_log rows with all columns by IDs """
+        if not ids:
+            return []
+        columns: list = MessageLogEntity.__table__.columns
+        return [
+            dict(row._mapping) for row in
+            self.session()
+            .query(*columns)
+            .filter(MessageLogEntity.id.in_(ids))
+            .order_by(MessageLogEntity.id)
+            .all()
+        ]
+
+    def get_message_logs_after(self, event_on: datetime,
+                               limit: int) -> list[dict]:
+        """ Get the latest visible message_log rows with all columns and
+        event_on at or after specified time ordered by event_on """
+        columns: list = MessageLogEntity.__table__.columns
+        return [
+            dict(row._mapping) for row in
+            self.session()
+            .query(*columns)
+            .filter(MessageLogEntity.event_on >= event_on,
+                    MessageLogEntity.is_visible == 'Y')
+            .order_by(MessageLogEntity.event_on.desc(),
+                      MessageLogEntity.id.desc())
+            .limit(limit)
+            .all()
+        ][::-1]
+
+    def get_message_logs_before(self, event_on: datetime,
+                                limit: int) -> list[dict]:
+        """ Get message_log rows with all columns and event_on before
+        specified time ordered by ID """
+        columns: list = MessageLogEntity.__table__.columns
+        return [
+            dict(row._mapping) for row in
+            self.session()
+            .query(*columns)
+            .filter(MessageLogEntity.event_on < event_on)
+            .order_by(MessageLogEntity.id)
+            .limit(limit)
+            .all()
+        ]
+
+    def get_message_log_delta(self, category_id: int,
+                              study_id: int,
+                              interval_sec: int,
+                              since_id: int = None,
+                              since_on: datetime = None
+                              ) -> tuple[list[MessageLogInfoDTO], list[int]]:
+        """ Get message log rows changed after watermark, i.e. inserted
+        after since_id or since_on recorded time, or with visibility
+        updated after since_on, all visible rows if there is no watermark
+
+        :return: visible rows and IDs of rows hidden after watermark
+        """
+        start_event_on: datetime.datetime = \
+            (datetime.now() - timedelta(seconds=interval_sec)) \
+            if interval_sec else None
+        inserted: list[str] = []
+        if since_id is not None:
+            inserted.append("ml.id > :since_id")
+        if since_on is not None:
+            inserted.append("ml.recorded_on > :since_on")
+        changed: str = "(ml.is_visible = 'Y' and " \
+                       f"({' or '.join(inserted)}))" \
+            if inserted else "ml.is_visible = 'Y'"
+        if since_on is not None:
+            changed = f"({changed} or ml.visible_updated_on > :since_on)"
+        stmt = text(
+            f"""
+                select
+                    ml.id,
+                    ml.study_id,
+                    ml.study_name as study,
+                    ml.event_on,
+                    ml.registered_on,
+                    ml.recorded_on,
+                    ml.recorded_by,
+                    ml.category_id,
+                    ml.level_id,
+                    ml.device_id,
+                    ml.provider_id,
+                    ml.description,
+                    ml.client_key,
+                    ml.is_visible
+                from
+                    {_prefix_} message_log ml
+                where
+                    {changed} and
+                    {_message_log_filter(category_id, study_id,
+                                         start_event_on)}
+                order by ml.event_on, ml.recorded_on, ml.id asc
+                limit 10000
+                """
+        )
+        if since_on is not None:
+            stmt = stmt.bindparams(
+                bindparam("since_on", since_on, type_=TIMESTAMP))
+        ref: RefData = DAO.ref_data.get_ref_data()
+        items: list[MessageLogInfoDTO] = []
+        hidden_ids: list[int] = []
+        for r in self.session().execute(stmt, {
+            "since_id": since_id,
+            "study_id": study_id,
+            "category_id": category_id,
+            "start_event_on": start_event_on,
+        }).all():
+            if r.is_visible == 'Y':
+                items.append(ref.message_log_info(r))
+            else:
+                hidden_ids.append(r.id)
+        return items, hidden_ids
 
     def get_message_log_info(self, message_id: int) -> MessageLogInfoDTO:
-        return _dto(
-            MessageLogInfoDTO,
+        row = (
             self.session()
             .execute(
                 text(
@@ -304,26 +1094,131 @@ class MessageDAO(BaseDAO):
                     ml.registered_on,
                     ml.recorded_on,
                     ml.recorded_by,
-                    mc.category,
-                    ll.level,
+                    ml.category_id,
+                    ml.level_id,
                     ml.device_id,
-                    dv.kind as device,
-                    dp.provider,
-                    ml.description
+                    ml.provider_id,
+                    ml.description,
+                    ml.client_key
                 from
                     {_prefix_} message_log ml
-                    left join {_prefix_} message_category mc on ml.category_id = mc.id
-                    left join {_prefix_} message_level ll on ml.level_id = ll.id
-                    left join {_prefix_} device dv on ml.device_id = dv.id
-                    left join {_prefix_} data_provider dp on ml.provider_id = dp.id
                 where
                     ml.id = :message_id
                 """
                 ),
                 {"message_id": message_id},
             )
-            .first(),
+            .first()
         )
+        return DAO.ref_data.get_ref_data().message_log_info(row) \
+            if row else None
+
+    def is_message_log_partitioned(self) -> bool:
+        if self.session().get_bind().dialect.name != "postgresql":
+            return False
+        return self.session().execute(
+            text(
+                """
+                select count(*)
+                from
+                    pg_partitioned_table pt
+                    join pg_class c on c.oid = pt.partrelid
+                    join pg_namespace n on n.oid = c.relnamespace
+                where
+                    c.relname = 'message_log' and
+                    n.nspname = coalesce(:schema, current_schema())
+                """
+            ),
+            {"schema": BaseDAO.default_schema}).scalar() > 0
+
+    def iter_message_log_batches(self, columns: list[str] = None,
+                                 category_id: int = None,
+                                 study_id: int = None,
+                                 start_event_on: datetime = None,
+                                 end_event_on: datetime = None,
+                                 visible_only: bool = True,
+                                 batch_size: int = 50000) -> Iterator:
+        """ Iterate over message_log rows as Arrow record batches ordered
+        by event_on, only specified columns are selected and event_on
+        range [start_event_on, end_event_on) is filtered in SQL, archived
+        rows go first. DB rows are read with server side cursor in own
+        session, so iterator can be consumed from any thread
+
+        :raise ImportError: if pyarrow is not installed
+        :raise ValueError: on unknown column name
+        """
+        schema = message_log_schema(columns)
+        return self._iter_message_log_batches_all(
+            schema, category_id, study_id, start_event_on, end_event_on,
+            visible_only, batch_size)
+
+    def iter_message_log_infos(self, category_id: int,
+                               study_id: int,
+                               interval_sec: int,
+                               batch_size: int = 1000
+                               ) -> Iterator[list[MessageLogInfoDTO]]:
+        """ Iterate over all visible message log rows in batches ordered
+        by event_on and recorded_on without row limit, archived rows go
+        first. DB rows are read with server side cursor in own session,
+        so iterator can be consumed from any thread """
+        start_event_on: datetime.datetime = \
+            (datetime.now() - timedelta(seconds=interval_sec)) \
+            if interval_sec else None
+        boundary: datetime = DAO.archive.get_boundary()
+        if boundary is not None and \
+                (start_event_on is None or start_event_on < boundary):
+            # rows before boundary still in DB are being archived or
+            # arrived late, they are few and merged into archive rows
+            late: list[MessageLogInfoDTO] = list(itertools.chain(
+                *self._iter_message_log_infos(category_id, study_id,
+                                              start_event_on, boundary,
+                                              batch_size)))
+            late_ids: set[int] = {o.id for o in late}
+            archived: Iterator[MessageLogInfoDTO] = (
+                o for batch in DAO.archive.iter_message_log_infos(
+                    category_id, study_id, start_event_on, batch_size)
+                for o in batch if o.id not in late_ids)
+            yield from _batches(
+                heapq.merge(archived, late,
+                            key=lambda o: (o.event_on, o.recorded_on)),
+                batch_size)
+            start_event_on = boundary
+        yield from self._iter_message_log_infos(category_id, study_id,
+                                                start_event_on, None,
+                                                batch_size)
+
+    def refresh_message_log_recent(self, condition: str = "1 = 1",
+                                   params: dict = None) -> int:
+        """ Copy visible message_log rows of recent hours matching
+        condition to message_log_recent if they are not there yet """
+        columns: str = ", ".join(["id"] + self._recent_columns())
+        return self.session().execute(
+            text(
+                f"""
+                insert into {_prefix_}message_log_recent ({columns})
+                select {columns}
+                from
+                    {_prefix_}message_log ml
+                where
+                    ml.is_visible = 'Y' and
+                    ml.event_on >= :recent_start and
+                    {condition} and
+                    not exists (
+                        select 1 from {_prefix_}message_log_recent r
+                        where r.id = ml.id
+                    )
+                """
+            ).bindparams(bindparam("recent_start", self._recent_start(),
+                                   type_=TIMESTAMP)),
+            params or {}).rowcount
+
+    @classmethod
+    def set_fast_dto(cls, enabled: bool):
+        cls.fast_dto = bool(enabled)
+
+    @classmethod
+    def set_recent_hours(cls, hours: int):
+        cls.recent_hours = max(0, hours or 0)
 
     def update_message_log_visibility(self, category_id: int,
                                       is_visible: str,
@@ -335,33 +1230,248 @@ class MessageDAO(BaseDAO):
             MessageLogEntity.level_id.in_(levels)
         )
 
+        start_event_on: datetime.datetime = None
         if interval_sec and interval_sec > 0:
-            start_event_on: datetime.datetime = \
+            start_event_on = \
                 (datetime.now() - timedelta(seconds=interval_sec))
             query = query.filter(MessageLogEntity.event_on >= start_event_on)
 
-        return query.update(
+        res: int = query.update(
             {
                 MessageLogEntity.is_visible: is_visible,
                 MessageLogEntity.visible_updated_by: updated_by,
-                MessageLogEntity.visible_updated_on: func.current_timestamp()
+                MessageLogEntity.visible_updated_on: datetime.now()
             },
             synchronize_session=False
         )
+        if MessageDAO.recent_hours > 0 and res > 0:
+            if is_visible == "Y":
+                condition: str = "ml.category_id = :category_id and " \
+                    f"ml.level_id in ({_int_list(levels)})"
+                params: dict = {"category_id": category_id}
+                if start_event_on:
+                    condition += " and ml.event_on >= :start_event_on"
+                    params["start_event_on"] = start_event_on
+                self.refresh_message_log_recent(condition, params)
+            else:
+                query = self.session().query(MessageLogRecentEntity).filter(
+                    MessageLogRecentEntity.category_id == category_id,
+                    MessageLogRecentEntity.level_id.in_(levels))
+                if start_event_on:
+                    query = query.filter(
+                        MessageLogRecentEntity.event_on >= start_event_on)
+                query.delete(synchronize_session=False)
+        return res
 
     def update_message_log_visibility_by_ids(self, ids: list[int],
                                              is_visible: str, updated_by: str) -> int:
         query = self.session().query(MessageLogEntity) \
             .filter(MessageLogEntity.id.in_(ids))
 
-        return query.update(
+        res: int = query.update(
             {
                 MessageLogEntity.is_visible: is_visible,
                 MessageLogEntity.visible_updated_by: updated_by,
-                MessageLogEntity.visible_updated_on: func.current_timestamp()
+                MessageLogEntity.visible_updated_on: datetime.now()
             },
             synchronize_session=False
         )
+        if MessageDAO.recent_hours > 0 and res > 0:
+            if is_visible == "Y":
+                self.refresh_message_log_recent(
+                    f"ml.id in ({_int_list(ids)})")
+            else:
+                self.session().query(MessageLogRecentEntity) \
+                    .filter(MessageLogRecentEntity.id.in_(ids)) \
+                    .delete(synchronize_session=False)
+        return res
+
+    def _iter_message_log_batches(self, schema,
+                                  category_id: int,
+                                  study_id: int,
+                                  start_event_on: datetime,
+                                  end_event_on: datetime,
+                                  visible_only: bool,
+                                  batch_size: int) -> Iterator:
+        condition: str = _message_log_filter(category_id, study_id,
+                                             start_event_on)
+        if end_event_on is not None:
+            condition += " and ml.event_on < :end_event_on"
+        if visible_only:
+            condition += " and ml.is_visible = 'Y'"
+        columns: list = [MessageLogEntity.__table__.c[c]
+                         for c in schema.names]
+        session = BaseDAO.default_session.session_factory()
+        try:
+            result = session.execute(
+                text(
+                    f"""
+                select
+                    {", ".join(f"ml.{c}" for c in schema.names)}
+                from
+                    {_prefix_} message_log ml
+                where
+                    {condition}
+                order by ml.event_on, ml.recorded_on, ml.id asc
+                """
+                ).columns(*columns),
+                {
+                    "study_id": study_id,
+                    "category_id": category_id,
+                    "start_event_on": start_event_on,
+                    "end_event_on": end_event_on,
+                },
+                execution_options={"yield_per": batch_size},
+            )
+            for rows in result.partitions():
+                values: list[list] = [list(o) for o in zip(*rows)]
+                if "payload" in schema.names:
+                    i: int = schema.names.index("payload")
+                    values[i] = [json.dumps(o) if o is not None else None
+                                 for o in values[i]]
+                yield pyarrow.RecordBatch.from_arrays(
+                    [pyarrow.array(v, type=f.type)
+                     for v, f in zip(values, schema)], schema=schema)
+        finally:
+            session.close()
+
+    def _iter_message_log_batches_all(self, schema,
+                                      category_id: int,
+                                      study_id: int,
+                                      start_event_on: datetime,
+                                      end_event_on: datetime,
+                                      visible_only: bool,
+                                      batch_size: int) -> Iterator:
+        boundary: datetime = DAO.archive.get_boundary()
+        if boundary is not None and \
+                (start_event_on is None or start_event_on < boundary):
+            # all DB rows before boundary are few, being archived or
+            # late ones, they replace archived copies
+            end: datetime = boundary if end_event_on is None \
+                else min(boundary, end_event_on)
+            late = pyarrow.Table.from_batches(
+                list(self._iter_message_log_batches(
+                    message_log_schema(), category_id, study_id,
+                    start_event_on, end, False, batch_size)),
+                schema=message_log_schema())
+            yield from DAO.archive.iter_message_log_batches(
+                schema.names, category_id, study_id, start_event_on, end,
+                visible_only, late, batch_size)
+            start_event_on = boundary
+        if end_event_on is None or start_event_on is None or \
+                start_event_on < end_event_on:
+            yield from self._iter_message_log_batches(
+                schema, category_id, study_id, start_event_on,
+                end_event_on, visible_only, batch_size)
+
+    def _iter_message_log_infos(self, category_id: int,
+                                study_id: int,
+                                start_event_on: datetime,
+                                end_event_on: datetime,
+                                batch_size: int
+                                ) -> Iterator[list[MessageLogInfoDTO]]:
+        condition: str = _message_log_filter(category_id, study_id,
+                                             start_event_on)
+        if end_event_on is not None:
+            condition += " and ml.event_on < :end_event_on"
+        session = BaseDAO.default_session.session_factory()
+        try:
+            result = session.execute(
+                text(
+                    f"""
+                select
+                    ml.id,
+                    ml.study_id,
+                    ml.study_name as study,
+                    ml.event_on,
+                    ml.registered_on,
+                    ml.recorded_on,
+                    ml.recorded_by,
+                    ml.category_id,
+                    ml.level_id,
+                    ml.device_id,
+                    ml.provider_id,
+                    ml.description,
+                    ml.client_key
+                from
+                    {_prefix_} message_log ml
+                where
+                    {condition} and
+                    ml.is_visible = 'Y'
+                order by ml.event_on, ml.recorded_on asc
+                """
+                ).columns(*_MESSAGE_LOG_INFO_COLUMNS),
+                {
+                    "study_id": study_id,
+                    "category_id": category_id,
+                    "start_event_on": start_event_on,
+                    "end_event_on": end_event_on,
+                },
+                execution_options={"yield_per": batch_size},
+            )
+            ref: RefData = DAO.ref_data.get_ref_data()
+            for rows in result.partitions():
+                yield [ref.message_log_info(r, MessageDAO.fast_dto)
+                       for r in rows]
+        finally:
+            session.close()
+
+    def _recent_columns(self) -> list[str]:
+        return [c.name for c in MessageLogRecentEntity.__table__.columns
+                if c.name != "id"]
+
+    def _recent_start(self) -> datetime:
+        return datetime.now() - timedelta(hours=MessageDAO.recent_hours)
+
+    def _use_client_key_table(self) -> bool:
+        # message_log is partitioned by migration, so it is checked once
+        if MessageDAO.client_key_table is None:
+            MessageDAO.client_key_table = self.is_message_log_partitioned()
+        return MessageDAO.client_key_table
+
+
+# Reference data registry DAO, message_category, message_level, device
+# and data_provider tables are loaded once and kept in memory as
+# versioned snapshot, refreshed on demand or when TTL is expired
+class RefDataDAO(BaseDAO):
+    ttl_sec: int = 300
+    _data: RefData = None
+    _lock: threading.Lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    def get_ref_data(self) -> RefData:
+        data: RefData = RefDataDAO._data
+        expired: bool = data is not None and RefDataDAO.ttl_sec > 0 \
+            and time.monotonic() - data.loaded_at > RefDataDAO.ttl_sec
+        if data is None or expired:
+            data = self.refresh()
+        return data
+
+    def refresh(self) -> RefData:
+        with RefDataDAO._lock:
+            version: int = RefDataDAO._data.version + 1 \
+                if RefDataDAO._data else 1
+            data: RefData = RefData(
+                version,
+                [o.copy() for o in
+                 self.session().query(MessageCategoryEntity).all()],
+                [o.copy() for o in self.session().query(DeviceEntity).all()],
+                [o.copy() for o in
+                 self.session().query(MessageLevelEntity).all()],
+                [o.copy() for o in
+                 self.session().query(DataProviderEntity).all()]
+            )
+            RefDataDAO._data = data
+        logger.debug(f"reference data loaded, version={data.version}")
+        return data
+
+    @classmethod
+    def reset(cls, ttl_sec: int = None):
+        if ttl_sec is not None:
+            cls.ttl_sec = ttl_sec
+        cls._data = None
 
 
 # Security system DAO
@@ -519,6 +1629,8 @@ class StudyDAO(BaseDAO):
 # DAO factory
 class DAO:
     account: AccountDAO = AccountDAO()
+    archive: ArchiveDAO = ArchiveDAO()
     message: MessageDAO = MessageDAO()
+    ref_data: RefDataDAO = RefDataDAO()
     sec_sys: SecSysDAO = SecSysDAO()
     study: StudyDAO = StudyDAO()
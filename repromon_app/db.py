@@ -3,7 +3,7 @@ import logging
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
-from repromon_app.dao import BaseDAO
+from repromon_app.dao import BaseDAO, RefDataDAO
 
 logger = logging.getLogger(__name__)
 logger.debug(f"name={__name__}")
@@ -32,6 +32,7 @@ def db_init(params: dict, session_scopefunc=None):
 
     BaseDAO.set_default_schema(params["arg_schema"])
     logger.debug(f"set default schema to: {params['arg_schema']}")
+    RefDataDAO.reset(params.get("arg_ref_data_ttl_sec"))
     logger.debug("done")
 
 
@@ -0,0 +1,1065 @@
+import json
+import logging
+import os
+import queue
+import re
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import exc
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+from repromon_app.db import db_session_done
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+############################################
+# Message ingest pipeline
+
+
+class IngestQueueFullError(Exception):
+    """Raised when ingest queue reached its capacity"""
+    pass
+
+
+class IngestRateLimitError(Exception):
+    """Raised when user exceeded ingest rate limit"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, retry_after)
+        self.retry_after: float = retry_after
+
+    def __str__(self):
+        return self.args[0]
+
+
+class IngestWriteError(Exception):
+    """Raised when some messages of batch were rejected by DB while
+    others were written"""
+
+    def __init__(self, ids: list[int], errors: dict[int, str]):
+        super().__init__(ids, errors)
+        # message IDs in batch order, None for rejected messages
+        self.ids: list[int] = ids
+        # error details by message index in batch
+        self.errors: dict[int, str] = errors
+
+    def __str__(self):
+        return f"{len(self.errors)} of {len(self.ids)} messages were " \
+               f"rejected by DB"
+
+
+def is_db_unavailable(e: BaseException) -> bool:
+    """ Check whether error means DB is down, locked or overloaded
+    rather than message itself is invalid """
+    return isinstance(e, (exc.InterfaceError, exc.OperationalError,
+                          exc.TimeoutError))
+
+
+# bounded in-process write-behind queue, messages are drained by
+# background writer thread and committed in batches (group commit).
+# Batch is retried while DB is unavailable, so the queue fills up and
+# new messages are rejected, and only messages rejected by DB are dropped
+class IngestQueue:
+    def __init__(self, writer: Callable[[list[dict]], list[int]],
+                 max_size: int = 10000,
+                 batch_max_size: int = 500,
+                 batch_linger_ms: int = 5):
+        """ Create ingest queue
+
+        :param writer: function to write batch of message_log values
+                       in single transaction, returns message IDs, can
+                       raise IngestWriteError when some are rejected
+        :param max_size: queue capacity, put fails when it is reached
+        :param batch_max_size: max number of messages in single batch
+        :param batch_linger_ms: time to wait for more messages
+                                before batch is flushed
+        """
+        self._writer = writer
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._max_size: int = max_size
+        self._batch_max_size: int = max(1, batch_max_size)
+        self._batch_linger_sec: float = max(0, batch_linger_ms) / 1000.0
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: threading.Thread = None
+        self._lock: threading.Lock = threading.Lock()
+        self._count_enqueued: int = 0
+        self._count_rejected: int = 0
+        self._count_written: int = 0
+        self._count_dropped: int = 0
+        self._count_retries: int = 0
+        self._count_batches: int = 0
+        self._flush_ms_last: float = 0
+        self._flush_ms_max: float = 0
+        self._flush_ms_total: float = 0
+        self._lag_ms_max: float = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self):
+        """ Block until all enqueued messages are written """
+        self._queue.join()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def put(self, values: dict) -> str:
+        """ Enqueue message_log values to be written
+
+        :param values: message_log column values
+        :return: provisional message ID
+        """
+        provisional_id: str = str(uuid.uuid4())
+        try:
+            self._queue.put_nowait((provisional_id, time.monotonic(), values))
+        except queue.Full:
+            with self._lock:
+                self._count_rejected += 1
+            raise IngestQueueFullError(
+                f"Ingest queue is full, max_size={self._max_size}")
+        with self._lock:
+            self._count_enqueued += 1
+        return provisional_id
+
+    def start(self):
+        logger.debug("start()")
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="IngestQueueWriter",
+                                        daemon=True)
+        self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.is_running(),
+                "depth": self.depth,
+                "max_size": self._max_size,
+                "enqueued": self._count_enqueued,
+                "rejected": self._count_rejected,
+                "written": self._count_written,
+                "dropped": self._count_dropped,
+                "retries": self._count_retries,
+                "batches": self._count_batches,
+                "flush_ms_last": round(self._flush_ms_last, 3),
+                "flush_ms_max": round(self._flush_ms_max, 3),
+                "flush_ms_avg": round(
+                    self._flush_ms_total / self._count_batches, 3)
+                if self._count_batches else 0,
+                "lag_ms_max": round(self._lag_ms_max, 3),
+            }
+
+    def stop(self, timeout: float = 10.0):
+        """ Stop writer thread, pending messages are written first """
+        logger.debug("stop()")
+        if not self.is_running():
+            return
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _next_batch(self) -> list[tuple]:
+        try:
+            batch: list[tuple] = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline: float = time.monotonic() + self._batch_linger_sec
+        while len(batch) < self._batch_max_size:
+            timeout: float = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout)
+                             if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        logger.info("Ingest queue writer started")
+        try:
+            while True:
+                batch: list[tuple] = self._next_batch()
+                if batch:
+                    self._write(batch)
+                elif self._stop_event.is_set():
+                    break
+        finally:
+            db_session_done()
+            logger.info("Ingest queue writer stopped")
+
+    def _write(self, batch: list[tuple]):
+        t0: float = time.monotonic()
+        lag_ms: float = (t0 - batch[0][1]) * 1000.0
+        values: list[dict] = [v for _, _, v in batch]
+        dropped: int = 0
+        retries: int = 0
+        while True:
+            try:
+                self._writer(values)
+                break
+            except IngestWriteError as e:
+                # only messages rejected by DB are dropped
+                logger.error(f"Dropped {len(e.errors)} of {len(batch)} "
+                             f"queued messages: {str(e)}")
+                dropped = len(e.errors)
+                break
+            except BaseException as e:
+                if not is_db_unavailable(e):
+                    dropped = self._write_each(values)
+                    break
+                # messages were accepted, so batch is kept and retried
+                # while DB is unavailable, new ones are rejected when
+                # queue is full
+                if self._stop_event.is_set():
+                    logger.error(f"Dropped batch of {len(batch)} queued "
+                                 f"messages on stop: {str(e)}")
+                    dropped = len(batch)
+                    break
+                logger.error(f"Failed write batch of {len(batch)} "
+                             f"messages, retry: {str(e)}")
+                retries += 1
+                self._stop_event.wait(min(5.0, 0.1 * 2 ** min(retries, 6)))
+        flush_ms: float = (time.monotonic() - t0) * 1000.0
+
+        with self._lock:
+            self._count_batches += 1
+            self._count_written += len(batch) - dropped
+            self._count_dropped += dropped
+            self._count_retries += retries
+            self._flush_ms_last = flush_ms
+            self._flush_ms_max = max(self._flush_ms_max, flush_ms)
+            self._flush_ms_total += flush_ms
+            self._lag_ms_max = max(self._lag_ms_max, lag_ms)
+
+        for _ in batch:
+            self._queue.task_done()
+
+    def _write_each(self, values: list[dict]) -> int:
+        """ Write messages one by one after batch failed, so only
+        failing ones are dropped
+
+        :return: number of dropped messages
+        """
+        dropped: int = 0
+        for v in values:
+            try:
+                self._writer([v])
+            except BaseException as e:
+                logger.error(f"Dropped queued message: {str(e)}")
+                dropped += 1
+        return dropped
+
+
+# bounded LRU of recently ingested idempotency keys, maps
+# (username, client_key) to message ID, so retries are mostly
+# resolved in memory and only evicted keys reach DB unique index
+class RecentKeys:
+    def __init__(self, max_size: int = 100000):
+        self._keys: OrderedDict = OrderedDict()
+        self._max_size: int = max(1, max_size)
+        self._lock: threading.Lock = threading.Lock()
+        self._count_hits: int = 0
+        self._count_misses: int = 0
+        self._count_evicted: int = 0
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        with self._lock:
+            return key in self._keys
+
+    def get(self, key: tuple[str, str]) -> int:
+        """ Get message ID by (username, client_key) if it is known """
+        with self._lock:
+            message_id: int = self._keys.get(key)
+            if message_id is None:
+                self._count_misses += 1
+            else:
+                self._count_hits += 1
+                self._keys.move_to_end(key)
+            return message_id
+
+    def put(self, key: tuple[str, str], message_id: int):
+        with self._lock:
+            self._keys[key] = message_id
+            self._keys.move_to_end(key)
+            while len(self._keys) > self._max_size:
+                self._keys.popitem(last=False)
+                self._count_evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._keys),
+                "max_size": self._max_size,
+                "hits": self._count_hits,
+                "misses": self._count_misses,
+                "evicted": self._count_evicted,
+            }
+
+
+# in-memory token bucket rate limiter keyed by username, bucket refills
+# at rate tokens (messages) per second up to burst, limits are resolved
+# by user, then by the most permissive of user roles, then by default,
+# rate 0 means unlimited
+class RateLimiter:
+    def __init__(self, rate: float = 0, burst: float = 0,
+                 users: dict[str, tuple[float, float]] = None,
+                 roles: dict[str, tuple[float, float]] = None):
+        """ Create rate limiter
+
+        :param rate: default rate in messages per second, 0 - unlimited
+        :param burst: default bucket capacity, rate is used if not set
+        :param users: username -> (rate, burst) overrides
+        :param roles: rolename -> (rate, burst) overrides
+        """
+        self._default: tuple[float, float] = self._limit(rate, burst)
+        self._users: dict[str, tuple[float, float]] = {
+            k: self._limit(*v) for k, v in (users or {}).items()}
+        self._roles: dict[str, tuple[float, float]] = {
+            k: self._limit(*v) for k, v in (roles or {}).items()}
+        self._lock: threading.Lock = threading.Lock()
+        # username -> [rate, burst, tokens, last refill time]
+        self._buckets: dict[str, list] = {}
+        self._count_allowed: int = 0
+        self._count_limited: int = 0
+
+    def acquire(self, username: str, rolenames: list[str],
+                count: int = 1) -> float:
+        """ Take count tokens from user bucket
+
+        :return: 0 if allowed, or seconds to wait before retry
+        """
+        now: float = time.monotonic()
+        with self._lock:
+            bucket: list = self._buckets.get(username)
+            if bucket is None:
+                rate, burst = self.get_limit(username, rolenames)
+                bucket = [rate, burst, burst, now]
+                self._buckets[username] = bucket
+            rate, burst, tokens, last = bucket
+            if rate <= 0:
+                self._count_allowed += count
+                return 0
+            tokens = min(burst, tokens + (now - last) * rate)
+            bucket[3] = now
+            # batches larger than burst pass on full bucket and
+            # leave it in debt, so they are not rejected forever
+            need: float = min(count, burst)
+            if tokens < need:
+                bucket[2] = tokens
+                self._count_limited += count
+                return (need - tokens) / rate
+            bucket[2] = tokens - count
+            self._count_allowed += count
+            return 0
+
+    def get_limit(self, username: str,
+                  rolenames: list[str]) -> tuple[float, float]:
+        if username in self._users:
+            return self._users[username]
+        limits: list[tuple[float, float]] = [
+            self._roles[r] for r in rolenames or [] if r in self._roles]
+        if not limits:
+            return self._default
+        if any(rate <= 0 for rate, _ in limits):
+            return 0, 0
+        return max(limits)
+
+    @staticmethod
+    def parse_limits(value: str) -> dict[str, tuple[float, float]]:
+        """ Parse limits like "name1=rate/burst, name2=rate" """
+        res: dict[str, tuple[float, float]] = {}
+        for item in (value or "").split(","):
+            if not item.strip():
+                continue
+            name, _, limit = item.partition("=")
+            rate, _, burst = limit.partition("/")
+            res[name.strip()] = (float(rate), float(burst or 0))
+        return res
+
+    def reset(self, username: str = None):
+        """ Drop user bucket, or all buckets, e.g. when roles changed """
+        with self._lock:
+            if username:
+                self._buckets.pop(username, None)
+            else:
+                self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._buckets),
+                "allowed": self._count_allowed,
+                "limited": self._count_limited,
+            }
+
+    @staticmethod
+    def _limit(rate: float, burst: float = 0) -> tuple[float, float]:
+        rate = float(rate)
+        if rate <= 0:
+            return 0.0, 0.0
+        return rate, max(1.0, float(burst or rate))
+
+
+# durable disk spool, messages are appended to segmented NDJSON files
+# when DB is unavailable or slow, and background replayer drains them
+# into DB in batches once it is back, values are written as is, so
+# original event_on/registered_on are kept. Damaged records and ones
+# which can't be written ever are appended to segment .failed file
+class IngestSpool:
+    FSYNC_ALWAYS: str = "always"
+    FSYNC_INTERVAL: str = "interval"
+    FSYNC_NEVER: str = "never"
+
+    _DATETIME_KEYS: tuple = ("event_on", "registered_on", "recorded_on")
+    _SEGMENT_RE = re.compile(r"segment-(\d{10})\.spool")
+
+    def __init__(self, path: str,
+                 writer: Callable[[list[dict]], list[int]],
+                 segment_max_bytes: int = 16 * 1024 * 1024,
+                 fsync: str = "interval",
+                 fsync_interval_ms: int = 1000,
+                 latency_threshold_ms: int = 1000,
+                 replay_batch_size: int = 500,
+                 replay_interval_ms: int = 1000):
+        """ Create ingest spool
+
+        :param path: spool directory, created if not exists
+        :param writer: function to write batch of message_log values
+                       in single transaction, returns message IDs
+        :param segment_max_bytes: segment file size to roll over
+        :param fsync: fsync policy, "always" after every append,
+                      "interval" at most once per fsync_interval_ms,
+                      or "never" to leave it up to OS
+        :param fsync_interval_ms: fsync interval for "interval" policy
+        :param latency_threshold_ms: DB write time to start spooling,
+                                     0 to spool only on DB errors
+        :param replay_batch_size: max number of messages per replay write
+        :param replay_interval_ms: replayer poll and retry interval
+        """
+        if fsync not in (IngestSpool.FSYNC_ALWAYS,
+                         IngestSpool.FSYNC_INTERVAL,
+                         IngestSpool.FSYNC_NEVER):
+            raise ValueError(f"Invalid spool fsync policy: {fsync}")
+        self._path: str = path
+        self._writer = writer
+        self._segment_max_bytes: int = max(1, segment_max_bytes)
+        self._fsync: str = fsync
+        self._fsync_interval_sec: float = max(0, fsync_interval_ms) / 1000.0
+        self._latency_threshold_ms: int = latency_threshold_ms
+        self._replay_batch_size: int = max(1, replay_batch_size)
+        self._replay_interval_sec: float = \
+            max(1, replay_interval_ms) / 1000.0
+        self._lock: threading.Lock = threading.Lock()
+        self._wakeup: threading.Event = threading.Event()
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: threading.Thread = None
+        # segment seq -> [pending records, pending bytes, first append time]
+        self._segments: dict[int, list] = {}
+        self._active_seq: int = 0
+        self._active_file = None
+        self._active_size: int = 0
+        self._fsync_last: float = 0
+        self._divert_reason: str = None
+        self._replayed: deque = deque()
+        self._count_spooled: int = 0
+        self._count_replayed: int = 0
+        self._count_replay_failed: int = 0
+        self._count_corrupted: int = 0
+        self._count_quarantined: int = 0
+        self._last_error: str = None
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return sum(seg[0] for seg in self._segments.values())
+
+    def divert(self, reason: str):
+        """ Route new messages to spool until it is drained """
+        with self._lock:
+            if self._divert_reason is None:
+                logger.warning(f"Ingest spool diverting: {reason}")
+            self._divert_reason = reason
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """ Wait until all spooled messages are replayed """
+        deadline: float = time.monotonic() + timeout
+        while self.pending > 0:
+            if time.monotonic() > deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.01)
+        return True
+
+    def is_diverting(self) -> bool:
+        return self._divert_reason is not None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def observe_latency(self, latency_ms: float):
+        """ Start spooling when DB write took longer than threshold """
+        if 0 < self._latency_threshold_ms < latency_ms:
+            self.divert(f"DB write took {round(latency_ms)} ms")
+
+    def put_all(self, values: list[dict]) -> list[str]:
+        """ Append message_log values to spool
+
+        :param values: list of message_log column values
+        :return: provisional message IDs
+        """
+        data: bytes = b"".join(
+            json.dumps(v, default=self._json_default).encode() + b"\n"
+            for v in values)
+        with self._lock:
+            f_full: bool = self._active_size > 0 and \
+                self._active_size + len(data) > self._segment_max_bytes
+            if self._active_file is None or f_full:
+                self._rotate()
+            self._active_file.write(data)
+            self._active_file.flush()
+            now: float = time.monotonic()
+            f_due: bool = now - self._fsync_last >= self._fsync_interval_sec
+            if self._fsync == IngestSpool.FSYNC_ALWAYS or \
+                    (self._fsync == IngestSpool.FSYNC_INTERVAL and f_due):
+                os.fsync(self._active_file.fileno())
+                self._fsync_last = now
+            self._active_size += len(data)
+            seg: list = self._segments[self._active_seq]
+            seg[0] += len(values)
+            seg[1] += len(data)
+            if seg[2] is None:
+                seg[2] = time.time()
+            self._count_spooled += len(values)
+        self._wakeup.set()
+        return [str(uuid.uuid4()) for _ in values]
+
+    def start(self):
+        logger.debug("start()")
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="IngestSpoolReplayer",
+                                        daemon=True)
+        self._thread.start()
+
+    def stats(self) -> dict:
+        now: float = time.monotonic()
+        with self._lock:
+            while self._replayed and now - self._replayed[0][0] > 60:
+                self._replayed.popleft()
+            first_ts: list[float] = [seg[2] for seg in self._segments.values()
+                                     if seg[0] > 0 and seg[2] is not None]
+            return {
+                "running": self.is_running(),
+                "path": self._path,
+                "diverting": self._divert_reason is not None,
+                "divert_reason": self._divert_reason,
+                "segments": sum(1 for seg in self._segments.values()
+                                if seg[0] > 0),
+                "pending": sum(seg[0] for seg in self._segments.values()),
+                "size_bytes": sum(seg[1] for seg in self._segments.values()),
+                "oldest_age_sec": round(time.time() - min(first_ts), 3)
+                if first_ts else 0,
+                "spooled": self._count_spooled,
+                "replayed": self._count_replayed,
+                "replay_failed": self._count_replay_failed,
+                "replay_rate": round(
+                    sum(n for _, n in self._replayed) / 60.0, 3),
+                "corrupted": self._count_corrupted,
+                "quarantined": self._count_quarantined,
+                "last_error": self._last_error,
+            }
+
+    def stop(self, timeout: float = 10.0):
+        """ Stop replayer thread and close active segment """
+        logger.debug("stop()")
+        if self.is_running():
+            self._stop_event.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            if self._active_file is not None:
+                if self._fsync != IngestSpool.FSYNC_NEVER:
+                    os.fsync(self._active_file.fileno())
+                self._active_file.close()
+                self._active_file = None
+
+    def _json_default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        raise TypeError(f"Type {type(o).__name__} is not JSON serializable")
+
+    def _load(self):
+        for name in sorted(os.listdir(self._path)):
+            m = IngestSpool._SEGMENT_RE.fullmatch(name)
+            if not m:
+                continue
+            seq: int = int(m.group(1))
+            file_path: str = self._segment_path(seq)
+            offset: int = self._read_offset(seq)
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                data: bytes = f.read()
+            self._active_seq = max(self._active_seq, seq)
+            if not data:
+                # fully replayed before it was removed
+                os.remove(file_path)
+                self._remove_segment(seq)
+                continue
+            self._segments[seq] = [data.count(b"\n"), len(data),
+                                   os.path.getmtime(file_path)]
+        if self._segments:
+            logger.info(f"Ingest spool recovered {len(self._segments)} "
+                        f"segment(s), pending={self.pending}")
+
+    def _read_offset(self, seq: int) -> int:
+        try:
+            with open(self._segment_path(seq, ".offset")) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _quarantine(self, seq: int, lines: list[bytes]):
+        """ Append records which can't be written ever to segment
+        .failed sidecar file """
+        with open(self._segment_path(seq, ".failed"), "ab") as f:
+            for line in lines:
+                f.write(line if line.endswith(b"\n") else line + b"\n")
+            if self._fsync != IngestSpool.FSYNC_NEVER:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _replay_each(self, seq: int, records: list[tuple]) -> bool:
+        """ Replay records one by one with checkpoint after each, so
+        only failing ones are quarantined, returns False when DB is
+        unavailable """
+        for record in records:
+            failed: bool = False
+            if record[0] is not None:
+                try:
+                    self._writer([record[0]])
+                except BaseException as e:
+                    self._replay_error(1, e)
+                    if is_db_unavailable(e):
+                        return False
+                    failed = True
+            self._replayed_records(seq, [record], {0} if failed else set())
+        return True
+
+    def _replay_error(self, count: int, e: BaseException):
+        logger.error(f"Failed replay {count} spooled messages: {str(e)}")
+        with self._lock:
+            self._count_replay_failed += count
+            self._last_error = str(e)
+
+    def _replay_segment(self, seq: int) -> bool:
+        """ Replay segment from last checkpoint, returns True when
+        it is fully replayed and removed """
+        file_path: str = self._segment_path(seq)
+        with open(file_path, "rb") as f:
+            f.seek(self._read_offset(seq))
+            while True:
+                if self._stop_event.is_set():
+                    return False
+                # records as (values or None if corrupted, line, offset
+                # after line)
+                records: list[tuple] = []
+                while len(records) < self._replay_batch_size:
+                    line: bytes = f.readline()
+                    if not line:
+                        break
+                    try:
+                        values: dict = self._values(json.loads(line))
+                    except ValueError:
+                        # torn write on crash or damaged record
+                        values = None
+                    records.append((values, line, f.tell()))
+                if not records:
+                    break
+
+                indexes: list[int] = [i for i, o in enumerate(records)
+                                      if o[0] is not None]
+                failed: set[int] = set()
+                try:
+                    if indexes:
+                        self._writer([records[i][0] for i in indexes])
+                except IngestWriteError as e:
+                    # the rest of messages are written
+                    self._replay_error(len(e.errors), e)
+                    failed = {indexes[i] for i in e.errors}
+                except BaseException as e:
+                    self._replay_error(len(indexes), e)
+                    if is_db_unavailable(e):
+                        return False
+                    # find messages which can't be written ever
+                    if not self._replay_each(seq, records):
+                        return False
+                    continue
+                self._replayed_records(seq, records, failed)
+
+        os.remove(file_path)
+        self._remove_segment(seq)
+        return True
+
+    def _replayed_records(self, seq: int, records: list[tuple],
+                          failed: set[int]):
+        """ Checkpoint replayed records, corrupted and failed ones are
+        quarantined """
+        bad: list[bytes] = [o[1] for i, o in enumerate(records)
+                            if o[0] is None or i in failed]
+        if bad:
+            self._quarantine(seq, bad)
+        self._write_offset(seq, records[-1][2])
+        corrupted: int = sum(1 for o in records if o[0] is None)
+        with self._lock:
+            seg: list = self._segments[seq]
+            seg[0] -= len(records)
+            seg[1] -= sum(len(o[1]) for o in records)
+            self._count_replayed += len(records) - len(bad)
+            self._count_corrupted += corrupted
+            self._count_quarantined += len(bad) - corrupted
+            self._replayed.append((time.monotonic(),
+                                   len(records) - len(bad)))
+
+    def _remove_segment(self, seq: int):
+        try:
+            os.remove(self._segment_path(seq, ".offset"))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._segments.pop(seq, None)
+
+    def _rotate(self):
+        if self._active_file is not None:
+            if self._fsync != IngestSpool.FSYNC_NEVER:
+                os.fsync(self._active_file.fileno())
+            self._active_file.close()
+        self._active_seq += 1
+        self._active_file = open(self._segment_path(self._active_seq), "ab")
+        self._active_size = 0
+        self._segments[self._active_seq] = [0, 0, None]
+
+    def _run(self):
+        logger.info("Ingest spool replayer started")
+        try:
+            while not self._stop_event.is_set():
+                if not self._replay_next():
+                    self._wakeup.wait(self._replay_interval_sec)
+                    self._wakeup.clear()
+        finally:
+            db_session_done()
+            logger.info("Ingest spool replayer stopped")
+
+    def _replay_next(self) -> bool:
+        """ Replay oldest segment, returns False when there is nothing
+        to replay or DB is still unavailable """
+        with self._lock:
+            seqs: list[int] = sorted(seq for seq, seg in self._segments.items()
+                                     if seg[0] > 0)
+            if not seqs:
+                if self._divert_reason is not None:
+                    logger.info("Ingest spool drained, stop diverting")
+                self._divert_reason = None
+                return False
+            seq: int = seqs[0]
+            # seal active segment, so it is not appended while replayed
+            if seq == self._active_seq:
+                self._rotate()
+        return self._replay_segment(seq)
+
+    def _segment_path(self, seq: int, ext: str = ".spool") -> str:
+        return os.path.join(self._path, f"segment-{seq:010d}{ext}")
+
+    def _values(self, o: dict) -> dict:
+        for key in IngestSpool._DATETIME_KEYS:
+            if isinstance(o.get(key), str):
+                o[key] = datetime.fromisoformat(o[key])
+        return o
+
+    def _write_offset(self, seq: int, offset: int):
+        tmp_path: str = self._segment_path(seq, ".offset.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self._segment_path(seq, ".offset"))
+
+
+class _UnixStreamServer(socketserver.ThreadingMixIn,
+                        socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# local low latency ingest listener, accepts length-prefixed frames
+# (4 bytes big-endian header + JSON or MessagePack object) over Unix
+# domain stream socket and optionally UDP, messages are passed to
+# acceptor which puts them into ingest queue or spool. Header holds
+# payload size, with FRAME_MSGPACK bit set for MessagePack payload
+#
+# frame object contains "apikey" and either message fields or
+# "messages" list, on Unix socket apikey is required in first frame
+# only and every frame is answered with ack frame in the same format
+# as the frame is:
+# {"ok": true, "ids": [...], "errors": [{"index": 0, "detail": ...}]}
+# or {"ok": false, "detail": ...}, UDP datagrams are not answered
+class IngestListener:
+    # frame header bit marking MessagePack payload
+    FRAME_MSGPACK: int = 0x80000000
+
+    _HEADER: struct.Struct = struct.Struct(">I")
+
+    def __init__(self, authenticator: Callable[[str], str],
+                 acceptor: Callable[[str, list[dict]], tuple[list, list]],
+                 socket_path: str = None,
+                 udp_host: str = None,
+                 udp_port: int = 0,
+                 max_frame_size: int = 65536):
+        """ Create ingest listener
+
+        :param authenticator: function to resolve API key to username,
+                              raises exception if key is invalid
+        :param acceptor: function to accept messages on behalf of user,
+                         returns message IDs and errors
+        :param socket_path: Unix domain socket path, None to disable
+        :param udp_host: UDP host to bind
+        :param udp_port: UDP port to bind, 0 to disable
+        :param max_frame_size: max frame payload size in bytes
+        """
+        self._authenticator = authenticator
+        self._acceptor = acceptor
+        self._socket_path: str = socket_path
+        self._udp_host: str = udp_host or "127.0.0.1"
+        self._udp_port: int = udp_port
+        self._max_frame_size: int = max_frame_size
+        self._servers: list[socketserver.BaseServer] = []
+        self._threads: list[threading.Thread] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._count_connections: int = 0
+        self._count_frames: int = 0
+        self._count_messages: int = 0
+        self._count_rejected: int = 0
+        self._count_auth_failed: int = 0
+        self._count_invalid: int = 0
+
+    @property
+    def udp_address(self) -> tuple:
+        for server in self._servers:
+            if isinstance(server, socketserver.UDPServer):
+                return server.server_address
+        return None
+
+    def handle_frame(self, payload: bytes, session: dict,
+                     f_msgpack: bool = False) -> dict:
+        """ Process single frame payload
+
+        :param payload: frame payload
+        :param session: per connection state, keeps authenticated username
+        :param f_msgpack: payload is MessagePack rather than JSON
+        :return: ack object
+        """
+        self._inc("_count_frames")
+        try:
+            frame: dict = self._decode(payload, f_msgpack)
+            if not isinstance(frame, dict):
+                raise ValueError("Frame must be an object")
+        except BaseException as e:
+            self._inc("_count_invalid")
+            return {"ok": False, "detail": f"Invalid frame: {str(e)}"}
+
+        apikey: str = frame.pop("apikey", None)
+        if apikey:
+            try:
+                session["username"] = self._authenticator(apikey)
+            except BaseException as e:
+                session.pop("username", None)
+                self._inc("_count_auth_failed")
+                return {"ok": False, "detail": f"Unauthorized: {str(e)}"}
+        username: str = session.get("username")
+        if not username:
+            self._inc("_count_auth_failed")
+            return {"ok": False, "detail": "Not authenticated"}
+
+        messages: list = frame.get("messages")
+        if messages is None:
+            messages = [frame] if frame else []
+        if not isinstance(messages, list):
+            self._inc("_count_invalid")
+            return {"ok": False, "detail": "Invalid frame: messages "
+                                           "must be a list"}
+        if not messages:
+            return {"ok": True, "ids": [], "errors": []}
+
+        try:
+            ids, errors = self._acceptor(username, messages)
+        except BaseException as e:
+            logger.error(f"Failed accept messages: {str(e)}")
+            self._inc("_count_rejected", len(messages))
+            return {"ok": False, "detail": str(e)}
+        self._inc("_count_messages", len(messages) - len(errors))
+        self._inc("_count_rejected", len(errors))
+        return {"ok": True, "ids": ids, "errors": errors}
+
+    def is_running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        logger.debug("start()")
+        if self.is_running():
+            return
+        listener: IngestListener = self
+
+        class StreamHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                listener._handle_stream(self.rfile, self.wfile)
+
+        class DatagramHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                listener._handle_datagram(self.request[0])
+
+        if self._socket_path:
+            if os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+            server = _UnixStreamServer(self._socket_path, StreamHandler)
+            self._serve(server, "IngestListenerUnix")
+            logger.info(f"Ingest listener on unix socket: "
+                        f"{self._socket_path}")
+        if self._udp_port:
+            server = socketserver.UDPServer(
+                (self._udp_host, max(0, self._udp_port)), DatagramHandler)
+            server.max_packet_size = self._HEADER.size + self._max_frame_size
+            self._serve(server, "IngestListenerUDP")
+            logger.info(f"Ingest listener on UDP: {server.server_address}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.is_running(),
+                "socket_path": self._socket_path,
+                "udp_address": self.udp_address,
+                "connections": self._count_connections,
+                "frames": self._count_frames,
+                "messages": self._count_messages,
+                "rejected": self._count_rejected,
+                "auth_failed": self._count_auth_failed,
+                "invalid": self._count_invalid,
+            }
+
+    def stop(self):
+        logger.debug("stop()")
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        for t in self._threads:
+            t.join()
+        self._servers = []
+        self._threads = []
+        if self._socket_path and os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+    @staticmethod
+    def _decode(payload: bytes, f_msgpack: bool) -> object:
+        if f_msgpack:
+            if msgpack is None:
+                raise ValueError("MessagePack is not supported")
+            return msgpack.unpackb(payload, raw=False, timestamp=3)
+        return json.loads(payload)
+
+    @staticmethod
+    def _encode(obj: dict, f_msgpack: bool) -> bytes:
+        if f_msgpack:
+            return msgpack.packb(obj, use_bin_type=True)
+        return json.dumps(obj).encode()
+
+    def _handle_datagram(self, data: bytes):
+        try:
+            if len(data) < self._HEADER.size:
+                raise ValueError("Truncated frame header")
+            size, f_msgpack = self._header(
+                self._HEADER.unpack_from(data)[0])
+            payload: bytes = data[self._HEADER.size:]
+            if size != len(payload) or size > self._max_frame_size:
+                raise ValueError(f"Invalid frame size: {size}")
+        except ValueError as e:
+            self._inc("_count_invalid")
+            logger.error(f"Invalid UDP datagram: {str(e)}")
+            return
+        ack: dict = self.handle_frame(payload, {}, f_msgpack)
+        if not ack["ok"] or ack.get("errors"):
+            logger.error(f"UDP frame rejected: {ack}")
+
+    def _handle_stream(self, rfile, wfile):
+        self._inc("_count_connections")
+        session: dict = {}
+        try:
+            while True:
+                header: bytes = rfile.read(self._HEADER.size)
+                if len(header) < self._HEADER.size:
+                    return
+                size, f_msgpack = self._header(
+                    self._HEADER.unpack(header)[0])
+                if size > self._max_frame_size:
+                    self._inc("_count_invalid")
+                    self._write_frame(wfile, {
+                        "ok": False,
+                        "detail": f"Frame is too large: {size}"
+                    }, f_msgpack)
+                    return
+                payload: bytes = rfile.read(size)
+                if len(payload) < size:
+                    return
+                ack: dict = self.handle_frame(payload, session, f_msgpack)
+                self._write_frame(wfile, ack,
+                                  f_msgpack and msgpack is not None)
+        except OSError as e:
+            logger.debug(f"Ingest listener connection closed: {str(e)}")
+        finally:
+            db_session_done()
+
+    @staticmethod
+    def _header(value: int) -> tuple[int, bool]:
+        """ :return: payload size and MessagePack flag of frame header """
+        return value & ~IngestListener.FRAME_MSGPACK, \
+            bool(value & IngestListener.FRAME_MSGPACK)
+
+    def _inc(self, name: str, count: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def _serve(self, server: socketserver.BaseServer, name: str):
+        t: threading.Thread = threading.Thread(target=self._serve_forever,
+                                               args=(server,),
+                                               name=name, daemon=True)
+        self._servers.append(server)
+        self._threads.append(t)
+        t.start()
+
+    def _serve_forever(self, server: socketserver.BaseServer):
+        try:
+            server.serve_forever(poll_interval=0.5)
+        finally:
+            db_session_done()
+
+    def _write_frame(self, wfile, ack: dict, f_msgpack: bool):
+        data: bytes = self._encode(ack, f_msgpack)
+        flags: int = IngestListener.FRAME_MSGPACK if f_msgpack else 0
+        wfile.write(self._HEADER.pack(len(data) | flags) + data)
+        wfile.flush()
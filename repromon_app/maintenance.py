@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+from repromon_app.dao import DAO
+from repromon_app.db import db_session_done
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+############################################
+# Background DB maintenance
+
+INTERVAL_MONTH: str = "month"
+INTERVAL_WEEK: str = "week"
+
+
+def partition_end(start: datetime, interval: str) -> datetime:
+    """ Get the first partition boundary after start """
+    return partition_start(
+        partition_start(start, interval) + timedelta(days=32), interval) \
+        if interval == INTERVAL_MONTH \
+        else partition_start(start, interval) + timedelta(days=7)
+
+
+def partition_name(start: datetime) -> str:
+    return f"message_log_p{start:%Y%m%d}"
+
+
+def partition_start(ts: datetime, interval: str) -> datetime:
+    """ Get partition boundary at or before ts, i.e. the first day of
+    month or Monday of week """
+    day: datetime = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == INTERVAL_MONTH:
+        return day.replace(day=1)
+    return day - timedelta(days=day.weekday())
+
+
+# base class of background maintenance job running periodically in
+# own thread, subclasses implement _maintain and can extend stats
+class MaintenanceJob:
+    def __init__(self, run_interval_sec: int = 3600):
+        self._run_interval_sec: int = max(1, run_interval_sec)
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: threading.Thread = None
+        self._lock: threading.Lock = threading.Lock()
+        self._count_runs: int = 0
+        self._last_run_ms: float = 0
+        self._last_error: str = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self, now: datetime = None) -> dict:
+        """ Run maintenance once """
+        now = now or datetime.now()
+        logger.debug(f"run(now={str(now)})")
+        t0: float = time.monotonic()
+        try:
+            return self._maintain(now)
+        except BaseException:
+            DAO.message.rollback()
+            raise
+        finally:
+            with self._lock:
+                self._count_runs += 1
+                self._last_run_ms = (time.monotonic() - t0) * 1000.0
+
+    def start(self):
+        logger.debug("start()")
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name=type(self).__name__,
+                                        daemon=True)
+        self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.is_running(),
+                "runs": self._count_runs,
+                "last_run_ms": round(self._last_run_ms, 3),
+                "last_error": self._last_error,
+            }
+
+    def stop(self, timeout: float = 10.0):
+        logger.debug("stop()")
+        if not self.is_running():
+            return
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _maintain(self, now: datetime) -> dict:
+        raise NotImplementedError()
+
+    def _run(self):
+        logger.info(f"{type(self).__name__} started")
+        while not self._stop_event.is_set():
+            try:
+                self.run()
+                with self._lock:
+                    self._last_error = None
+            except BaseException as e:
+                logger.error(f"{type(self).__name__} failed: {str(e)}")
+                with self._lock:
+                    self._last_error = str(e)
+            finally:
+                db_session_done()
+            self._stop_event.wait(self._run_interval_sec)
+        logger.info(f"{type(self).__name__} stopped")
+
+
+# keeps message_log range partitions on event_on for Postgres, creates
+# partitions for the next premake intervals ahead of time and detaches
+# and drops partitions older than retention, does nothing when table is
+# not partitioned, e.g. on SQLite
+class MessageLogPartitioner(MaintenanceJob):
+    def __init__(self, interval: str = INTERVAL_MONTH, premake: int = 3,
+                 retention_days: int = 0, run_interval_sec: int = 3600,
+                 on_removed: Callable[[], None] = None):
+        """ Create partition maintenance job
+
+        :param interval: partition range, month or week
+        :param premake: number of future partitions to keep
+        :param retention_days: drop partitions with all rows older than
+                               this, 0 - keep forever
+        :param run_interval_sec: background job run interval
+        :param on_removed: called after partitions were dropped or rows
+                           deleted, e.g. to invalidate message log caches
+        """
+        if interval not in (INTERVAL_MONTH, INTERVAL_WEEK):
+            raise ValueError(f"Invalid partition interval: {interval}")
+        super().__init__(run_interval_sec)
+        self._interval: str = interval
+        self._premake: int = max(0, premake)
+        self._retention_days: int = max(0, retention_days)
+        self._on_removed: Callable[[], None] = on_removed
+        self._count_created: int = 0
+        self._count_dropped: int = 0
+        self._count_deleted: int = 0
+
+    def stats(self) -> dict:
+        res: dict = super().stats()
+        with self._lock:
+            res.update({
+                "interval": self._interval,
+                "created": self._count_created,
+                "dropped": self._count_dropped,
+                "deleted": self._count_deleted,
+            })
+        return res
+
+    def _create(self, partitions: list, now: datetime, res: dict):
+        default_name: str = partitions[0][0] \
+            if partitions[0][1] is None else None
+        ranges: list = [o for o in partitions if o[1] is not None]
+        target: datetime = partition_start(now, self._interval)
+        for _ in range(self._premake + 1):
+            target = partition_end(target, self._interval)
+        # continue from the last partition, so gaps are filled and rows
+        # of these ranges are moved out of default partition
+        start: datetime = ranges[-1][2] if ranges \
+            else partition_start(now, self._interval)
+        while start < target:
+            end: datetime = partition_end(start, self._interval)
+            name: str = partition_name(start)
+            logger.info(f"Create partition {name} [{start}, {end})")
+            DAO.message.add_message_log_partition(name, start, end,
+                                                  default_name)
+            DAO.message.commit()
+            res["created"].append(name)
+            start = end
+
+    def _drop(self, partitions: list, now: datetime, res: dict):
+        cutoff: datetime = now - timedelta(days=self._retention_days)
+        for name, start, end in partitions:
+            if start is None:
+                # default partition holds rows out of partitions range
+                res["deleted"] += DAO.message.delete_message_logs_before(
+                    name, cutoff)
+                DAO.message.commit()
+            elif end <= cutoff:
+                logger.info(f"Drop partition {name} [{start}, {end})")
+                DAO.message.drop_message_log_partition(name)
+                DAO.message.commit()
+                res["dropped"].append(name)
+        # keys of rows kept in partition spanning cutoff stay in place
+        keys_cutoff: datetime = min(
+            [cutoff] + [start for _, start, end in partitions
+                        if start is not None and end > cutoff])
+        DAO.message.delete_message_log_client_keys_before(keys_cutoff)
+        DAO.message.commit()
+
+    def _maintain(self, now: datetime) -> dict:
+        """ :return: created and dropped partition names and number of
+        rows deleted from default partition """
+        res: dict = {"created": [], "dropped": [], "deleted": 0}
+        try:
+            partitions: list = DAO.message.get_message_log_partitions()
+            if partitions:
+                self._create(partitions, now, res)
+                if self._retention_days > 0:
+                    self._drop(partitions, now, res)
+        finally:
+            if (res["dropped"] or res["deleted"]) and self._on_removed:
+                self._on_removed()
+            with self._lock:
+                self._count_created += len(res["created"])
+                self._count_dropped += len(res["dropped"])
+                self._count_deleted += res["deleted"]
+        return res
+
+
+# prunes message_log_recent rows older than MessageDAO.recent_hours, the
+# first run also copies recent visible rows missing there, e.g. after the
+# table is created or recent hours are increased
+class RecentMessagesPruner(MaintenanceJob):
+    def __init__(self, run_interval_sec: int = 60):
+        super().__init__(run_interval_sec)
+        self._count_pruned: int = 0
+        self._count_refreshed: int = 0
+        self._refreshed: bool = False
+
+    def stats(self) -> dict:
+        res: dict = super().stats()
+        with self._lock:
+            res.update({
+                "pruned": self._count_pruned,
+                "refreshed": self._count_refreshed,
+            })
+        return res
+
+    def _maintain(self, now: datetime) -> dict:
+        res: dict = {"pruned": 0, "refreshed": 0}
+        if DAO.message.recent_hours <= 0:
+            return res
+        res["pruned"] = DAO.message.delete_message_logs_recent_before(
+            now - timedelta(hours=DAO.message.recent_hours))
+        if not self._refreshed:
+            res["refreshed"] = DAO.message.refresh_message_log_recent()
+        DAO.message.commit()
+        self._refreshed = True
+        with self._lock:
+            self._count_pruned += res["pruned"]
+            self._count_refreshed += res["refreshed"]
+        return res
@@ -4,8 +4,8 @@ from enum import Enum, IntEnum
 from typing import Optional
 
 from pydantic import BaseModel
-from sqlalchemy import (JSON, TIMESTAMP, Column, Integer, String,
-                        UniqueConstraint)
+from sqlalchemy import (JSON, TIMESTAMP, Column, Index, Integer, String,
+                        UniqueConstraint, text)
 from sqlalchemy.orm import as_declarative
 
 logger = logging.getLogger(__name__)
@@ -123,6 +123,70 @@ class MessageLogInfoDTO(BasePydantic):
     device: str = None
     provider: str = None
     description: str = None
+    client_key: Optional[str] = None
+
+
+class MessageLogDeltaDTO(BasePydantic):
+    """Message log changes after watermark, new watermark is to be
+    passed to the next delta request
+    """
+
+    items: list[MessageLogInfoDTO] = []
+    hidden_ids: list[int] = []
+    since_id: Optional[int] = None
+    since_recorded_on: Optional[datetime.datetime] = None
+
+
+class MessageLogPageDTO(BasePydantic):
+    """Page of message log, cursors are opaque positions to fetch
+    next page forward or previous page backward, null if there is none
+    """
+
+    items: list[MessageLogInfoDTO] = []
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+class MessageQueuedDTO(BasePydantic):
+    """Message accepted by ingest queue, to be written in background
+    """
+
+    provisional_id: str = None
+    queue_depth: int = 0
+
+
+class MessageSendDTO(BasePydantic):
+    """Single message to be sent via MessageService
+    """
+
+    study: Optional[str] = None
+    category: str = None
+    level: str = None
+    device: Optional[str] = None
+    provider: str = None
+    description: str = None
+    payload: Optional[str] = None
+    event_on: Optional[datetime.datetime] = None
+    registered_on: Optional[datetime.datetime] = None
+    client_key: Optional[str] = None
+
+
+class MessageSendErrorDTO(BasePydantic):
+    """Error info for message rejected in batch send
+    """
+
+    index: int = 0
+    detail: str = None
+
+
+class MessageSendResultDTO(BasePydantic):
+    """Batch send result, message IDs are listed in the same order
+    as sent messages and are null for rejected or spooled ones
+    """
+
+    ids: list[Optional[int]] = []
+    errors: list[MessageSendErrorDTO] = []
+    spooled: list[int] = []
 
 
 class PushMessageDTO(BasePydantic):
@@ -254,23 +318,41 @@ class MessageLogEntity(BaseEntity):
     """Entity for "message_log" table
     """
     __tablename__ = 'message_log'
+    # indexes match MessageDAO query shapes, i.e. filter by category or
+    # study and order by event time, single column indexes are not used
+    # to keep ingest write cost low
+    __table_args__ = (
+        Index('idx_message_log_category_event', 'category_id', 'event_on',
+              'recorded_on'),
+        Index('idx_message_log_client_key', 'recorded_by', 'client_key',
+              unique=True),
+        Index('idx_message_log_event_key', 'event_on', 'recorded_on', 'id'),
+        Index('idx_message_log_study_visible', 'study_id', 'event_on',
+              'recorded_on',
+              sqlite_where=text("is_visible = 'Y'"),
+              postgresql_where=text("is_visible = 'Y'")),
+        Index('idx_message_log_visible_updated_on', 'visible_updated_on'),
+        # IDs of deleted, e.g. archived, rows are never reused
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     level_id = Column(Integer, nullable=False)
-    category_id = Column(Integer, nullable=False, index=True)
-    device_id = Column(Integer, nullable=False, index=True)
-    provider_id = Column(Integer, nullable=False, index=True)
-    study_id = Column(Integer, index=True)
-    study_name = Column(String(255), index=True)
-    is_visible = Column(String(1), default='Y', nullable=False, index=True)
+    category_id = Column(Integer, nullable=False)
+    device_id = Column(Integer, nullable=False)
+    provider_id = Column(Integer, nullable=False)
+    study_id = Column(Integer)
+    study_name = Column(String(255))
+    is_visible = Column(String(1), default='Y', nullable=False)
     visible_updated_on = Column(TIMESTAMP)
     visible_updated_by = Column(String(15))
     description = Column(String(255))
     payload = Column(JSON)
-    event_on = Column(TIMESTAMP, nullable=False, index=True)
+    event_on = Column(TIMESTAMP, nullable=False)
     registered_on = Column(TIMESTAMP, nullable=False)
     recorded_on = Column(TIMESTAMP, nullable=False)
     recorded_by = Column(String(15), nullable=False)
+    client_key = Column(String(64))
 
     def __repr__(self):
         return "MessageLogEntity(id={self.id}, " \
@@ -288,7 +370,67 @@ class MessageLogEntity(BaseEntity):
                "event_on='{self.event_on}', " \
                "registered_on='{self.registered_on}', " \
                "recorded_on='{self.recorded_on}', " \
-               "recorded_by='{self.recorded_by}')".format(self=self)
+               "recorded_by='{self.recorded_by}', " \
+               "client_key='{self.client_key}')".format(self=self)
+
+
+class MessageLogClientKeyEntity(BaseEntity):
+    """Entity for "message_log_client_key" table, idempotency keys of
+    message_log rows, unique per (recorded_by, client_key) regardless of
+    message_log partitioning
+    """
+    __tablename__ = 'message_log_client_key'
+    __table_args__ = (
+        Index('idx_message_log_client_key_event_on', 'event_on'),
+        Index('idx_message_log_client_key_message_id', 'message_id'),
+    )
+
+    recorded_by = Column(String(15), primary_key=True, nullable=False)
+    client_key = Column(String(64), primary_key=True, nullable=False)
+    message_id = Column(Integer, nullable=False)
+    event_on = Column(TIMESTAMP, nullable=False)
+
+    def __repr__(self):
+        return "MessageLogClientKeyEntity(" \
+               "recorded_by='{self.recorded_by}', " \
+               "client_key='{self.client_key}', " \
+               "message_id='{self.message_id}', " \
+               "event_on='{self.event_on}')".format(self=self)
+
+
+class MessageLogRecentEntity(BaseEntity):
+    """Entity for "message_log_recent" table, copy of visible message_log
+    rows of the last hours maintained on write to serve feedback screens
+    """
+    __tablename__ = 'message_log_recent'
+    __table_args__ = (
+        Index('idx_message_log_recent_category_event', 'category_id',
+              'event_on'),
+        Index('idx_message_log_recent_event_on', 'event_on'),
+        Index('idx_message_log_recent_study_event', 'study_id',
+              'category_id', 'event_on'),
+    )
+
+    id = Column(Integer, primary_key=True, nullable=False,
+                autoincrement=False)
+    level_id = Column(Integer, nullable=False)
+    category_id = Column(Integer, nullable=False)
+    device_id = Column(Integer, nullable=False)
+    provider_id = Column(Integer, nullable=False)
+    study_id = Column(Integer)
+    study_name = Column(String(255))
+    description = Column(String(255))
+    event_on = Column(TIMESTAMP, nullable=False)
+    registered_on = Column(TIMESTAMP, nullable=False)
+    recorded_on = Column(TIMESTAMP, nullable=False)
+    recorded_by = Column(String(15), nullable=False)
+    client_key = Column(String(64))
+
+    def __repr__(self):
+        return "MessageLogRecentEntity(id={self.id}, " \
+               "category_id='{self.category_id}', " \
+               "study_id='{self.study_id}', " \
+               "event_on='{self.event_on}')".format(self=self)
 
 
 class RoleEntity(BaseEntity):
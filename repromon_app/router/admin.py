@@ -8,7 +8,7 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from repromon_app.config import app_config, app_settings
-from repromon_app.dao import DAO
+from repromon_app.dao import DAO, RefData
 from repromon_app.model import MessageCategoryId, MessageLogEntity, Rolename
 from repromon_app.security import (SecurityContext, Token, security_check,
                                    security_context, web_basic_context)
@@ -100,10 +100,10 @@ def create_admin_router() -> APIRouter:
     ):
         logger.debug("send_fmessage")
         security_check(rolename=Rolename.ADMIN)
-        dao: DAO = DAO()
-        levels = dao.message.get_message_levels()
+        ref: RefData = DAO.ref_data.get_ref_data()
+        levels = ref.levels
         logger.debug(f"levels={str(levels)}")
-        providers = dao.message.get_data_providers()
+        providers = ref.providers
         logger.debug(f"providers={str(providers)}")
         return _templates.TemplateResponse("send_fmessage.j2", {
             "request": request,
@@ -1,15 +1,27 @@
 import logging
+import math
 from datetime import datetime
 from typing import Annotated, Optional
 
-from fastapi import (APIRouter, Depends, Query, Request, WebSocket,
-                     WebSocketDisconnect, WebSocketException)
+from fastapi import (APIRouter, Depends, HTTPException, Query, Request,
+                     Response, WebSocket, WebSocketDisconnect,
+                     WebSocketException, status)
+from fastapi.responses import JSONResponse, StreamingResponse
 
+from repromon_app.codec import (ARROW_MEDIA_TYPES, EXPORT_MEDIA_TYPES,
+                                MsgpackResponse, accepts_msgpack, body_list,
+                                body_list_openapi, etag_matches, negotiate,
+                                not_modified)
+from repromon_app.ingest import (IngestQueueFullError, IngestRateLimitError,
+                                 IngestSpool, is_db_unavailable)
 from repromon_app.model import (ApiKeyInfoDTO, DataProviderId, DeviceEntity,
                                 LoginInfoDTO, MessageCategoryId,
-                                MessageLevelId, MessageLogEntity,
-                                MessageLogInfoDTO, PushMessageDTO, RoleEntity,
-                                Rolename, StudyInfoDTO, UserEntity)
+                                MessageLevelId, MessageLogDeltaDTO,
+                                MessageLogEntity, MessageLogInfoDTO,
+                                MessageLogPageDTO, MessageQueuedDTO,
+                                MessageSendDTO, MessageSendResultDTO,
+                                PushMessageDTO, RoleEntity, Rolename,
+                                StudyInfoDTO, UserEntity)
 from repromon_app.security import (ApiKey, SecurityContext, SecurityManager,
                                    Token, security_check, security_context,
                                    web_oauth2_apikey_context,
@@ -43,11 +55,33 @@ class WebsocketChannel:
         self._connections.remove(conn)
 
 
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response generated while request body is still being
+    read, so it doesn't listen for client disconnect concurrently, as
+    that would consume request body messages
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
 def create_api_v1_router() -> APIRouter:
     api_v1_router = APIRouter()
     websocket_channel: WebsocketChannel = WebsocketChannel()
     PushService.channel = websocket_channel
 
+    def _check_rate_limit(username: str, count: int = 1):
+        try:
+            MessageService().check_rate_limit(username, count)
+        except IngestRateLimitError as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(e),
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
+
     ##############################################
     # AccountService public API
 
@@ -150,6 +184,133 @@ def create_api_v1_router() -> APIRouter:
     ##############################################
     # FeedbackService public API
 
+    # @security: role=data_collector, auth
+    @api_v1_router.get("/feedback/export_message_log",
+                       response_class=StreamingResponse,
+                       tags=["FeedbackService"],
+                       summary="export_message_log",
+                       description="Export all study message log rows as "
+                                   "CSV, NDJSON or JSON array streamed "
+                                   "from DB without row limit",
+                       responses={200: {"content": {
+                           t: {} for t in EXPORT_MEDIA_TYPES.values()}}})
+    def feedback_export_message_log(request: Request,
+                                    sec_ctx:
+                                    Annotated[SecurityContext, Depends(
+                                        web_oauth2_context)],
+                                    category_id: Optional[int] =
+                                    Query(None,
+                                          description="Category ID"),
+                                    study_id: Optional[int] =
+                                    Query(None,
+                                          description="Study ID"),
+                                    interval_sec: Optional[int] =
+                                    Query(None,
+                                          description="Interval in seconds "
+                                                      "for latest messages"),
+                                    fmt: str =
+                                    Query("ndjson", alias="format",
+                                          regex="^(csv|ndjson|json)$",
+                                          description="Export format, "
+                                                      "csv | ndjson | json"),
+                                    ) -> StreamingResponse:
+        logger.debug("feedback_export_message_log")
+        security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
+        return StreamingResponse(
+            FeedbackService().export_message_log(
+                category_id=category_id,
+                study_id=study_id,
+                interval_sec=interval_sec,
+                fmt=fmt),
+            media_type=EXPORT_MEDIA_TYPES[fmt],
+            headers={"Content-Disposition":
+                     f'attachment; filename="message_log.{fmt}"'})
+
+    # @security: role=data_collector, auth
+    @api_v1_router.get("/feedback/export_message_log_arrow",
+                       response_class=StreamingResponse,
+                       tags=["FeedbackService"],
+                       summary="export_message_log_arrow",
+                       description="Export message_log columns for "
+                                   "analytics as Arrow IPC stream or "
+                                   "Parquet file streamed from DB in record "
+                                   "batches, requires pyarrow",
+                       responses={200: {"content": {
+                           t: {} for t in ARROW_MEDIA_TYPES.values()}}})
+    def feedback_export_message_log_arrow(request: Request,
+                                          sec_ctx:
+                                          Annotated[SecurityContext, Depends(
+                                              web_oauth2_context)],
+                                          columns: Optional[list[str]] =
+                                          Query(None,
+                                                description="message_log "
+                                                            "columns, all "
+                                                            "by default"),
+                                          category_id: Optional[int] =
+                                          Query(None,
+                                                description="Category ID"),
+                                          study_id: Optional[int] =
+                                          Query(None,
+                                                description="Study ID"),
+                                          start_event_on: Optional[datetime] =
+                                          Query(None,
+                                                description="Include rows "
+                                                            "with event_on "
+                                                            "at or after"),
+                                          end_event_on: Optional[datetime] =
+                                          Query(None,
+                                                description="Include rows "
+                                                            "with event_on "
+                                                            "before"),
+                                          visible_only: bool =
+                                          Query(True,
+                                                description="Skip hidden "
+                                                            "rows"),
+                                          fmt: str =
+                                          Query("arrow", alias="format",
+                                                regex="^(arrow|parquet)$",
+                                                description="Export format, "
+                                                            "arrow | parquet"),
+                                          ) -> StreamingResponse:
+        logger.debug("feedback_export_message_log_arrow")
+        security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
+        try:
+            content = FeedbackService().export_message_log_arrow(
+                columns=columns,
+                category_id=category_id,
+                study_id=study_id,
+                start_event_on=start_event_on,
+                end_event_on=end_event_on,
+                visible_only=visible_only,
+                fmt=fmt)
+        except ImportError as e:
+            # optional pyarrow dependency is not installed
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                                detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=str(e))
+        return StreamingResponse(
+            content,
+            media_type=ARROW_MEDIA_TYPES[fmt],
+            headers={"Content-Disposition":
+                     f'attachment; filename="message_log.{fmt}"'})
+
+    # @security: admin
+    @api_v1_router.get("/feedback/get_cache_stats",
+                       response_model=object,
+                       tags=["FeedbackService"],
+                       summary="get_cache_stats",
+                       description="Get message log cache statistics")
+    def feedback_get_cache_stats(request: Request,
+                                 sec_ctx:
+                                 Annotated[SecurityContext, Depends(
+                                     web_oauth2_context)],
+                                 ) -> object:
+        logger.debug("feedback_get_cache_stats()")
+        security_check(rolename=Rolename.ADMIN)
+        return FeedbackService().get_cache_stats()
+
     # @security: role=data_collector, auth
     @api_v1_router.get("/feedback/get_devices",
                        response_model=list,
@@ -179,15 +340,23 @@ def create_api_v1_router() -> APIRouter:
                              ) -> MessageLogInfoDTO | None:
         logger.debug("feedback_get_message")
         security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
-        return FeedbackService().get_message(message_id)
+        return negotiate(request, FeedbackService().get_message(message_id))
 
     # @security: role=data_collector, auth
+    # DTOs are built by DAO, so response model is in docs only and
+    # rows are not validated again on response
     @api_v1_router.get("/feedback/get_message_log",
-                       response_model=list[MessageLogInfoDTO],
+                       response_model=None,
                        tags=["FeedbackService"],
                        summary="get_message_log",
-                       description="Get study message log info")
+                       description="Get study message log info, "
+                                   "when cache is enabled response has "
+                                   "ETag header and If-None-Match is "
+                                   "answered with 304 when log is not "
+                                   "changed",
+                       responses={200: {"model": list[MessageLogInfoDTO]}})
     def feedback_get_message_log(request: Request,
+                                 response: Response,
                                  sec_ctx:
                                  Annotated[SecurityContext, Depends(
                                      web_oauth2_context)],
@@ -200,20 +369,141 @@ def create_api_v1_router() -> APIRouter:
                                  Query(None,
                                        description="Interval in "
                                                    "seconds for latest messages"),
+                                 include_archive: bool =
+                                 Query(False,
+                                       description="Include archived "
+                                                   "messages when all "
+                                                   "messages are requested, "
+                                                   "interval reaching past "
+                                                   "archive boundary always "
+                                                   "includes them"),
                                  ) -> list[MessageLogInfoDTO]:
         logger.debug("feedback_get_message_log")
         security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
-        return FeedbackService().get_message_log(category_id=category_id,
-                                                 study_id=study_id,
-                                                 interval_sec=interval_sec)
+        # tag is taken before query, so concurrent change can only
+        # make it older than content
+        if FeedbackService.log_etag:
+            etag: str = '"' + FeedbackService().get_message_log_etag(
+                category_id, study_id, interval_sec, include_archive) + '"'
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            response.headers["ETag"] = etag
+        res: list[MessageLogInfoDTO] = FeedbackService().get_message_log(
+            category_id=category_id,
+            study_id=study_id,
+            interval_sec=interval_sec,
+            include_archive=include_archive)
+        return negotiate(request, res, MessageLogInfoDTO, response=response,
+                         prepared=True)
+
+    # @security: role=data_collector, auth
+    @api_v1_router.get("/feedback/get_message_log_delta",
+                       response_model=MessageLogDeltaDTO,
+                       tags=["FeedbackService"],
+                       summary="get_message_log_delta",
+                       description="Get study message log changes after "
+                                   "watermark, i.e. new messages and IDs of "
+                                   "hidden ones, pass since_id and "
+                                   "since_recorded_on from response to the "
+                                   "next call")
+    def feedback_get_message_log_delta(request: Request,
+                                       sec_ctx:
+                                       Annotated[SecurityContext, Depends(
+                                           web_oauth2_context)],
+                                       category_id: Optional[int] =
+                                       Query(None,
+                                             description="Category ID"),
+                                       study_id: Optional[int] =
+                                       Query(None,
+                                             description="Study ID"),
+                                       interval_sec: Optional[int] =
+                                       Query(None,
+                                             description="Interval in seconds "
+                                                         "for latest messages"),
+                                       since_id: Optional[int] =
+                                       Query(None,
+                                             description="Watermark message "
+                                                         "ID from previous "
+                                                         "response"),
+                                       since_recorded_on: Optional[datetime] =
+                                       Query(None,
+                                             description="Watermark timestamp "
+                                                         "from previous "
+                                                         "response"),
+                                       ) -> MessageLogDeltaDTO:
+        logger.debug("feedback_get_message_log_delta")
+        security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
+        return negotiate(request, FeedbackService().get_message_log_delta(
+            category_id=category_id,
+            study_id=study_id,
+            interval_sec=interval_sec,
+            since_id=since_id,
+            since_recorded_on=since_recorded_on))
+
+    # @security: role=data_collector, auth
+    @api_v1_router.get("/feedback/get_message_log_page",
+                       response_model=None,
+                       tags=["FeedbackService"],
+                       summary="get_message_log_page",
+                       description="Get page of study message log info, "
+                                   "use next_cursor/prev_cursor from "
+                                   "response to fetch next/previous page",
+                       responses={200: {"model": MessageLogPageDTO}})
+    def feedback_get_message_log_page(request: Request,
+                                      sec_ctx:
+                                      Annotated[SecurityContext, Depends(
+                                          web_oauth2_context)],
+                                      category_id: Optional[int] =
+                                      Query(None,
+                                            description="Category ID"),
+                                      study_id: Optional[int] =
+                                      Query(None,
+                                            description="Study ID"),
+                                      interval_sec: Optional[int] =
+                                      Query(None,
+                                            description="Interval in seconds "
+                                                        "for latest messages"),
+                                      cursor: Optional[str] =
+                                      Query(None,
+                                            description="Opaque page cursor, "
+                                                        "empty for the first "
+                                                        "or, backward, the "
+                                                        "last page"),
+                                      page_size: int =
+                                      Query(100, ge=1, le=10000,
+                                            description="Max messages per page"),
+                                      direction: str =
+                                      Query("forward",
+                                            regex="^(forward|backward)$",
+                                            description="Page direction, "
+                                                        "forward | backward"),
+                                      ) -> MessageLogPageDTO:
+        logger.debug("feedback_get_message_log_page")
+        security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
+        try:
+            res: MessageLogPageDTO = FeedbackService().get_message_log_page(
+                category_id=category_id,
+                study_id=study_id,
+                interval_sec=interval_sec,
+                cursor=cursor,
+                page_size=page_size,
+                backward=direction == "backward")
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=str(e))
+        return negotiate(request, res, prepared=True)
 
     # @security: role=data_collector, auth
     @api_v1_router.get("/feedback/get_study_header",
                        response_model=StudyInfoDTO | None,
                        tags=["FeedbackService"],
                        summary="get_study_header",
-                       description="Get study header info")
+                       description="Get study header info, response has "
+                                   "ETag header and If-None-Match is "
+                                   "answered with 304 when study is not "
+                                   "changed")
     def feedback_get_study_header(request: Request,
+                                  response: Response,
                                   sec_ctx:
                                   Annotated[SecurityContext, Depends(
                                       web_oauth2_context)],
@@ -222,7 +512,12 @@ def create_api_v1_router() -> APIRouter:
                                   ) -> StudyInfoDTO:
         logger.debug("feedback_get_study_header")
         security_check(rolename=[Rolename.ADMIN, Rolename.DATA_COLLECTOR])
-        return FeedbackService().get_study_header(study_id)
+        res: StudyInfoDTO = FeedbackService().get_study_header(study_id)
+        etag: str = '"' + FeedbackService().get_study_header_etag(res) + '"'
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+        return negotiate(request, res, response=response)
 
     # @security: role=data_collector, auth
     @api_v1_router.get("/feedback/set_message_log_visibility",
@@ -299,9 +594,53 @@ def create_api_v1_router() -> APIRouter:
     ##############################################
     # MessageService public API
 
+    # @security: admin
+    @api_v1_router.get("/message/get_ingest_stats",
+                       response_model=object,
+                       tags=["MessageService"],
+                       summary="get_ingest_stats",
+                       description="Get message ingest pipeline statistics")
+    def message_get_ingest_stats(request: Request,
+                                 sec_ctx:
+                                 Annotated[SecurityContext, Depends(
+                                     web_oauth2_context)],
+                                 ) -> object:
+        logger.debug("message_get_ingest_stats()")
+        security_check(rolename=Rolename.ADMIN)
+        return MessageService().get_ingest_stats()
+
+    # @security: admin
+    @api_v1_router.post("/message/refresh_ref_data",
+                        response_model=object,
+                        tags=["MessageService"],
+                        summary="refresh_ref_data",
+                        description="Reload categories, levels, devices and "
+                                    "providers reference data registry")
+    def message_refresh_ref_data(request: Request,
+                                 sec_ctx:
+                                 Annotated[SecurityContext, Depends(
+                                     web_oauth2_context)],
+                                 ) -> object:
+        logger.debug("message_refresh_ref_data()")
+        security_check(rolename=Rolename.ADMIN)
+        return MessageService().refresh_ref_data()
+
     # @security: admin | sys_data_entry
     @api_v1_router.post("/message/send_message",
                         response_model=MessageLogInfoDTO,
+                        responses={
+                            status.HTTP_202_ACCEPTED: {
+                                "model": MessageQueuedDTO,
+                                "description": "Message is queued when "
+                                               "ingest queue is enabled, "
+                                               "or spooled while DB is "
+                                               "unavailable"
+                            },
+                            status.HTTP_429_TOO_MANY_REQUESTS: {
+                                "description": "Ingest queue is full or "
+                                               "rate limit is exceeded"
+                            },
+                        },
                         tags=["MessageService"],
                         summary="send_message",
                         description="Send ReproMon message")
@@ -344,11 +683,19 @@ def create_api_v1_router() -> APIRouter:
                            description="Timestamp of "
                                        "registration in the ISO 8601 format like "
                                        "YYYY-MM-DDTHH:MM:SS.ssssss"),
+                     client_key: Optional[str] =
+                     Query(None,
+                           max_length=64,
+                           description="Optional client idempotency key, "
+                                       "retries with the same key return "
+                                       "the original message"),
                      ) -> MessageLogInfoDTO:
         logger.debug("send_message")
         security_check(rolename=[Rolename.ADMIN, Rolename.SYS_DATA_ENTRY])
-        o: MessageLogEntity = MessageService().send_message(
-            security_context().username,
+        username: str = security_context().username
+        _check_rate_limit(username)
+        args: tuple = (
+            username,
             None,
             study,
             MessageCategoryId.parse(category),
@@ -358,11 +705,100 @@ def create_api_v1_router() -> APIRouter:
             description,
             payload,
             event_on,
-            registered_on
+            registered_on,
+            client_key
         )
+
+        def _enqueue() -> JSONResponse:
+            try:
+                provisional_id: str = MessageService().enqueue_message(*args)
+            except IngestQueueFullError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=str(e),
+                    headers={"Retry-After": "1"}
+                )
+            content: dict = MessageQueuedDTO(
+                provisional_id=provisional_id,
+                queue_depth=MessageService().get_ingest_depth()
+            ).dict()
+            if accepts_msgpack(request):
+                return MsgpackResponse(content,
+                                       status_code=status.HTTP_202_ACCEPTED)
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                                content=content)
+
+        spool: IngestSpool = MessageService.ingest_spool
+        f_deferred: bool = MessageService.ingest_queue is not None or \
+            (spool is not None and spool.is_diverting())
+        # retries of already written messages are answered with original
+        if f_deferred and \
+                (username, client_key) not in MessageService.recent_keys:
+            return _enqueue()
+
+        try:
+            o: MessageLogEntity = MessageService().send_message(*args)
+        except BaseException as e:
+            if not spool or not is_db_unavailable(e):
+                raise
+            logger.error(f"DB is unavailable, spool message: {str(e)}")
+            spool.divert(str(e))
+            return _enqueue()
         logger.debug(f"id={o.id}")
-        res: MessageLogInfoDTO = FeedbackService().get_message(o.id)
-        return res
+        res: MessageLogInfoDTO = MessageService().get_message_info(o)
+        return negotiate(request, res)
+
+    # @security: admin | sys_data_entry
+    @api_v1_router.post("/message/send_messages",
+                        response_model=MessageSendResultDTO,
+                        tags=["MessageService"],
+                        summary="send_messages",
+                        description="Send batch of ReproMon messages in "
+                                    "single transaction, body is JSON array "
+                                    "or MessagePack array or column-oriented "
+                                    "map of messages",
+                        openapi_extra=body_list_openapi(MessageSendDTO))
+    def send_messages(request: Request,
+                      sec_ctx: Annotated[SecurityContext, Depends(
+                          web_oauth2_apikey_context)],
+                      messages: list[MessageSendDTO] =
+                      Depends(body_list(MessageSendDTO)),
+                      ) -> MessageSendResultDTO:
+        logger.debug(f"send_messages(count={len(messages)})")
+        security_check(rolename=[Rolename.ADMIN, Rolename.SYS_DATA_ENTRY])
+        _check_rate_limit(security_context().username, len(messages))
+        return negotiate(request,
+                         MessageService().send_messages(
+                             security_context().username, messages))
+
+    # @security: admin | sys_data_entry
+    @api_v1_router.post("/message/send_messages_stream",
+                        response_class=DuplexStreamingResponse,
+                        responses={
+                            status.HTTP_200_OK: {
+                                "content": {"application/x-ndjson": {}},
+                                "description": "NDJSON ack per each message "
+                                               "line with message ID or "
+                                               "error, and final summary"
+                            },
+                        },
+                        tags=["MessageService"],
+                        summary="send_messages_stream",
+                        description="Send ReproMon messages as NDJSON stream, "
+                                    "one JSON message per line, messages "
+                                    "are written in micro-batches while "
+                                    "body is still being received")
+    async def send_messages_stream(request: Request,
+                                   sec_ctx: Annotated[SecurityContext, Depends(
+                                       web_oauth2_apikey_context)],
+                                   ) -> DuplexStreamingResponse:
+        logger.debug("send_messages_stream")
+        security_check(rolename=[Rolename.ADMIN, Rolename.SYS_DATA_ENTRY])
+        return DuplexStreamingResponse(
+            MessageService().send_messages_stream(sec_ctx.username,
+                                                  request.stream()),
+            media_type="application/x-ndjson"
+        )
 
     ##############################################
     # SecSysService public API
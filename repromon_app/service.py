@@ -1,16 +1,35 @@
 import asyncio
+import base64
+import hashlib
+import json
 import logging
-from datetime import datetime
-
-from repromon_app.config import app_settings
-from repromon_app.dao import DAO
-from repromon_app.model import (ApiKeyInfoDTO, DeviceEntity, LoginInfoDTO,
-                                MessageLevelId, MessageLogEntity,
-                                MessageLogInfoDTO, PushMessageDTO, RoleEntity,
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import AsyncIterator, Iterator
+
+from repromon_app.cache import (LogCache, LogVersions, RecentLogBuffer,
+                                SingleFlight)
+from repromon_app.codec import export_arrow, export_rows
+from repromon_app.config import app_config, app_settings
+from repromon_app.dao import DAO, RefData, message_log_schema
+from repromon_app.ingest import (IngestListener, IngestQueue,
+                                 IngestQueueFullError, IngestRateLimitError,
+                                 IngestSpool, IngestWriteError, RateLimiter,
+                                 RecentKeys, is_db_unavailable)
+from repromon_app.maintenance import (MessageLogPartitioner,
+                                      RecentMessagesPruner)
+from repromon_app.model import (ApiKeyInfoDTO, DataProviderId, DeviceEntity,
+                                LoginInfoDTO, MessageCategoryId,
+                                MessageLevelId, MessageLogDeltaDTO,
+                                MessageLogEntity, MessageLogInfoDTO,
+                                MessageLogPageDTO, MessageSendDTO,
+                                MessageSendErrorDTO, MessageSendResultDTO,
+                                PushMessageDTO, RoleEntity, Rolename,
                                 SecUserDeviceEntity, SecUserRoleEntity,
                                 StudyDataEntity, StudyInfoDTO, UserEntity)
-from repromon_app.security import (ApiKey, SecurityManager, Token,
-                                   security_context)
+from repromon_app.security import (ApiKey, SecurityContext, SecurityManager,
+                                   Token, security_context)
 
 logger = logging.getLogger(__name__)
 logger.debug(f"name={__name__}")
@@ -20,6 +39,43 @@ logger.debug(f"name={__name__}")
 # Services
 
 
+def _decode_cursor(cursor: str) -> tuple[datetime, datetime, int]:
+    try:
+        data: list = json.loads(base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4)))
+        return (datetime.fromisoformat(data[0]),
+                datetime.fromisoformat(data[1]),
+                int(data[2]))
+    except BaseException:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _encode_cursor(o: MessageLogInfoDTO) -> str:
+    # message log (event_on, recorded_on, id) key
+    data: str = json.dumps([o.event_on.isoformat(),
+                            o.recorded_on.isoformat(), o.id])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def _log_buffer_entries(ref: RefData, rows: list[dict]) -> list[tuple]:
+    """ Map visible message_log rows to RecentLogBuffer entries """
+    return [
+        (row["category_id"], row["level_id"],
+         ref.message_log_info(SimpleNamespace(**row,
+                                              study=row["study_name"])))
+        for row in rows if row.get("is_visible", "Y") == "Y"
+    ]
+
+
+def _naive_datetime(ts: datetime) -> datetime:
+    """ Convert timezone aware datetime, e.g. MessagePack timestamp or
+    ISO string with offset, to naive server local time as message_log
+    timestamps are """
+    if ts is None or ts.tzinfo is None:
+        return ts
+    return ts.astimezone().replace(tzinfo=None)
+
+
 # base class for all business services
 class BaseService:
     def __init__(self):
@@ -76,12 +132,79 @@ class AccountService(BaseService):
 
 # service for feedback screen
 class FeedbackService(BaseService):
+    # message log versions used as ETag by read endpoints and as cache
+    # entry versions
+    log_versions: LogVersions = LogVersions()
+    # versions see writes of this process only, so get_message_log
+    # ETag is issued with single writer process only, as cache is
+    log_etag: bool = False
+    # message log query result cache, None when disabled
+    log_cache: LogCache = None
+    # recent messages per study serving interval queries, None when
+    # disabled
+    log_buffer: RecentLogBuffer = None
+    # coalescing of identical concurrent message log queries
+    log_flight: SingleFlight = SingleFlight()
+    # delta watermark overlap covering commit lag of concurrent writes
+    delta_overlap_sec: int = 5
+
     def __init__(self):
         super().__init__()
 
+    def export_message_log(self, category_id: int = None,
+                           study_id: int = None,
+                           interval_sec: int = None,
+                           fmt: str = "ndjson") -> Iterator[str]:
+        """ Stream all matching message log rows encoded in export
+        format, rows are read from DB lazily while result is consumed """
+        logger.debug(f"export_message_log(category_id={str(category_id)},"
+                     f" study_id={str(study_id)},"
+                     f" interval_sec={str(interval_sec)}, fmt={fmt})")
+        return export_rows(
+            self.dao.message.iter_message_log_infos(
+                category_id, study_id, interval_sec,
+                app_config().feedback.export_batch_size),
+            fmt, MessageLogInfoDTO)
+
+    def export_message_log_arrow(self, columns: list[str] = None,
+                                 category_id: int = None,
+                                 study_id: int = None,
+                                 start_event_on: datetime = None,
+                                 end_event_on: datetime = None,
+                                 visible_only: bool = True,
+                                 fmt: str = "arrow") -> Iterator[bytes]:
+        """ Stream message_log columns for analytics as Arrow IPC stream
+        or Parquet file, rows are read from DB lazily in record batches
+
+        :raise ImportError: if pyarrow is not installed
+        :raise ValueError: on unknown column name or format
+        """
+        logger.debug(f"export_message_log_arrow(columns={str(columns)},"
+                     f" category_id={str(category_id)},"
+                     f" study_id={str(study_id)},"
+                     f" start_event_on={str(start_event_on)},"
+                     f" end_event_on={str(end_event_on)}, fmt={fmt})")
+        return export_arrow(
+            self.dao.message.iter_message_log_batches(
+                columns, category_id, study_id, start_event_on,
+                end_event_on, visible_only,
+                app_config().feedback.export_arrow_batch_size),
+            message_log_schema(columns), fmt)
+
+    def get_cache_stats(self) -> dict:
+        logger.debug("get_cache_stats()")
+        return {
+            "buffer": FeedbackService.log_buffer.stats()
+            if FeedbackService.log_buffer else None,
+            "cache": FeedbackService.log_cache.stats()
+            if FeedbackService.log_cache else None,
+            "flight": FeedbackService.log_flight.stats(),
+            "versions": FeedbackService.log_versions.stats(),
+        }
+
     def get_devices(self) -> list[DeviceEntity]:
         logger.debug("get_devices()")
-        return self.dao.message.get_devices()
+        return self.dao.ref_data.get_ref_data().devices
 
     def get_message(self, message_id: int) -> MessageLogInfoDTO:
         logger.debug(f"get_message(message_id={str(message_id)})")
@@ -89,17 +212,162 @@ class FeedbackService(BaseService):
 
     def get_message_log(self, category_id: int = None,
                         study_id: int = None,
-                        interval_sec: int = None
+                        interval_sec: int = None,
+                        include_archive: bool = False
                         ) -> list[MessageLogInfoDTO]:
         logger.debug(f"get_message_log(category_id={str(category_id)} "
-                     f"study_id={str(study_id)})")
-        return self.dao.message.get_message_log_infos(category_id,
-                                                      study_id, interval_sec)
+                     f"study_id={str(study_id)}, "
+                     f"include_archive={include_archive})")
+        if FeedbackService.log_buffer and interval_sec:
+            res: list[MessageLogInfoDTO] = FeedbackService.log_buffer.get(
+                category_id, study_id, interval_sec)
+            if res is not None:
+                return res
+        cache: LogCache = FeedbackService.log_cache
+        key: tuple = (category_id, study_id, interval_sec, include_archive)
+        # version also includes interval bucket, and it is taken before
+        # query, so result of query concurrent with change is not reused
+        version: str = self.get_message_log_etag(category_id, study_id,
+                                                 interval_sec,
+                                                 include_archive)
+        if cache:
+            res = cache.get(key, version)
+            if res is not None:
+                return res
+
+        def _query() -> list[MessageLogInfoDTO]:
+            items: list[MessageLogInfoDTO] = \
+                self.dao.message.get_message_log_infos(category_id,
+                                                       study_id,
+                                                       interval_sec,
+                                                       include_archive)
+            if cache:
+                cache.put(key, version, items)
+            return items
+
+        # concurrent callers with the same key and version share result
+        # of the first one
+        return FeedbackService.log_flight.do(key + (version,), _query)
+
+    def get_message_log_etag(self, category_id: int = None,
+                             study_id: int = None,
+                             interval_sec: int = None,
+                             include_archive: bool = False) -> str:
+        """ Get ETag of get_message_log result without running the query.
+        Interval window moves with time, so tag also changes every
+        1/60 of interval """
+        etag: str = FeedbackService.log_versions.get(category_id, study_id)
+        if include_archive:
+            etag += "-archive"
+        if interval_sec:
+            step: int = max(1, interval_sec // 60)
+            etag += f"-{interval_sec}-{int(time.time()) // step}"
+        return etag
+
+    def get_message_log_delta(self, category_id: int = None,
+                              study_id: int = None,
+                              interval_sec: int = None,
+                              since_id: int = None,
+                              since_recorded_on: datetime = None
+                              ) -> MessageLogDeltaDTO:
+        """ Get messages inserted or with visibility changed after
+        watermark from previous response, all visible messages if no
+        watermark specified, rows can repeat, so clients should merge
+        them by message ID. Watermark is moved back by overlap, as rows
+        of concurrent transactions can be committed out of ID order """
+        logger.debug(f"get_message_log_delta(category_id={str(category_id)} "
+                     f"study_id={str(study_id)}, since_id={since_id}, "
+                     f"since_recorded_on={since_recorded_on})")
+        # taken before query, so rows committed meanwhile come next time,
+        # rows recorded within overlap can still have uncommitted ones
+        # with lower ID, so they do not move ID watermark
+        cutoff: datetime = datetime.now() - \
+            timedelta(seconds=FeedbackService.delta_overlap_sec)
+        items, hidden_ids = self.dao.message.get_message_log_delta(
+            category_id, study_id, interval_sec, since_id, since_recorded_on)
+        ids: list[int] = [o.id for o in items if o.recorded_on <= cutoff]
+        return MessageLogDeltaDTO(
+            items=items,
+            hidden_ids=hidden_ids,
+            since_id=max(ids + [since_id or 0]),
+            since_recorded_on=cutoff
+        )
+
+    def get_message_log_page(self, category_id: int = None,
+                             study_id: int = None,
+                             interval_sec: int = None,
+                             cursor: str = None,
+                             page_size: int = 100,
+                             backward: bool = False) -> MessageLogPageDTO:
+        """ Get page of message log using keyset pagination
+
+        :param cursor: opaque cursor from previous page next_cursor
+                       (forward) or prev_cursor (backward), None to
+                       start from the first or, backward, the last page
+        :param page_size: max number of messages per page
+        :param backward: fetch page before cursor
+        """
+        logger.debug(f"get_message_log_page(category_id={str(category_id)} "
+                     f"study_id={str(study_id)}, cursor={cursor}, "
+                     f"page_size={page_size}, backward={backward})")
+        key: tuple = _decode_cursor(cursor) if cursor else None
+        # one extra row tells if there is more in this direction
+        items: list[MessageLogInfoDTO] = self.dao.message.get_message_log_page(
+            category_id, study_id, interval_sec, key, backward, page_size + 1)
+        f_more: bool = len(items) > page_size
+        if f_more:
+            items = items[1:] if backward else items[:-1]
+
+        res: MessageLogPageDTO = MessageLogPageDTO(items=items)
+        if not items:
+            return res
+        first: str = _encode_cursor(items[0])
+        last: str = _encode_cursor(items[-1])
+        if backward:
+            res.prev_cursor = first if f_more else None
+            res.next_cursor = last if cursor else None
+        else:
+            res.next_cursor = last if f_more else None
+            res.prev_cursor = first if cursor else None
+        return res
 
     def get_study_header(self, study_id: int) -> StudyInfoDTO:
         logger.debug(f"get_study_header(study_id={str(study_id)})")
         return self.dao.study.get_study_info(study_id)
 
+    def get_study_header_etag(self, header: StudyInfoDTO) -> str:
+        """ Get ETag of get_study_header result, study_data has no change
+        marker, so hash of header itself is used """
+        return hashlib.sha1(
+            (header.json() if header else "null").encode()).hexdigest()
+
+    def invalidate_message_log(self):
+        """ Drop cached message log state after messages were removed
+        outside of services, e.g. by partition maintenance """
+        logger.debug("invalidate_message_log()")
+        FeedbackService.log_versions.bump_all()
+        if FeedbackService.log_cache:
+            FeedbackService.log_cache.clear()
+        if FeedbackService.log_buffer:
+            FeedbackService.log_buffer.reset()
+
+    def load_message_log_buffer(self, horizon_sec: int,
+                                limit: int) -> int:
+        """ Fill recent messages buffer from DB, so interval queries are
+        served right after start """
+        logger.debug(f"load_message_log_buffer(horizon_sec={horizon_sec},"
+                     f" limit={limit})")
+        started_on: datetime = datetime.now() - timedelta(seconds=horizon_sec)
+        rows: list[dict] = self.dao.message.get_message_logs_after(started_on,
+                                                                   limit)
+        if len(rows) >= limit:
+            # rows with the same event_on as the oldest one can be cut
+            started_on = rows[0]["event_on"] + timedelta(microseconds=1)
+        FeedbackService.log_buffer.load(
+            _log_buffer_entries(self.dao.ref_data.get_ref_data(), rows),
+            started_on)
+        return len(rows)
+
     def set_message_log_visibility(self, category_id: int,
                                    visible: bool, level: str,
                                    interval_sec: int) -> int:
@@ -117,6 +385,9 @@ class FeedbackService(BaseService):
                                                              security_context().username)
         self.dao.message.commit()
         if res > 0:
+            FeedbackService.log_versions.bump_category(category_id)
+            if FeedbackService.log_buffer:
+                FeedbackService.log_buffer.reset()
             PushService().push_message("feedback-log-refresh",
                                        {"category_id": category_id})
         return res
@@ -133,6 +404,14 @@ class FeedbackService(BaseService):
             ids, v, security_context().username)
         self.dao.message.commit()
         if res > 0:
+            for key in self.dao.message.get_message_log_keys(ids):
+                FeedbackService.log_versions.bump(*key)
+            if FeedbackService.log_buffer:
+                FeedbackService.log_buffer.remove(ids)
+                if visible:
+                    FeedbackService.log_buffer.add(_log_buffer_entries(
+                        self.dao.ref_data.get_ref_data(),
+                        self.dao.message.get_message_logs(ids)))
             if visible:
                 PushService().push_message("feedback-log-refresh",
                                            {"category_id": category_id})
@@ -165,9 +444,209 @@ class LoginService(BaseService):
 
 # service to handle messaging functionality
 class MessageService(BaseService):
+    # optional write-behind ingest queue, see [ingest] config section
+    ingest_queue: IngestQueue = None
+    # optional durable disk spool, see [ingest] config section
+    ingest_spool: IngestSpool = None
+    # recently used idempotency keys, (username, client_key) -> message ID
+    recent_keys: RecentKeys = RecentKeys()
+    # optional local socket listener, see [ingest] config section
+    ingest_listener: IngestListener = None
+    # optional per user ingest rate limiter, see [ingest] config section
+    rate_limiter: RateLimiter = None
+    # message_log partition maintenance job, None when disabled
+    log_partitioner: MessageLogPartitioner = None
+    # message_log_recent pruning job, None when disabled
+    recent_pruner: RecentMessagesPruner = None
+    # device of messages sent without device
+    default_device_id: int = 1
+
     def __init__(self):
         super().__init__()
 
+    def accept_messages(self, username: str,
+                        messages: list[dict]) -> tuple[list, list[dict]]:
+        """ Accept raw messages from local ingest listener, messages are
+        put into ingest queue or spool when enabled and written to DB
+        otherwise
+
+        :return: message IDs (provisional ones for queued or spooled
+                 messages, None for rejected), and errors list
+        """
+        logger.debug(f"accept_messages(username={username}, "
+                     f"count={len(messages)})")
+        self.check_rate_limit(username, len(messages))
+        ids: list = [None] * len(messages)
+        errors: list[dict] = []
+        indexes: list[int] = []
+        values: list[dict] = []
+        for index, m in enumerate(messages):
+            try:
+                values.append(self._message_send_values(
+                    username, MessageSendDTO.parse_obj(m)))
+                indexes.append(index)
+            except BaseException as e:
+                errors.append({"index": index, "detail": str(e)})
+
+        if not values:
+            return ids, errors
+
+        if MessageService.ingest_queue:
+            for index, v in zip(indexes, values):
+                try:
+                    ids[index] = MessageService.ingest_queue.put(v)
+                except IngestQueueFullError as e:
+                    errors.append({"index": index, "detail": str(e)})
+        elif MessageService.ingest_spool:
+            for index, provisional_id in zip(
+                    indexes, MessageService.ingest_spool.put_all(values)):
+                ids[index] = provisional_id
+        else:
+            try:
+                written: list[int] = self.ingest_messages(values)
+            except IngestWriteError as e:
+                written = e.ids
+                errors.extend({"index": indexes[i], "detail": detail}
+                              for i, detail in e.errors.items())
+                errors.sort(key=lambda o: o["index"])
+            for index, message_id in zip(indexes, written):
+                ids[index] = message_id
+        return ids, errors
+
+    def authenticate_ingest(self, apikey: str) -> str:
+        """ Resolve API key to username allowed to send messages """
+        mgr: SecurityManager = SecurityManager.instance()
+        username: str = mgr.get_username_by_apikey(apikey)
+        ctx: SecurityContext = mgr.create_context_by_username(username)
+        if not ctx.has_role(Rolename.ADMIN) and \
+                not ctx.has_role(Rolename.SYS_DATA_ENTRY):
+            raise Exception(f"User {username} is not allowed to send "
+                            f"messages")
+        return username
+
+    def check_rate_limit(self, username: str, count: int = 1):
+        """ Take count messages from user rate limit, raises
+        IngestRateLimitError when limit is exceeded """
+        limiter: RateLimiter = MessageService.rate_limiter
+        if not limiter:
+            return
+        ctx: SecurityContext = \
+            SecurityManager.instance().create_context_by_username(username)
+        retry_after: float = limiter.acquire(username, ctx.rolenames, count)
+        if retry_after > 0:
+            raise IngestRateLimitError(
+                f"Rate limit exceeded for {username}, retry after "
+                f"{retry_after:.3f} sec", retry_after)
+
+    def enqueue_message(
+            self,
+            username: str,
+            study_id: int,
+            study_name: str,
+            category_id: int,
+            level_id: int,
+            device_id: int,
+            provider_id: int,
+            description: str,
+            payload: str,
+            event_on: datetime = None,
+            registered_on: datetime = None,
+            client_key: str = None
+    ) -> str:
+        logger.debug("enqueue_message(...)")
+        if not MessageService.ingest_queue and not MessageService.ingest_spool:
+            raise Exception("Neither ingest queue nor spool is enabled")
+
+        # study name lookup is skipped while DB is unavailable
+        f_db: bool = not MessageService.ingest_spool or \
+            not MessageService.ingest_spool.is_diverting()
+        sd: StudyDataEntity = self.dao.study.get_study_data(study_id) \
+            if study_id and f_db else None
+        if sd and not study_name:
+            study_name = sd.name
+
+        values: dict = self._message_values(
+            username, study_id, study_name, category_id, level_id,
+            device_id, provider_id, description, payload,
+            event_on, registered_on, client_key)
+        if MessageService.ingest_queue:
+            return MessageService.ingest_queue.put(values)
+        return MessageService.ingest_spool.put_all([values])[0]
+
+    def get_ingest_stats(self) -> dict:
+        logger.debug("get_ingest_stats()")
+        return {
+            "listener": MessageService.ingest_listener.stats()
+            if MessageService.ingest_listener else None,
+            "queue": MessageService.ingest_queue.stats()
+            if MessageService.ingest_queue else None,
+            "rate_limit": MessageService.rate_limiter.stats()
+            if MessageService.rate_limiter else None,
+            "recent_keys": MessageService.recent_keys.stats(),
+            "spool": MessageService.ingest_spool.stats()
+            if MessageService.ingest_spool else None,
+        }
+
+    def get_ingest_depth(self) -> int:
+        """ Number of messages accepted but not yet written """
+        depth: int = 0
+        if MessageService.ingest_queue:
+            depth += MessageService.ingest_queue.depth
+        if MessageService.ingest_spool:
+            depth += MessageService.ingest_spool.pending
+        return depth
+
+    def get_message_info(self, msg: MessageLogEntity) -> MessageLogInfoDTO:
+        """ Build message log info from entity, reference names
+        are resolved via reference data registry rather than joined in DB """
+        logger.debug(f"get_message_info(id={str(msg.id)})")
+        ref: RefData = self.dao.ref_data.get_ref_data()
+        return MessageLogInfoDTO(
+            id=msg.id,
+            study_id=msg.study_id,
+            study=msg.study_name,
+            event_on=msg.event_on,
+            registered_on=msg.registered_on,
+            recorded_on=msg.recorded_on,
+            recorded_by=msg.recorded_by,
+            category=ref.category_name(msg.category_id),
+            level=ref.level_name(msg.level_id),
+            device_id=msg.device_id,
+            device=ref.device_kind(msg.device_id),
+            provider=ref.provider_name(msg.provider_id),
+            description=msg.description,
+            client_key=msg.client_key
+        )
+
+    def ingest_messages(self, values: list[dict]) -> list[int]:
+        """ Write messages to DB, or to ingest spool while DB is
+        unavailable or slow, IDs of spooled messages are None """
+        logger.debug(f"ingest_messages(count={len(values)})")
+        spool: IngestSpool = MessageService.ingest_spool
+        if not spool:
+            return self.write_messages(values)
+
+        if not spool.is_diverting():
+            try:
+                return self.write_messages(values)
+            except BaseException as e:
+                if not is_db_unavailable(e):
+                    raise
+                spool.divert(str(e))
+        spool.put_all(values)
+        return [None] * len(values)
+
+    def refresh_ref_data(self) -> dict:
+        logger.debug("refresh_ref_data()")
+        ref: RefData = self.dao.ref_data.refresh()
+        return {"version": ref.version, "loaded_on": ref.loaded_on}
+
+    def replay_messages(self, values: list[dict]) -> list[int]:
+        """ Write messages replayed from ingest spool, replay write time
+        is not observed as ingest latency, so replay does not divert
+        live writes to spool again """
+        return self.write_messages(values, replay=True)
+
     def send_message(
             self,
             username: str,
@@ -180,49 +659,423 @@ class MessageService(BaseService):
             description: str,
             payload: str,
             event_on: datetime = None,
-            registered_on: datetime = None
+            registered_on: datetime = None,
+            client_key: str = None
     ) -> MessageLogEntity:
         logger.debug("send_message(...)")
+        self._check_client_key(client_key)
+        key: tuple[str, str] = (username, client_key)
+        if client_key:
+            message_id: int = MessageService.recent_keys.get(key)
+            if message_id:
+                logger.debug(f"duplicate client_key, message_id={message_id}")
+                return self.dao.message.get_message_log(message_id)
+
         sd: StudyDataEntity = self.dao.study.get_study_data(study_id) \
             if study_id else None
-
-        msg: MessageLogEntity = MessageLogEntity()
-        msg.study_id = study_id
-        if sd:
-            msg.study_name = sd.name
-        if study_name:
-            msg.study_name = study_name
-        msg.category_id = category_id
-        msg.level_id = level_id
-        msg.provider_id = provider_id
-        msg.is_visible = "Y"
-        msg.description = description
-        msg.payload = payload
-        msg.event_on = event_on if event_on else datetime.now()
-        msg.registered_on = registered_on if registered_on else datetime.now()
-        msg.device_id = device_id
-        msg.recorded_on = datetime.now()
-        msg.recorded_by = username
-
-        self.dao.message.add(msg)
-        self.dao.message.commit()
+        if sd and not study_name:
+            study_name = sd.name
+
+        values: dict = self._message_values(
+            username, study_id, study_name, category_id, level_id,
+            device_id, provider_id, description, payload,
+            event_on, registered_on, client_key)
+        try:
+            message_id = self._add_message_logs([values])[0]
+        except BaseException:
+            # key may be evicted from recent keys but still in DB
+            message_ids: dict = self._find_client_keys([key]) \
+                if client_key else {}
+            if key not in message_ids:
+                raise
+            logger.debug(f"duplicate client_key, "
+                         f"message_id={message_ids[key]}")
+            return self.dao.message.get_message_log(message_ids[key])
+
+        # entity is built from inserted values, so it is not
+        # read back from DB after commit
+        msg: MessageLogEntity = MessageLogEntity(id=message_id, **values)
         logger.debug(f"msg={str(msg)}")
+        if client_key:
+            MessageService.recent_keys.put(key, msg.id)
 
         # send push notifications
         # NOTE: in future it should be published to message broker
         # rather than via PushService directly.
         PushService().push_message("feedback-log-add", {
             "category_id": category_id,
-            "study_id": msg.study_id,
+            "study_id": study_id,
             "message_id": msg.id})
         return msg
 
+    def send_messages(
+            self,
+            username: str,
+            messages: list[MessageSendDTO]
+    ) -> MessageSendResultDTO:
+        logger.debug(f"send_messages(username={username}, "
+                     f"count={len(messages)})")
+        res: MessageSendResultDTO = MessageSendResultDTO(
+            ids=[None] * len(messages), errors=[])
+        indexes: list[int] = []
+        values: list[dict] = []
+
+        for index, m in enumerate(messages):
+            try:
+                values.append(self._message_send_values(username, m))
+                indexes.append(index)
+            except BaseException as e:
+                logger.debug(f"reject message #{index}: {str(e)}")
+                res.errors.append(MessageSendErrorDTO(index=index,
+                                                      detail=str(e)))
+
+        if not values:
+            return res
+
+        failed: set[int] = set()
+        try:
+            ids: list[int] = self.ingest_messages(values)
+        except IngestWriteError as e:
+            ids = e.ids
+            for i, detail in e.errors.items():
+                failed.add(indexes[i])
+                res.errors.append(MessageSendErrorDTO(index=indexes[i],
+                                                      detail=detail))
+            res.errors.sort(key=lambda o: o.index)
+        for index, message_id in zip(indexes, ids):
+            res.ids[index] = message_id
+            if message_id is None and index not in failed:
+                res.spooled.append(index)
+        return res
+
+    async def send_messages_stream(
+            self,
+            username: str,
+            chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[str]:
+        """ Parse NDJSON messages stream incrementally and write them
+        in micro-batches, yields NDJSON ack per each non-empty line
+
+        :param username: name of user sending messages
+        :param chunks: raw body chunks as they are received
+        :return: iterator over NDJSON ack lines
+        """
+        logger.debug(f"send_messages_stream(username={username})")
+        batch_size: int = max(1, app_config().ingest.stream_batch_size)
+        max_line_size: int = app_config().ingest.stream_max_line_size
+        buf: bytearray = bytearray()
+        f_overflow: bool = False
+        line_no: int = 0
+        count_ids: int = 0
+        count_spooled: int = 0
+        count_errors: int = 0
+        # pending items as (line number, message_log values, error)
+        items: list[tuple[int, dict, str]] = []
+
+        def _parse(line: bytes):
+            nonlocal line_no
+            line_no += 1
+            if f_overflow:
+                items.append((line_no, None,
+                              f"Line exceeds {max_line_size} bytes"))
+            elif line.strip():
+                try:
+                    values: dict = self._message_send_values(
+                        username, MessageSendDTO.parse_raw(line))
+                    self.check_rate_limit(username)
+                    items.append((line_no, values, None))
+                except BaseException as e:
+                    items.append((line_no, None, str(e)))
+
+        async def _flush() -> list[str]:
+            nonlocal count_ids, count_spooled, count_errors
+            values: list[dict] = [v for _, v, _ in items if v]
+            ids: list[int] = []
+            # write errors of batch or by message index in batch
+            error: str = None
+            errors: dict[int, str] = {}
+            if values:
+                try:
+                    ids = await asyncio.to_thread(self.ingest_messages, values)
+                except IngestWriteError as e:
+                    ids, errors = e.ids, e.errors
+                except BaseException as e:
+                    logger.error(f"Failed write messages: {str(e)}")
+                    error = str(e)
+            it_ids = iter(enumerate(ids))
+            acks: list[str] = []
+            for n, v, err in items:
+                if v and not error:
+                    i, message_id = next(it_ids)
+                    if i in errors:
+                        count_errors += 1
+                        acks.append(json.dumps({"line": n,
+                                                "error": errors[i]}))
+                    elif message_id is None:
+                        count_spooled += 1
+                        acks.append(json.dumps({"line": n, "spooled": True}))
+                    else:
+                        count_ids += 1
+                        acks.append(json.dumps({"line": n, "id": message_id}))
+                else:
+                    count_errors += 1
+                    acks.append(json.dumps({"line": n,
+                                            "error": err if err else error}))
+            items.clear()
+            return acks
+
+        async for chunk in chunks:
+            start: int = 0
+            while start < len(chunk):
+                pos: int = chunk.find(b"\n", start)
+                end: int = pos if pos >= 0 else len(chunk)
+                if not f_overflow:
+                    buf += chunk[start:end]
+                    if len(buf) > max_line_size:
+                        f_overflow = True
+                        buf.clear()
+                if pos < 0:
+                    break
+                _parse(bytes(buf))
+                buf.clear()
+                f_overflow = False
+                start = pos + 1
+                if sum(1 for _, v, _ in items if v) >= batch_size:
+                    for ack in await _flush():
+                        yield ack + "\n"
+
+            # flush on every received chunk, so slow producers
+            # get acks without waiting for the full batch
+            for ack in await _flush():
+                yield ack + "\n"
+
+        if buf or f_overflow:
+            _parse(bytes(buf))
+        for ack in await _flush():
+            yield ack + "\n"
+        yield json.dumps({"done": True, "lines": line_no,
+                          "ids": count_ids, "spooled": count_spooled,
+                          "errors": count_errors}) + "\n"
+
+    def write_messages(self, values: list[dict],
+                       replay: bool = False) -> list[int]:
+        """ Write messages to DB in single transaction, when it fails
+        messages are written one by one in savepoints, so only ones
+        rejected by DB fail
+
+        :param replay: messages are replayed from ingest spool
+        :raise IngestWriteError: if some messages were rejected by DB
+                                 and others were written
+        """
+        logger.debug(f"write_messages(count={len(values)})")
+        # queued and spooled messages are recorded when written, so
+        # recorded_on follows commit order as delta watermark expects
+        now: datetime = datetime.now()
+        values = [{**v, "recorded_on": now} for v in values]
+        ids: list[int] = [None] * len(values)
+        errors: dict[int, str] = {}
+        # first value index per idempotency key not resolved in memory
+        keys: dict = {}
+        indexes: list[int] = []
+        for index, v in enumerate(values):
+            key: tuple[str, str] = (v["recorded_by"], v.get("client_key"))
+            if key[1]:
+                ids[index] = MessageService.recent_keys.get(key)
+                if ids[index] or key in keys:
+                    continue
+                keys[key] = index
+            indexes.append(index)
+
+        try:
+            new_ids: list[int] = self._add_message_logs(
+                [values[index] for index in indexes], replay)
+        except BaseException as e:
+            if is_db_unavailable(e):
+                raise
+            # some keys may be evicted from recent keys but still in DB,
+            # resolve them and write the rest of messages one by one
+            for key, message_id in self._find_client_keys(
+                    list(keys)).items():
+                ids[keys[key]] = message_id
+            indexes = [index for index in indexes if ids[index] is None]
+            new_ids, item_errors = self._add_message_logs_each(
+                [values[index] for index in indexes], replay)
+            for i, detail in item_errors.items():
+                errors[indexes[i]] = detail
+
+        for index, message_id in zip(indexes, new_ids):
+            ids[index] = message_id
+        for key, index in keys.items():
+            if ids[index] is not None:
+                MessageService.recent_keys.put(key, ids[index])
+        # duplicates within the same batch
+        for index, v in enumerate(values):
+            if ids[index] is None and index not in errors:
+                first: int = keys[(v["recorded_by"], v["client_key"])]
+                ids[index] = ids[first]
+                if first in errors:
+                    errors[index] = errors[first]
+
+        # single push notification per affected study
+        studies: dict = {}
+        for index, message_id in zip(indexes, new_ids):
+            if message_id is None:
+                continue
+            v: dict = values[index]
+            studies.setdefault((v["category_id"], v["study_id"]),
+                               []).append((message_id, v["recorded_by"]))
+
+        for (category_id, study_id), items in studies.items():
+            PushService().push_message("feedback-log-refresh", {
+                "category_id": category_id,
+                "study_id": study_id,
+                "message_ids": [message_id for message_id, _ in items]},
+                sender=items[0][1])
+        if errors:
+            raise IngestWriteError(ids, errors)
+        return ids
+
+    def _add_message_logs(self, values: list[dict],
+                          replay: bool = False) -> list[int]:
+        t0: float = time.monotonic()
+        try:
+            ids: list[int] = self.dao.message.add_message_logs(values)
+            self.dao.message.commit()
+        except BaseException:
+            self.dao.message.rollback()
+            raise
+        self._added_message_logs(values, ids, t0, replay)
+        return ids
+
+    def _add_message_logs_each(self, values: list[dict],
+                               replay: bool = False
+                               ) -> tuple[list[int], dict[int, str]]:
+        """ Write messages in single transaction with savepoint per
+        message, so messages rejected by DB are skipped
+
+        :return: message IDs, None for rejected ones, and error details
+                 by message index
+        """
+        t0: float = time.monotonic()
+        ids: list[int] = []
+        errors: dict[int, str] = {}
+        try:
+            for index, v in enumerate(values):
+                try:
+                    with self.dao.message.begin_nested():
+                        ids.append(self.dao.message.add_message_logs([v])[0])
+                except BaseException as e:
+                    if is_db_unavailable(e):
+                        raise
+                    logger.debug(f"reject message #{index}: {str(e)}")
+                    ids.append(None)
+                    errors[index] = str(e)
+            self.dao.message.commit()
+        except BaseException:
+            self.dao.message.rollback()
+            raise
+        written: list[int] = [i for i, o in enumerate(ids) if o is not None]
+        self._added_message_logs([values[i] for i in written],
+                                 [ids[i] for i in written], t0, replay)
+        return ids, errors
+
+    def _added_message_logs(self, values: list[dict], ids: list[int],
+                            t0: float, replay: bool = False):
+        """ Update caches and ingest stats after messages are committed,
+        latency is observed for live request and queue writes only """
+        for key in {(v["category_id"], v["study_id"]) for v in values}:
+            FeedbackService.log_versions.bump(*key)
+        if FeedbackService.log_buffer and ids:
+            rows: list[dict] = [{**v, "id": message_id}
+                                for v, message_id in zip(values, ids)]
+            FeedbackService.log_buffer.add(_log_buffer_entries(
+                self.dao.ref_data.get_ref_data(), rows))
+        if MessageService.ingest_spool and not replay:
+            MessageService.ingest_spool.observe_latency(
+                (time.monotonic() - t0) * 1000.0)
+
+    def _check_client_key(self, client_key: str):
+        if client_key is not None and not 0 < len(client_key) <= 64:
+            raise ValueError("client_key must be 1..64 characters long")
+
+    def _find_client_keys(self, keys: list[tuple[str, str]]) -> dict:
+        """ Find already written messages by (username, client_key) """
+        if not keys:
+            return {}
+        keys_set: set = set(keys)
+        rows: list[tuple[str, str, int]] = \
+            self.dao.message.get_message_log_client_keys(
+                list({key[1] for key in keys}))
+        res: dict = {}
+        for username, client_key, message_id in rows:
+            if (username, client_key) in keys_set:
+                MessageService.recent_keys.put((username, client_key),
+                                               message_id)
+                res[(username, client_key)] = message_id
+        return res
+
+    def _message_send_values(self, username: str, m: MessageSendDTO) -> dict:
+        if not m.category or not m.level or not m.provider:
+            raise ValueError("category, level and provider are required")
+        if not m.description:
+            raise ValueError("description is required")
+        return self._message_values(
+            username,
+            None,
+            m.study,
+            MessageCategoryId.parse(m.category),
+            MessageLevelId.parse(m.level),
+            self.dao.ref_data.get_ref_data().parse_device(m.device)
+            if m.device else MessageService.default_device_id,
+            DataProviderId.parse(m.provider),
+            m.description,
+            m.payload,
+            m.event_on,
+            m.registered_on,
+            m.client_key
+        )
+
+    def _message_values(
+            self,
+            username: str,
+            study_id: int,
+            study_name: str,
+            category_id: int,
+            level_id: int,
+            device_id: int,
+            provider_id: int,
+            description: str,
+            payload: str,
+            event_on: datetime = None,
+            registered_on: datetime = None,
+            client_key: str = None
+    ) -> dict:
+        self._check_client_key(client_key)
+        now: datetime = datetime.now()
+        return {
+            "study_id": study_id,
+            "study_name": study_name,
+            "category_id": category_id,
+            "level_id": level_id,
+            "device_id": device_id,
+            "provider_id": provider_id,
+            "is_visible": "Y",
+            "description": description,
+            "payload": payload,
+            "event_on": _naive_datetime(event_on) if event_on else now,
+            "registered_on": _naive_datetime(registered_on)
+            if registered_on else now,
+            "recorded_on": now,
+            "recorded_by": username,
+            "client_key": client_key,
+        }
+
 
 # service to handle push messaging functionality in client-server web app
 class PushService(BaseService):
     channel: object = None
 
-    def push_message(self, topic: str, body: object):
+    def push_message(self, topic: str, body: object, sender: str = None):
         logger.debug(f"push_message(topic={topic}, body={str(body)})")
         if not PushService.channel:
             logger.error("PushService.channel is not initialized yet")
@@ -231,7 +1084,7 @@ class PushService(BaseService):
         msg: PushMessageDTO = PushMessageDTO(
             topic=topic,
             ts=datetime.now(),
-            sender=security_context().username,
+            sender=sender if sender else security_context().username,
             body=body)
         asyncio.run(PushService.channel.broadcast(msg))
 
@@ -365,8 +1218,9 @@ class SecSysService(BaseService):
         if not user:
             raise Exception("User not found")
 
-        # get devices cache
-        devices_all: list[DeviceEntity] = self.dao.message.get_devices()
+        # get devices from reference data registry
+        devices_all: list[DeviceEntity] = \
+            self.dao.ref_data.get_ref_data().devices
         map_name = {str(d.id): d for d in devices_all} | \
                    {d.kind: d for d in devices_all} | \
                    {d.description: d for d in devices_all}
@@ -454,5 +1308,8 @@ class SecSysService(BaseService):
 
         # reset security context cache for the user
         SecurityManager.instance().reset_context_cache(username)
+        # rate limit can depend on roles
+        if MessageService.rate_limiter:
+            MessageService.rate_limiter.reset(username)
 
         return list(map_id[id_res].rolename for id_res in set_to_res)
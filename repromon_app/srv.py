@@ -10,13 +10,20 @@ from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from starlette.datastructures import Headers
 
+from repromon_app.cache import LogCache, RecentLogBuffer
 from repromon_app.config import app_config, app_config_init, app_settings
+from repromon_app.dao import ArchiveDAO, MessageDAO
 from repromon_app.db import db_init
+from repromon_app.ingest import (IngestListener, IngestQueue, IngestSpool,
+                                 RateLimiter, RecentKeys)
+from repromon_app.maintenance import (MessageLogPartitioner,
+                                      RecentMessagesPruner)
 from repromon_app.router.admin import create_admin_router
 from repromon_app.router.api_v1 import create_api_v1_router
 from repromon_app.router.app import create_app_router
 from repromon_app.router.test import create_test_router
 from repromon_app.security import SecurityManager, Token, current_web_request
+from repromon_app.service import FeedbackService, MessageService
 
 logger = logging.getLogger(__name__)
 logger.debug(f"name={__name__}")
@@ -36,6 +43,97 @@ def create_fastapi_app() -> FastAPI:
     logger.debug("Initialize DB...")
     # ?? db_init(app_config().db.dict(), threading.get_ident)
     db_init(app_config().db.dict())
+    ArchiveDAO.set_path(app_config().maintenance.archive_path)
+
+    FeedbackService.log_etag = app_config().feedback.cache_enabled
+    if app_config().feedback.cache_enabled and \
+            not FeedbackService.log_cache:
+        FeedbackService.log_cache = LogCache(
+            app_config().feedback.cache_max_bytes)
+
+    if app_config().feedback.buffer_enabled and \
+            not FeedbackService.log_buffer:
+        FeedbackService.log_buffer = RecentLogBuffer(
+            app_config().feedback.buffer_horizon_sec,
+            study_max_rows=app_config().feedback.buffer_study_max_rows,
+            max_studies=app_config().feedback.buffer_max_studies)
+        # warm up with DB rows of the horizon, as many as buffer holds
+        buffer_max_rows: int = app_config().feedback.buffer_max_studies * \
+            app_config().feedback.buffer_study_max_rows
+        FeedbackService().load_message_log_buffer(
+            app_config().feedback.buffer_horizon_sec, buffer_max_rows)
+
+    MessageService.recent_keys = RecentKeys(
+        app_config().ingest.recent_keys_max_size)
+
+    if app_config().ingest.rate_limit_enabled:
+        MessageService.rate_limiter = RateLimiter(
+            app_config().ingest.rate_limit_rate,
+            app_config().ingest.rate_limit_burst,
+            users=RateLimiter.parse_limits(
+                app_config().ingest.rate_limit_users),
+            roles=RateLimiter.parse_limits(
+                app_config().ingest.rate_limit_roles)
+        )
+
+    if app_config().ingest.spool_enabled and not MessageService.ingest_spool:
+        logger.debug("Start ingest spool...")
+        MessageService.ingest_spool = IngestSpool(
+            app_config().ingest.spool_path,
+            MessageService().replay_messages,
+            segment_max_bytes=app_config().ingest.spool_segment_max_bytes,
+            fsync=app_config().ingest.spool_fsync,
+            fsync_interval_ms=app_config().ingest.spool_fsync_interval_ms,
+            latency_threshold_ms=app_config().ingest.spool_latency_threshold_ms,
+            replay_batch_size=app_config().ingest.spool_replay_batch_size,
+            replay_interval_ms=app_config().ingest.spool_replay_interval_ms
+        )
+        MessageService.ingest_spool.start()
+
+    if app_config().ingest.queue_enabled and not MessageService.ingest_queue:
+        logger.debug("Start ingest queue...")
+        MessageService.ingest_queue = IngestQueue(
+            MessageService().ingest_messages,
+            max_size=app_config().ingest.queue_max_size,
+            batch_max_size=app_config().ingest.batch_max_size,
+            batch_linger_ms=app_config().ingest.batch_linger_ms
+        )
+        MessageService.ingest_queue.start()
+
+    if app_config().ingest.listener_enabled and \
+            not MessageService.ingest_listener:
+        logger.debug("Start ingest listener...")
+        MessageService.ingest_listener = IngestListener(
+            MessageService().authenticate_ingest,
+            MessageService().accept_messages,
+            socket_path=app_config().ingest.listener_socket_path,
+            udp_host=app_config().ingest.listener_udp_host,
+            udp_port=app_config().ingest.listener_udp_port,
+            max_frame_size=app_config().ingest.listener_max_frame_size
+        )
+        MessageService.ingest_listener.start()
+
+    if app_config().maintenance.partition_enabled and \
+            not MessageService.log_partitioner:
+        logger.debug("Start message log partitioner...")
+        MessageService.log_partitioner = MessageLogPartitioner(
+            app_config().maintenance.partition_interval,
+            premake=app_config().maintenance.partition_premake,
+            retention_days=app_config().maintenance.partition_retention_days,
+            run_interval_sec=app_config().maintenance.partition_run_interval_sec,
+            on_removed=FeedbackService().invalidate_message_log
+        )
+        MessageService.log_partitioner.start()
+
+    FeedbackService.delta_overlap_sec = \
+        app_config().feedback.delta_overlap_sec
+    MessageDAO.set_recent_hours(app_config().feedback.recent_hours)
+    if app_config().feedback.recent_hours > 0 and \
+            not MessageService.recent_pruner:
+        logger.debug("Start recent messages pruner...")
+        MessageService.recent_pruner = RecentMessagesPruner(
+            app_config().feedback.recent_prune_interval_sec)
+        MessageService.recent_pruner.start()
 
     app_web = FastAPI(
         title="ReproMon App",
@@ -156,6 +254,24 @@ def create_fastapi_app() -> FastAPI:
             content={"detail": detail}
         )
 
+    @app_web.on_event("shutdown")
+    def app_shutdown():
+        if MessageService.log_partitioner:
+            logger.debug("Stop message log partitioner...")
+            MessageService.log_partitioner.stop()
+        if MessageService.recent_pruner:
+            logger.debug("Stop recent messages pruner...")
+            MessageService.recent_pruner.stop()
+        if MessageService.ingest_listener:
+            logger.debug("Stop ingest listener...")
+            MessageService.ingest_listener.stop()
+        if MessageService.ingest_queue:
+            logger.debug("Stop ingest queue...")
+            MessageService.ingest_queue.stop()
+        if MessageService.ingest_spool:
+            logger.debug("Stop ingest spool...")
+            MessageService.ingest_spool.stop()
+
     @app_web.middleware("http")
     async def app_request_context(request: Request, call_next):
         # TODO: auto commit/rollback DB session using db_session_done
@@ -1,10 +1,21 @@
+import csv
+import io
+import json
 import logging
 
+import msgpack
+import pyarrow.ipc
+import pyarrow.parquet
+from fastapi.encoders import jsonable_encoder
 from fastapi.testclient import TestClient
 
+from repromon_app.cache import LogCache, RecentLogBuffer
 from repromon_app.dao import DAO
+from repromon_app.ingest import IngestQueue, IngestSpool, RateLimiter
 from repromon_app.model import (DataProviderId, MessageCategoryId,
                                 MessageLevelId)
+from repromon_app.service import FeedbackService, MessageService
+from repromon_tools.benchmark_dto import benchmark_http
 
 logger = logging.getLogger(__name__)
 logger.debug(f"name={__name__}")
@@ -49,6 +60,129 @@ def test_account_get_users(
     assert len(data) > 0
 
 
+def test_feedback_export_message_log(
+        test_client: TestClient,
+        oauth2_tester1_headers
+):
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        params={"category_id": int(MessageCategoryId.FEEDBACK)},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    expected = response.json()
+    assert expected
+
+    def _export(fmt):
+        response = test_client.get(
+            "/api/1/feedback/export_message_log",
+            params={"category_id": int(MessageCategoryId.FEEDBACK),
+                    "format": fmt},
+            headers=oauth2_tester1_headers)
+        assert response.status_code == 200
+        assert f"message_log.{fmt}" in \
+            response.headers["content-disposition"]
+        return response
+
+    response = _export("json")
+    assert response.headers["content-type"].startswith("application/json")
+    assert response.json() == expected
+    response = _export("ndjson")
+    assert response.headers["content-type"].startswith(
+        "application/x-ndjson")
+    assert [json.loads(o) for o in response.text.splitlines()] == expected
+    response = _export("csv")
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(o["id"]) for o in rows] == [o["id"] for o in expected]
+    assert rows[0]["event_on"] == expected[0]["event_on"]
+
+    response = test_client.get(
+        "/api/1/feedback/export_message_log",
+        params={"format": "xml"},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 422
+
+
+def test_feedback_export_message_log_arrow(
+        test_client: TestClient,
+        oauth2_tester1_headers,
+        monkeypatch
+):
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        params={"category_id": int(MessageCategoryId.FEEDBACK)},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    expected = [o["id"] for o in response.json()]
+    assert expected
+
+    def _export(fmt, **params):
+        response = test_client.get(
+            "/api/1/feedback/export_message_log_arrow",
+            params={"category_id": int(MessageCategoryId.FEEDBACK),
+                    "format": fmt, **params},
+            headers=oauth2_tester1_headers)
+        assert response.status_code == 200
+        assert f"message_log.{fmt}" in \
+            response.headers["content-disposition"]
+        return response
+
+    response = _export("arrow", columns=["id", "description"])
+    assert response.headers["content-type"].startswith(
+        "application/vnd.apache.arrow.stream")
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["id", "description"]
+    assert table["id"].to_pylist() == expected
+    response = _export("parquet")
+    assert response.headers["content-type"].startswith(
+        "application/vnd.apache.parquet")
+    table = pyarrow.parquet.read_table(io.BytesIO(response.content))
+    assert "payload" in table.column_names
+    assert table["id"].to_pylist() == expected
+
+    response = test_client.get(
+        "/api/1/feedback/export_message_log_arrow",
+        params={"columns": ["id", "password"]},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 400
+    response = test_client.get(
+        "/api/1/feedback/export_message_log_arrow",
+        params={"format": "csv"},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 422
+
+    # optional pyarrow dependency is not installed
+    monkeypatch.setattr("repromon_app.codec.pyarrow", None)
+    monkeypatch.setattr("repromon_app.dao.pyarrow", None)
+    response = test_client.get(
+        "/api/1/feedback/export_message_log_arrow",
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 501
+    assert "pip install repromon[arrow]" in response.json()["detail"]
+
+
+def test_feedback_get_cache_stats(
+        test_client: TestClient,
+        oauth2_admin_headers,
+        monkeypatch
+):
+    response = test_client.get(
+        "/api/1/feedback/get_cache_stats",
+        headers=oauth2_admin_headers)
+    assert response.status_code == 200
+    assert response.json()["cache"] is None
+
+    monkeypatch.setattr(FeedbackService, "log_cache", LogCache())
+    response = test_client.get(
+        "/api/1/feedback/get_cache_stats",
+        headers=oauth2_admin_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert "hits" in data["cache"]
+    assert "coalesced" in data["flight"]
+    assert "keys" in data["versions"]
+
+
 def test_feedback_get_devices(
         test_client: TestClient,
         oauth2_tester1_headers
@@ -87,6 +221,155 @@ def test_feedback_get_message_log(
     data = response.json()
     assert isinstance(data, list)
     assert len(data) > 0
+    # rendered from DAO DTOs as FastAPI would render them
+    assert data == json.loads(json.dumps(jsonable_encoder(
+        FeedbackService().get_message_log())))
+
+
+def test_feedback_get_message_log_benchmark(
+        test_client: TestClient,
+        oauth2_tester1_headers
+):
+    cache = FeedbackService.log_cache
+    res = benchmark_http(test_client, oauth2_tester1_headers,
+                         MessageCategoryId.FEEDBACK, repeat=1)
+    assert res["fast"]["rows"] == res["validated"]["rows"] > 0
+    assert res["speedup"] > 0
+    assert FeedbackService.log_cache is cache
+
+
+def test_feedback_get_message_log_delta(
+        test_client: TestClient,
+        oauth2_tester1_headers,
+        monkeypatch
+):
+    # test messages are all recorded within default overlap
+    monkeypatch.setattr(FeedbackService, "delta_overlap_sec", 0)
+    response = test_client.get(
+        "/api/1/feedback/get_message_log_delta",
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["items"]) > 0
+    assert data["since_id"] > 0
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log_delta",
+        params={"since_id": data["since_id"],
+                "since_recorded_on": data["since_recorded_on"]},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["items"] == []
+    assert data["hidden_ids"] == []
+
+
+def test_feedback_get_message_log_etag(
+        test_client: TestClient,
+        oauth2_tester1_headers,
+        apikey_tester2_headers,
+        monkeypatch
+):
+    monkeypatch.setattr(FeedbackService, "log_etag", False)
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+
+    monkeypatch.setattr(FeedbackService, "log_etag", True)
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers={**oauth2_tester1_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert not response.content
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers={**oauth2_tester1_headers,
+                 "Accept": "application/msgpack"})
+    assert response.headers["etag"] == etag
+
+    response = test_client.post(
+        "/api/1/message/send_message",
+        params={
+            "category": int(MessageCategoryId.FEEDBACK),
+            "level": int(MessageLevelId.INFO),
+            "provider": int(DataProviderId.MRI),
+            "description": "ETag message from test_api_v1",
+        },
+        headers=apikey_tester2_headers)
+    assert response.status_code == 200
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers={**oauth2_tester1_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert len(response.json()) > 0
+
+
+def test_feedback_get_message_log_msgpack(
+        test_client: TestClient,
+        oauth2_tester1_headers
+):
+    response = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers={**oauth2_tester1_headers,
+                 "Accept": "application/msgpack"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    data = msgpack.unpackb(response.content)
+    rows = test_client.get(
+        "/api/1/feedback/get_message_log",
+        headers=oauth2_tester1_headers).json()
+    assert data["columns"][0] == "id"
+    assert len(data["data"]) == len(data["columns"])
+    assert data["data"][0] == [row["id"] for row in rows]
+    assert [dict(zip(data["columns"], row)) for row in zip(*data["data"])] == rows
+
+
+def test_feedback_get_message_log_page(
+        test_client: TestClient,
+        oauth2_tester1_headers
+):
+    response = test_client.get(
+        "/api/1/feedback/get_message_log_page",
+        params={"page_size": 2},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["items"]) == 2
+    assert data["prev_cursor"] is None
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log_page",
+        params={"page_size": 2, "cursor": data["next_cursor"]},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    data2 = response.json()
+    assert data2["items"][0]["id"] not in [o["id"] for o in data["items"]]
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log_page",
+        params={"page_size": 2, "cursor": data2["prev_cursor"],
+                "direction": "backward"},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 200
+    assert response.json()["items"] == data["items"]
+
+    response = test_client.get(
+        "/api/1/feedback/get_message_log_page",
+        params={"cursor": "invalid"},
+        headers=oauth2_tester1_headers)
+    assert response.status_code == 400
 
 
 def test_feedback_get_study_header(
@@ -101,6 +384,56 @@ def test_feedback_get_study_header(
     data = response.json()
     assert data is None
 
+    response = test_client.get(
+        "/api/1/feedback/get_study_header",
+        params={"study_id": -1},
+        headers={**oauth2_tester1_headers,
+                 "If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+
+def test_feedback_set_message_log_visibility_by_ids(
+        test_client: TestClient,
+        apikey_tester2_headers,
+        oauth2_admin_headers,
+        monkeypatch
+):
+    monkeypatch.setattr(FeedbackService, "log_buffer", RecentLogBuffer())
+    FeedbackService().load_message_log_buffer(900, 1000)
+    response = test_client.post(
+        "/api/1/message/send_message",
+        params={
+            "category": int(MessageCategoryId.FEEDBACK),
+            "level": int(MessageLevelId.INFO),
+            "provider": int(DataProviderId.MRI),
+            "description": "Visibility message from test_api_v1",
+        },
+        headers=apikey_tester2_headers)
+    assert response.status_code == 200
+    message_id = response.json()["id"]
+
+    def _ids():
+        response = test_client.get(
+            "/api/1/feedback/get_message_log",
+            params={"category_id": MessageCategoryId.FEEDBACK,
+                    "interval_sec": 600},
+            headers=oauth2_admin_headers)
+        assert response.status_code == 200
+        return [o["id"] for o in response.json()]
+
+    assert message_id in _ids()
+    for visible in (False, True):
+        response = test_client.get(
+            "/api/1/feedback/set_message_log_visibility_by_ids",
+            params={"category_id": MessageCategoryId.FEEDBACK,
+                    "message_ids": [message_id], "visible": visible},
+            headers=oauth2_admin_headers)
+        assert response.status_code == 200
+        assert response.json() == 1
+        assert (message_id in _ids()) == visible
+    # interval queries are answered by recent messages buffer
+    assert FeedbackService.log_buffer.stats()["hits"] == 3
+
 
 def test_login_get_current_user(
         test_client: TestClient,
@@ -114,6 +447,28 @@ def test_login_get_current_user(
     assert data["username"] == "tester1"
 
 
+def test_message_get_ingest_stats(
+        test_client: TestClient,
+        oauth2_admin_headers
+):
+    response = test_client.get(
+        "/api/1/message/get_ingest_stats",
+        headers=oauth2_admin_headers)
+    assert response.status_code == 200
+    assert "queue" in response.json()
+
+
+def test_message_refresh_ref_data(
+        test_client: TestClient,
+        oauth2_admin_headers
+):
+    response = test_client.post(
+        "/api/1/message/refresh_ref_data",
+        headers=oauth2_admin_headers)
+    assert response.status_code == 200
+    assert response.json()["version"] > 0
+
+
 def test_message_send_message(
         test_client: TestClient,
         apikey_tester2_headers
@@ -137,6 +492,226 @@ def test_message_send_message(
     assert msg2
 
 
+def test_message_send_message_client_key(
+        test_client: TestClient,
+        apikey_tester2_headers
+):
+    params = {
+        "category": int(MessageCategoryId.FEEDBACK),
+        "level": int(MessageLevelId.INFO),
+        "provider": int(DataProviderId.MRI),
+        "description": "Idempotent message from test_api_v1",
+        "client_key": "test_api_v1_client_key_1"
+    }
+    response = test_client.post("/api/1/message/send_message",
+                                params=params,
+                                headers=apikey_tester2_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["client_key"] == "test_api_v1_client_key_1"
+
+    response = test_client.post("/api/1/message/send_message",
+                                params=params,
+                                headers=apikey_tester2_headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == data["id"]
+
+
+def test_message_send_message_queued(
+        test_client: TestClient,
+        apikey_tester2_headers
+):
+    params = {
+        "study": "Test Study Name",
+        "category": int(MessageCategoryId.FEEDBACK),
+        "level": int(MessageLevelId.INFO),
+        "provider": int(DataProviderId.MRI),
+        "description": "Queued message from test_api_v1"
+    }
+    MessageService.ingest_queue = IngestQueue(
+        MessageService().write_messages, max_size=1)
+    try:
+        response = test_client.post(
+            "/api/1/message/send_message",
+            params=params,
+            headers=apikey_tester2_headers)
+        assert response.status_code == 202
+        assert response.json()["provisional_id"]
+
+        # queue is not drained by writer, so next one is rejected
+        response = test_client.post(
+            "/api/1/message/send_message",
+            params=params,
+            headers=apikey_tester2_headers)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"]
+
+        MessageService.ingest_queue.start()
+        MessageService.ingest_queue.flush()
+        assert MessageService.ingest_queue.stats()["written"] == 1
+    finally:
+        MessageService.ingest_queue.stop()
+        MessageService.ingest_queue = None
+
+
+def test_message_send_message_rate_limit(
+        test_client: TestClient,
+        apikey_tester2_headers
+):
+    MessageService.rate_limiter = RateLimiter(
+        1000, roles={"sys_data_entry": (0.1, 2)})
+    try:
+        params = {
+            "category": int(MessageCategoryId.FEEDBACK),
+            "level": int(MessageLevelId.INFO),
+            "provider": int(DataProviderId.MRI),
+            "description": "Rate limited message from test_api_v1"
+        }
+        for _ in range(2):
+            response = test_client.post("/api/1/message/send_message",
+                                        params=params,
+                                        headers=apikey_tester2_headers)
+            assert response.status_code == 200
+        response = test_client.post("/api/1/message/send_message",
+                                    params=params,
+                                    headers=apikey_tester2_headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 9
+        stats = MessageService().get_ingest_stats()["rate_limit"]
+        assert stats["allowed"] == 2
+        assert stats["limited"] == 1
+    finally:
+        MessageService.rate_limiter = None
+
+
+def test_message_send_message_spooled(
+        test_client: TestClient,
+        apikey_tester2_headers,
+        tmp_path
+):
+    MessageService.ingest_spool = IngestSpool(
+        str(tmp_path), MessageService().replay_messages,
+        replay_interval_ms=10)
+    try:
+        MessageService.ingest_spool.divert("test_api_v1")
+        response = test_client.post(
+            "/api/1/message/send_message",
+            params={
+                "category": int(MessageCategoryId.FEEDBACK),
+                "level": int(MessageLevelId.INFO),
+                "provider": int(DataProviderId.MRI),
+                "description": "Spooled message from test_api_v1"
+            },
+            headers=apikey_tester2_headers)
+        assert response.status_code == 202
+        assert response.json()["queue_depth"] == 1
+
+        MessageService.ingest_spool.start()
+        assert MessageService.ingest_spool.flush()
+        assert not MessageService.ingest_spool.is_diverting()
+    finally:
+        MessageService.ingest_spool.stop()
+        MessageService.ingest_spool = None
+
+
+def test_message_send_messages(
+        test_client: TestClient,
+        apikey_tester2_headers
+):
+    response = test_client.post(
+        "/api/1/message/send_messages",
+        json=[
+            {
+                "study": "Test Study Name",
+                "category": int(MessageCategoryId.FEEDBACK),
+                "level": "WARNING",
+                "provider": int(DataProviderId.MRI),
+                "description": "Batch message 1 from test_api_v1",
+                "event_on": "2023-10-01T10:00:00.123456"
+            },
+            {
+                "category": int(MessageCategoryId.FEEDBACK),
+                "level": int(MessageLevelId.INFO),
+                "provider": "UNKNOWN",
+                "description": "Batch message 2 from test_api_v1"
+            }
+        ],
+        headers=apikey_tester2_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["ids"]) == 2
+    assert data["ids"][1] is None
+    assert data["errors"][0]["index"] == 1
+    msg = DAO.message.get_message_log_info(data["ids"][0])
+    assert msg.level == "WARNING"
+
+
+def test_message_send_messages_msgpack(
+        test_client: TestClient,
+        apikey_tester2_headers
+):
+    body = msgpack.packb({
+        "columns": ["category", "level", "provider", "description"],
+        "data": [
+            [int(MessageCategoryId.FEEDBACK)] * 2,
+            ["INFO", "UNKNOWN"],
+            [int(DataProviderId.MRI)] * 2,
+            ["Msgpack message 1 from test_api_v1",
+             "Msgpack message 2 from test_api_v1"]
+        ]
+    })
+    response = test_client.post(
+        "/api/1/message/send_messages",
+        content=body,
+        headers={**apikey_tester2_headers,
+                 "Content-Type": "application/msgpack",
+                 "Accept": "application/msgpack"})
+    assert response.status_code == 200
+    data = msgpack.unpackb(response.content)
+    assert data["ids"][1] is None
+    assert data["errors"][0]["index"] == 1
+    msg = DAO.message.get_message_log_info(data["ids"][0])
+    assert msg.description == "Msgpack message 1 from test_api_v1"
+
+    response = test_client.post(
+        "/api/1/message/send_messages",
+        content=msgpack.packb([{"event_on": "not a date"}]),
+        headers={**apikey_tester2_headers,
+                 "Content-Type": "application/msgpack"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"][:2] == ["body", 0]
+
+
+def test_message_send_messages_stream(
+        test_client: TestClient,
+        apikey_tester2_headers
+):
+    def _body():
+        yield b'{"category": "Feedback", "level": "INFO", "provider": "MRI", '
+        yield b'"description": "Stream message 1 from test_api_v1"}\n\n'
+        yield b'{"category": "Feedback", "level": "BAD", "provider": "MRI", ' \
+              b'"description": "Stream message 2 from test_api_v1"}\n'
+        yield b'not a json\n'
+        yield b'{"category": 1, "level": "ERROR", "provider": 7, ' \
+              b'"description": "Stream message 3 from test_api_v1"}'
+
+    response = test_client.post(
+        "/api/1/message/send_messages_stream",
+        content=_body(),
+        headers=apikey_tester2_headers | {
+            "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    acks = [json.loads(s) for s in response.text.splitlines()]
+    assert [a.get("line") for a in acks[:-1]] == [1, 3, 4, 5]
+    assert acks[0]["id"] and acks[3]["id"]
+    assert acks[1]["error"] and acks[2]["error"]
+    assert acks[-1] == {"done": True, "lines": 5, "ids": 2,
+                        "spooled": 0, "errors": 2}
+    msg = DAO.message.get_message_log_info(acks[3]["id"])
+    assert msg.description == "Stream message 3 from test_api_v1"
+
+
 def test_secsys_calculate_apikey(
         test_client: TestClient,
         oauth2_admin_headers
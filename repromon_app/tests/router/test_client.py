@@ -0,0 +1,187 @@
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from repromon_app.dao import DAO
+from repromon_app.model import MessageCategoryId
+from repromon_tools.client import (LocalBuffer, RepromonClient,
+                                   RepromonClientError)
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+# requests transport adapter serving client requests by FastAPI app via
+# TestClient, scripted replies as (status, headers, body) or exceptions
+# are returned first
+class _AppAdapter(BaseAdapter):
+    def __init__(self, test_client, replies: list = None):
+        super().__init__()
+        self.test_client = test_client
+        self.replies: list = list(replies or [])
+        self.requests: list = []
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        if self.replies:
+            reply = self.replies.pop(0)
+            if isinstance(reply, BaseException):
+                raise reply
+            status, headers, body = reply
+        else:
+            url = urlsplit(request.url)
+            r = self.test_client.request(
+                request.method,
+                f"{url.path}?{url.query}" if url.query else url.path,
+                content=request.body,
+                headers=dict(request.headers))
+            status, headers, body = r.status_code, r.headers, r.content
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+
+def _client(test_client, apikey: str, replies: list = None,
+            **kwargs) -> tuple[RepromonClient, _AppAdapter]:
+    client = RepromonClient("http://testserver/api/1", api_key=apikey,
+                            backoff_base_ms=1, backoff_max_ms=10, **kwargs)
+    adapter = _AppAdapter(test_client, replies)
+    client.session.mount("http://", adapter)
+    return client, adapter
+
+
+def _batches(adapter: _AppAdapter) -> list[list[str]]:
+    """ Descriptions of messages in send_messages requests """
+    return [[m["description"] for m in json.loads(r.body)]
+            for r in adapter.requests
+            if r.url.endswith("/message/send_messages")]
+
+
+def _message(description: str) -> dict:
+    return {"category": "Feedback", "level": "INFO", "provider": "MRI",
+            "description": description}
+
+
+def test_client_buffer_replay(test_client, apikey_tester2, tmp_path):
+    client, adapter = _client(
+        test_client, apikey_tester2,
+        [requests.exceptions.ConnectionError("Server is down")],
+        max_retries=0, batch_max_size=10, batch_linger_ms=50,
+        buffer_path=str(tmp_path / "client.buf"))
+    with client:
+        for i in range(3):
+            client.submit(**_message(f"Buffered message {i} from test_client"))
+        client.flush()
+        assert client.count_buffered == 3
+        assert not client.buffer.is_empty()
+
+        client.submit(**_message("Next message from test_client"))
+        client.flush()
+    assert client.buffer.is_empty()
+    assert client.stats()["sent"] == 4
+    # buffered messages are replayed first in the same order
+    assert _batches(adapter)[-1] == \
+        [f"Buffered message {i} from test_client" for i in range(3)] + \
+        ["Next message from test_client"]
+
+
+def test_client_retry_after(test_client, apikey_tester2):
+    client, adapter = _client(test_client, apikey_tester2,
+                              [(503, {"Retry-After": "0.2"}, b"")],
+                              max_retries=2)
+    with client:
+        t0 = time.monotonic()
+        res = client.send_messages(
+            [_message("Retried message from test_client")])
+        assert time.monotonic() - t0 >= 0.2
+    assert res["ids"][0]
+    assert client.count_retries == 1
+    assert len(adapter.requests) == 2
+    # Retry-After is lower bound of backoff delay
+    assert client._retry_delay(0, "1.5") >= 1.5
+    assert client._retry_delay(10, "bad") <= client.backoff_max_ms / 1000.0
+
+    # client errors other than 429 are not retried
+    client, adapter = _client(test_client, apikey_tester2,
+                              [(400, {}, b'{"detail": "Bad request"}')],
+                              max_retries=2)
+    with client:
+        with pytest.raises(RepromonClientError) as e:
+            client.send_messages([_message("Bad message from test_client")])
+    assert e.value.status_code == 400
+    assert len(adapter.requests) == 1
+
+
+def test_client_send_error(test_client, apikey_tester2):
+    client, _ = _client(test_client, apikey_tester2,
+                        [(200, {}, b"<html>Proxy page</html>")],
+                        batch_max_size=1, batch_linger_ms=0)
+    with client:
+        client.submit(**_message("Unparsed message from test_client"))
+        client.submit(**_message("Next message from test_client"))
+        # sender thread keeps running, so flush doesn't block
+        t = threading.Thread(target=client.flush, daemon=True)
+        t.start()
+        t.join(10)
+        assert not t.is_alive()
+    assert client.count_dropped == 1
+    assert client.count_sent == 1
+
+
+def test_client_send_message(test_client, apikey_tester2):
+    client, _ = _client(test_client, apikey_tester2)
+    with client:
+        res = client.send_message(**_message("Single message from test_client"))
+    assert res["id"]
+    assert DAO.message.get_message_log_info(res["id"]).description == \
+        "Single message from test_client"
+
+
+def test_client_submit(test_client, apikey_tester2):
+    client, adapter = _client(test_client, apikey_tester2,
+                              batch_max_size=3, batch_linger_ms=50)
+    with client:
+        for i in range(7):
+            client.submit(**_message(f"Batch message {i} from test_client"))
+    batches = _batches(adapter)
+    assert all(0 < len(o) <= 3 for o in batches)
+    assert [d for o in batches for d in o] == \
+        [f"Batch message {i} from test_client" for i in range(7)]
+    assert client.stats()["sent"] == 7
+    lst = [o for o in DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None)
+        if o.description.startswith("Batch message ")
+        if o.description.endswith(" from test_client")]
+    assert len(lst) == 7
+
+
+def test_local_buffer(tmp_path):
+    buffer = LocalBuffer(str(tmp_path / "client.buf"))
+    assert buffer.is_empty()
+    assert buffer.take() == []
+    buffer.append([{"n": 0}, {"n": 1}])
+    buffer.append([{"n": 2}])
+    assert not buffer.is_empty()
+    assert buffer.take() == [{"n": 0}, {"n": 1}, {"n": 2}]
+    # taken messages are kept until done, e.g. on crash before send
+    buffer.append([{"n": 3}])
+    buffer = LocalBuffer(str(tmp_path / "client.buf"))
+    assert not buffer.is_empty()
+    assert buffer.take() == [{"n": i} for i in range(4)]
+    buffer.done()
+    assert buffer.is_empty()
+    assert buffer.take() == []
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from repromon_app.cache import (LogCache, LogVersions, RecentLogBuffer,
+                                SingleFlight, _sizeof)
+from repromon_app.model import MessageLogInfoDTO
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+def _items(count: int) -> list[MessageLogInfoDTO]:
+    return [MessageLogInfoDTO(id=i, description=f"Message {i}")
+            for i in range(count)]
+
+
+def test_log_cache():
+    size = _sizeof(_items(10))
+    cache = LogCache(max_bytes=size * 2)
+    assert cache.get((1, 1, None), "v1") is None
+
+    cache.put((1, 1, None), "v1", _items(10))
+    assert [o.id for o in cache.get((1, 1, None), "v1")] == list(range(10))
+    # stale version is dropped
+    assert cache.get((1, 1, None), "v2") is None
+    assert cache.get((1, 1, None), "v1") is None
+
+    cache.put((1, 1, None), "v1", _items(10))
+    cache.put((1, 2, None), "v1", _items(10))
+    assert cache.get((1, 1, None), "v1")
+    cache.put((1, 3, None), "v1", _items(10))
+    # (1, 2) is least recently used and evicted
+    assert cache.get((1, 2, None), "v1") is None
+    assert cache.get((1, 1, None), "v1")
+    # result larger than budget is not cached
+    cache.put((1, 4, None), "v1", _items(30))
+    assert cache.get((1, 4, None), "v1") is None
+
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["hits"] == 3
+    assert stats["misses"] == 5
+    assert stats["evicted"] == 1
+    assert stats["invalidated"] == 1
+
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def _query():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return [1, 2, 3]
+
+    res = [None] * 4
+
+    def _call(index):
+        res[index] = flight.do(("key",), _query)
+
+    threads = [threading.Thread(target=_call, args=(i,)) for i in range(4)]
+    threads[0].start()
+    assert started.wait(10)
+    for t in threads[1:]:
+        t.start()
+    deadline = time.monotonic() + 10
+    while flight.stats()["coalesced"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(10)
+
+    assert len(calls) == 1
+    assert res == [[1, 2, 3]] * 4
+    assert flight.stats() == {"in_flight": 0, "calls": 1, "coalesced": 3}
+
+    # exception is raised and key is released
+    def _fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        flight.do(("key",), _fail)
+    assert flight.do(("key",), lambda: 1) == 1
+    assert flight.stats()["calls"] == 3
+
+
+def test_log_versions():
+    versions = LogVersions()
+    v11, v12, v1, v = versions.get(1, 1), versions.get(1, 2), \
+        versions.get(1), versions.get()
+    v21 = versions.get(2, 1)
+    versions.bump(1, 1)
+    assert versions.get(1, 1) != v11
+    assert versions.get(1) != v1
+    assert versions.get() != v
+    assert versions.get(1, 2) == v12
+    assert versions.get(2, 1) == v21
+
+    v12, v21 = versions.get(1, 2), versions.get(2, 1)
+    versions.bump_category(1)
+    assert versions.get(1, 2) != v12
+    assert versions.get(2, 1) == v21
+
+    versions.bump_all()
+    assert versions.get(2, 1) != v21
+
+
+def test_recent_log_buffer():
+    def _entry(message_id, study_id, category_id=1, seconds=0):
+        on = datetime.now() - timedelta(seconds=seconds)
+        return (category_id, 1,
+                MessageLogInfoDTO(id=message_id, study_id=study_id,
+                                  event_on=on, recorded_on=on))
+
+    buf = RecentLogBuffer(horizon_sec=600, study_max_rows=3, max_studies=2)
+    # messages written before buffer started are unknown
+    assert buf.get(None, 1, 60) is None
+    buf.load([_entry(1, 1, seconds=30)],
+             datetime.now() - timedelta(seconds=600))
+    buf.add([_entry(2, 1, category_id=2), _entry(3, 2)])
+    assert buf.get(None, None, None) is None
+    assert buf.get(None, 1, 3600) is None
+    assert [o.id for o in buf.get(None, 1, 60)] == [1, 2]
+    assert [o.id for o in buf.get(1, None, 60)] == [1, 3]
+    assert buf.get(None, 3, 60) == []
+
+    assert buf.remove([2]) == 1
+    assert [o.id for o in buf.get(None, 1, 60)] == [1]
+    # overwritten row limits served intervals
+    buf.add([_entry(4, 1, seconds=120), _entry(5, 1)])
+    assert buf.get(None, 1, 60) is None
+    assert [o.id for o in buf.get(None, 1, 10)] == [5]
+    assert [o.id for o in buf.get(None, 2, 60)] == [3]
+    # the least recently active study is dropped with its rows
+    buf.add([_entry(6, 3)])
+    assert buf.get(None, 2, 10) is None
+
+    buf.reset()
+    assert buf.get(None, 1, 10) is None
+    stats = buf.stats()
+    assert stats["studies"] == 0
+    assert stats["evicted"] == 1
+    assert stats["dropped"] == 1
+    assert stats["hits"] == 6
+    assert stats["misses"] == 4
+    assert stats["hit_ratio"] == 0.6
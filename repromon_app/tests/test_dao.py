@@ -1,12 +1,110 @@
 import logging
+from datetime import datetime, timedelta
 
-from repromon_app.dao import DAO
-from repromon_app.model import MessageCategoryId, Rolename
+import pyarrow.parquet
+import pytest
+from sqlalchemy import inspect, text
+
+from repromon_app.dao import DAO, ArchiveDAO, MessageDAO
+from repromon_app.model import (DataProviderId, MessageCategoryId,
+                                MessageLevelId, MessageLogRecentEntity,
+                                Rolename)
+from repromon_tools.archive_messages import archive_messages
+from repromon_tools.benchmark_dto import benchmark_dto
+from repromon_tools.export_messages import export_messages
 
 logger = logging.getLogger(__name__)
 logger.debug(f"name={__name__}")
 
 
+def test_archive_message_logs(tmp_path):
+    values = [{
+        "study_id": None,
+        "study_name": "Test Study Name",
+        "category_id": MessageCategoryId.FEEDBACK,
+        "level_id": MessageLevelId.INFO,
+        "device_id": 1,
+        "provider_id": DataProviderId.MRI,
+        "is_visible": "N" if i == 3 else "Y",
+        "description": f"Archived message {i} from test_dao",
+        "payload": {"n": i},
+        "event_on": datetime(2001, 1 + i, 10),
+        "registered_on": datetime(2001, 1 + i, 10),
+        "recorded_on": datetime(2001, 1 + i, 10),
+        "recorded_by": "tester1",
+        "client_key": None,
+    } for i in range(4)]
+    ids = DAO.message.add_message_logs(values)
+    DAO.message.commit()
+
+    path = ArchiveDAO.path
+    ArchiveDAO.set_path(str(tmp_path / "archive"))
+    try:
+        assert DAO.archive.get_boundary() is None
+        age_days = (datetime.now() - datetime(2005, 1, 1)).days
+        res = archive_messages(age_days, batch_size=3)
+        assert res["rows"] == 4
+        assert res["files"] == 4
+        assert DAO.archive.get_boundary() == res["cutoff"]
+        assert DAO.message.get_message_logs_before(datetime(2005, 1, 1),
+                                                   10) == []
+        assert len(list(tmp_path.glob(
+            "archive/month=2001-01/study=none/*.parquet"))) == 1
+
+        # archive is not read for all rows unless requested
+        assert not set(ids) & {o.id for o in DAO.message.get_message_log_infos(
+            MessageCategoryId.FEEDBACK, None, None)}
+        # archived rows go first, hidden one is not returned
+        lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK,
+                                                None, None, True)
+        assert [o.id for o in lst[:3]] == ids[:3]
+        assert lst[0].description == "Archived message 0 from test_dao"
+        assert lst[0].provider == "MRI"
+        assert lst[0].event_on == datetime(2001, 1, 10)
+        assert len(lst) > 3
+        # limit stops reading of archive months
+        assert [o.id for o in DAO.archive.get_message_log_infos(
+            MessageCategoryId.FEEDBACK, None, None, 2)] == ids[:2]
+        # interval reaching past archive boundary includes archive
+        assert set(ids[:3]) <= {o.id for o in DAO.message.get_message_log_infos(
+            MessageCategoryId.FEEDBACK, None,
+            int((datetime.now() - datetime(2000, 1, 1)).total_seconds()))}
+        # interval after archive boundary is read from DB only
+        lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK,
+                                                None, 3600)
+        assert not set(ids) & {o.id for o in lst}
+        # not archived yet rows are not duplicated
+        values[0]["event_on"] = datetime(2001, 1, 11)
+        ids = DAO.message.add_message_logs(values[:1])
+        DAO.message.commit()
+        assert len(DAO.archive.add_message_logs(
+            DAO.message.get_message_logs_before(datetime(2005, 1, 1),
+                                                10))) == 1
+        lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK,
+                                                None, None, True)
+        assert lst[1].id == ids[0]
+        assert len({o.id for o in lst}) == len(lst)
+        # export stream merges archive and DB rows the same way
+        assert [o.id for batch in DAO.message.iter_message_log_infos(
+            MessageCategoryId.FEEDBACK, None, None, 2) for o in batch] == \
+            [o.id for o in lst]
+        # Arrow export too, hidden archived row is included on request
+        path_parquet = str(tmp_path / "messages.parquet")
+        res = export_messages(path_parquet, "parquet", ["id", "payload"],
+                              MessageCategoryId.FEEDBACK, None, None,
+                              datetime(2005, 1, 1), visible_only=False,
+                              batch_size=2)
+        table = pyarrow.parquet.read_table(path_parquet)
+        assert res["rows"] == table.num_rows == 5
+        assert table.column_names == ["id", "payload"]
+        assert table["id"].to_pylist()[:2] == [lst[0].id, ids[0]]
+        assert table["payload"].to_pylist()[0] == '{"n": 0}'
+        DAO.message.delete_message_logs(ids)
+        DAO.message.commit()
+    finally:
+        ArchiveDAO.set_path(path)
+
+
 def test_account_get_roles():
     logger.debug("test_account_get_roles()")
     assert len(DAO.account.get_roles()) > 0
@@ -68,6 +166,30 @@ def test_account_add_update_user():
         DAO.account.commit()
 
 
+def test_message_add_message_logs():
+    now = datetime.now()
+    values = [{
+        "study_name": "Test Study Name",
+        "category_id": MessageCategoryId.FEEDBACK,
+        "level_id": MessageLevelId.INFO,
+        "device_id": 1,
+        "provider_id": DataProviderId.MRI,
+        "is_visible": "Y",
+        "description": f"Test message {i} from test_dao",
+        "event_on": now,
+        "registered_on": now,
+        "recorded_on": now,
+        "recorded_by": "tester1",
+    } for i in range(3)]
+    ids = DAO.message.add_message_logs(values)
+    DAO.message.commit()
+    assert len(ids) == 3
+    assert ids == sorted(ids)
+    assert DAO.message.get_message_log_info(ids[1]).description == \
+        "Test message 1 from test_dao"
+    assert DAO.message.add_message_logs([]) == []
+
+
 def test_message_get_data_providers():
     assert len(DAO.message.get_data_providers()) > 0
 
@@ -87,6 +209,143 @@ def test_message_get_message_log_infos():
     assert DAO.message.get_message_log_info(msg0.id)
 
 
+def test_message_get_message_log_infos_fast_dto():
+    assert MessageDAO.fast_dto
+    lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK, None, None)
+    MessageDAO.set_fast_dto(False)
+    try:
+        expected = DAO.message.get_message_log_infos(
+            MessageCategoryId.FEEDBACK, None, None)
+    finally:
+        MessageDAO.set_fast_dto(True)
+    assert lst == expected
+    assert [o.dict() for o in lst] == [o.dict() for o in expected]
+    assert isinstance(lst[0].event_on, datetime)
+    assert lst[0].__fields_set__ == expected[0].__fields_set__
+    res = benchmark_dto(MessageCategoryId.FEEDBACK, repeat=1)
+    assert res["fast"]["rows"] == res["validated"]["rows"] == len(lst)
+    assert res["speedup"] > 0
+    assert MessageDAO.fast_dto
+
+
+def test_message_iter_message_log_batches():
+    lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK, None, None)
+    batches = list(DAO.message.iter_message_log_batches(
+        ["id", "event_on"], MessageCategoryId.FEEDBACK, batch_size=3))
+    assert all(0 < o.num_rows <= 3 for o in batches)
+    assert all(o.schema.names == ["id", "event_on"] for o in batches)
+    assert [v for o in batches for v in o["id"].to_pylist()] == \
+        [o.id for o in lst]
+    # event_on range is half open
+    start, end = lst[0].event_on, lst[-1].event_on
+    ids = [v for o in DAO.message.iter_message_log_batches(
+        ["id"], MessageCategoryId.FEEDBACK, None, start, end)
+        for v in o["id"].to_pylist()]
+    assert ids == [o.id for o in lst if start <= o.event_on < end]
+    with pytest.raises(ValueError):
+        DAO.message.iter_message_log_batches(["id", "password"])
+
+
+def test_message_iter_message_log_infos():
+    lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK, None, None)
+    batches = list(DAO.message.iter_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None, 3))
+    assert all(0 < len(o) <= 3 for o in batches)
+    assert [o for batch in batches for o in batch] == lst
+
+
+def test_message_log_indexes():
+    session = DAO.message.session()
+    names = {o["name"] for o in
+             inspect(session.get_bind()).get_indexes("message_log")}
+    assert {"idx_message_log_category_event",
+            "idx_message_log_study_visible"} <= names
+    assert not any(n.startswith("ix_message_log_") for n in names)
+
+    plan = " ".join(str(r[-1]) for r in session.execute(text(
+        "explain query plan select ml.id from message_log ml "
+        "where 1 = 1 and ml.study_id = :study_id and ml.is_visible = 'Y' "
+        "order by ml.event_on, ml.recorded_on"), {"study_id": 1}).all())
+    assert "idx_message_log_study_visible" in plan
+
+
+def test_message_log_recent():
+    now = datetime.now()
+    values = [{
+        "study_name": "Test Study Name",
+        "category_id": MessageCategoryId.FEEDBACK,
+        "level_id": MessageLevelId.INFO,
+        "device_id": 1,
+        "provider_id": DataProviderId.MRI,
+        "is_visible": "N" if i == 1 else "Y",
+        "description": f"Recent message {i} from test_dao",
+        "event_on": now - timedelta(hours=2 if i == 2 else 0),
+        "registered_on": now,
+        "recorded_on": now,
+        "recorded_by": "tester1",
+    } for i in range(3)]
+
+    def _recent_ids():
+        return {o.id for o in DAO.message.session()
+                .query(MessageLogRecentEntity).all()} & set(ids)
+
+    MessageDAO.set_recent_hours(1)
+    try:
+        # only visible rows of recent hours are copied
+        ids = DAO.message.add_message_logs(values)
+        DAO.message.commit()
+        assert _recent_ids() == {ids[0]}
+        lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK,
+                                                None, 600)
+        assert {o.id for o in lst} & set(ids) == {ids[0]}
+        assert [o for o in lst if o.id == ids[0]][0].provider == "MRI"
+        # longer interval is read from message_log
+        lst = DAO.message.get_message_log_infos(MessageCategoryId.FEEDBACK,
+                                                None, 3 * 3600)
+        assert {o.id for o in lst} & set(ids) == {ids[0], ids[2]}
+
+        DAO.message.update_message_log_visibility_by_ids([ids[0]], "N",
+                                                         "tester1")
+        DAO.message.commit()
+        assert _recent_ids() == set()
+        DAO.message.update_message_log_visibility(
+            MessageCategoryId.FEEDBACK, "Y", [MessageLevelId.INFO], 60,
+            "tester1")
+        DAO.message.commit()
+        assert _recent_ids() == {ids[0], ids[1]}
+
+        assert DAO.message.delete_message_logs_recent_before(
+            now + timedelta(minutes=1)) >= 2
+        DAO.message.commit()
+        assert _recent_ids() == set()
+        assert DAO.message.refresh_message_log_recent() >= 2
+        DAO.message.commit()
+        assert _recent_ids() == {ids[0], ids[1]}
+    finally:
+        DAO.message.delete_message_logs_recent_before(
+            now + timedelta(minutes=1))
+        DAO.message.commit()
+        MessageDAO.set_recent_hours(0)
+
+
+def test_ref_data_get_ref_data():
+    ref = DAO.ref_data.get_ref_data()
+    assert ref is DAO.ref_data.get_ref_data()
+    assert ref.level_name(MessageLevelId.ERROR) == "ERROR"
+    assert ref.provider_name(DataProviderId.DICOM_QA) == "DICOM/QA"
+    assert ref.device_kind(1)
+    assert ref.parse_device("1") == 1
+    assert ref.parse_device(ref.device_kind(1).lower()) == 1
+    with pytest.raises(ValueError):
+        ref.parse_device("12345")
+    with pytest.raises(ValueError):
+        ref.parse_device("BAD_DEVICE")
+    assert ref.category_name(12345) is None
+    ref2 = DAO.ref_data.refresh()
+    assert ref2.version == ref.version + 1
+    assert len(ref2.devices) == len(DAO.message.get_devices())
+
+
 def test_sec_sys_get_device_id_by_username():
     assert len(DAO.sec_sys.get_device_id_by_username("tester1")) > 0
 
@@ -0,0 +1,400 @@
+import json
+import logging
+import socket
+import struct
+import time
+from datetime import datetime
+
+import msgpack
+import pytest
+from sqlalchemy import exc
+
+from repromon_app.dao import DAO
+from repromon_app.ingest import (IngestListener, IngestQueue,
+                                 IngestQueueFullError, IngestSpool,
+                                 RateLimiter, RecentKeys)
+from repromon_app.model import (DataProviderId, MessageCategoryId,
+                                MessageLevelId)
+from repromon_app.service import MessageService
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+def _values(description: str) -> dict:
+    now = datetime.now()
+    return {
+        "study_id": None,
+        "study_name": "Test Study Name",
+        "category_id": MessageCategoryId.FEEDBACK,
+        "level_id": MessageLevelId.INFO,
+        "device_id": 1,
+        "provider_id": DataProviderId.MRI,
+        "is_visible": "Y",
+        "description": description,
+        "payload": None,
+        "event_on": now,
+        "registered_on": now,
+        "recorded_on": now,
+        "recorded_by": "tester1",
+    }
+
+
+def test_ingest_queue_full():
+    q = IngestQueue(lambda values: [], max_size=1)
+    assert q.put(_values("Queued message 0 from test_ingest"))
+    with pytest.raises(IngestQueueFullError):
+        q.put(_values("Queued message 1 from test_ingest"))
+    stats = q.stats()
+    assert stats["depth"] == 1
+    assert stats["enqueued"] == 1
+    assert stats["rejected"] == 1
+    assert not stats["running"]
+
+
+def test_ingest_queue_write():
+    q = IngestQueue(MessageService().write_messages, max_size=100,
+                    batch_max_size=3, batch_linger_ms=50)
+    q.start()
+    try:
+        for i in range(7):
+            assert q.put(_values(f"Queued message {i} from test_ingest_write"))
+        q.flush()
+    finally:
+        q.stop()
+
+    stats = q.stats()
+    assert stats["written"] == 7
+    assert stats["dropped"] == 0
+    assert stats["batches"] >= 3
+    assert stats["depth"] == 0
+
+    lst = [o for o in DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None)
+        if o.description.endswith("from test_ingest_write")]
+    assert len(lst) == 7
+
+
+def test_ingest_queue_write_dropped():
+    q = IngestQueue(MessageService().write_messages, max_size=100,
+                    batch_max_size=10, batch_linger_ms=50)
+    values = [_values(f"Queued message {i} from test_ingest_dropped")
+              for i in range(3)]
+    # event_on is not nullable, so DB rejects the second message
+    values[1]["event_on"] = None
+    for v in values:
+        q.put(v)
+    q.start()
+    try:
+        q.flush()
+    finally:
+        q.stop()
+    stats = q.stats()
+    assert stats["written"] == 2
+    assert stats["dropped"] == 1
+
+    lst = [o for o in DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None)
+        if o.description.endswith("from test_ingest_dropped")]
+    assert len(lst) == 2
+
+
+def test_ingest_queue_write_retry():
+    written = []
+
+    def _writer(values):
+        if not written:
+            written.append(None)
+            raise exc.OperationalError("insert", {}, Exception("locked"))
+        written.extend(values)
+        return list(range(len(values)))
+
+    q = IngestQueue(_writer, batch_max_size=10, batch_linger_ms=50)
+    for i in range(3):
+        q.put(_values(f"Queued message {i} from test_ingest_retry"))
+    q.start()
+    try:
+        q.flush()
+    finally:
+        q.stop()
+    stats = q.stats()
+    assert len(written) == 4
+    assert stats["written"] == 3
+    assert stats["dropped"] == 0
+    assert stats["retries"] == 1
+
+
+def _frame(obj: dict) -> bytes:
+    payload = json.dumps(obj).encode()
+    return struct.pack(">I", len(payload)) + payload
+
+
+def _read_frame(conn: socket.socket) -> dict:
+    f = conn.makefile("rb")
+    try:
+        size = struct.unpack(">I", f.read(4))[0]
+        return json.loads(f.read(size))
+    finally:
+        f.close()
+
+
+def test_ingest_listener(tmp_path, apikey_tester1, apikey_tester2):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        udp_port = s.getsockname()[1]
+    listener = IngestListener(MessageService().authenticate_ingest,
+                              MessageService().accept_messages,
+                              socket_path=str(tmp_path / "ingest.sock"),
+                              udp_port=udp_port,
+                              max_frame_size=1024)
+    message = {
+        "category": int(MessageCategoryId.FEEDBACK),
+        "level": "INFO",
+        "provider": int(DataProviderId.MRI),
+    }
+    listener.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(str(tmp_path / "ingest.sock"))
+            conn.sendall(_frame({**message, "description": "No auth"}))
+            assert _read_frame(conn)["detail"] == "Not authenticated"
+            # tester1 has no sys_data_entry role
+            conn.sendall(_frame({"apikey": apikey_tester1}))
+            assert not _read_frame(conn)["ok"]
+            conn.sendall(_frame({"apikey": apikey_tester2}))
+            assert _read_frame(conn)["ok"]
+            conn.sendall(_frame({"messages": [
+                {**message, "description": "Unix message from "
+                                           "test_ingest_listener"},
+                {**message, "level": "UNKNOWN", "description": "Bad level"}
+            ]}))
+            ack = _read_frame(conn)
+            assert ack["ok"]
+            assert ack["ids"][0] and ack["ids"][1] is None
+            assert ack["errors"][0]["index"] == 1
+            conn.sendall(struct.pack(">I", 2048))
+            assert "too large" in _read_frame(conn)["detail"]
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as conn:
+            conn.sendto(_frame({**message, "apikey": apikey_tester2,
+                                "description": "UDP message from "
+                                               "test_ingest_listener"}),
+                        ("127.0.0.1", udp_port))
+        t_end = time.monotonic() + 5
+        while listener.stats()["messages"] < 2 and time.monotonic() < t_end:
+            time.sleep(0.01)
+    finally:
+        listener.stop()
+
+    stats = listener.stats()
+    assert not stats["running"]
+    assert stats["messages"] == 2
+    assert stats["rejected"] == 1
+    assert stats["auth_failed"] == 2
+    assert not (tmp_path / "ingest.sock").exists()
+
+    lst = [o for o in DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None)
+        if o.description.endswith("from test_ingest_listener")]
+    assert len(lst) == 2
+    assert all(o.recorded_by == "tester2" for o in lst)
+
+
+def test_ingest_listener_format(tmp_path, apikey_tester2):
+    listener = IngestListener(MessageService().authenticate_ingest,
+                              MessageService().accept_messages,
+                              socket_path=str(tmp_path / "ingest.sock"))
+    listener.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(str(tmp_path / "ingest.sock"))
+            f = conn.makefile("rb")
+            # format is set by header flag, not guessed from payload
+            payload = msgpack.packb({"apikey": apikey_tester2})
+            conn.sendall(struct.pack(
+                ">I", len(payload) | IngestListener.FRAME_MSGPACK) + payload)
+            header = struct.unpack(">I", f.read(4))[0]
+            assert header & IngestListener.FRAME_MSGPACK
+            ack = msgpack.unpackb(
+                f.read(header & ~IngestListener.FRAME_MSGPACK))
+            assert ack["ok"]
+
+            payload = b"  " + json.dumps({"messages": []}).encode()
+            conn.sendall(struct.pack(">I", len(payload)) + payload)
+            header = struct.unpack(">I", f.read(4))[0]
+            assert not header & IngestListener.FRAME_MSGPACK
+            assert json.loads(f.read(header))["ok"]
+
+            # MessagePack payload without flag is invalid JSON
+            payload = msgpack.packb({"messages": []})
+            conn.sendall(struct.pack(">I", len(payload)) + payload)
+            header = struct.unpack(">I", f.read(4))[0]
+            assert not json.loads(f.read(header))["ok"]
+            f.close()
+    finally:
+        listener.stop()
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(
+        10, 5,
+        users=RateLimiter.parse_limits("tester1=0"),
+        roles=RateLimiter.parse_limits("admin=0, data_collector=1/2, "
+                                       "sys_data_entry=2"))
+    assert limiter.get_limit("tester1", ["sys_data_entry"]) == (0, 0)
+    assert limiter.get_limit("tester2", ["data_collector",
+                                         "sys_data_entry"]) == (2, 2)
+    assert limiter.get_limit("tester3", ["data_collector"]) == (1, 2)
+    assert limiter.get_limit("tester3", ["data_collector",
+                                         "admin"]) == (0, 0)
+    assert limiter.get_limit("tester4", []) == (10, 5)
+
+    assert limiter.acquire("tester1", [], 1000) == 0
+    assert limiter.acquire("tester3", ["data_collector"]) == 0
+    assert limiter.acquire("tester3", ["data_collector"]) == 0
+    assert 0.9 < limiter.acquire("tester3", ["data_collector"]) <= 1
+    # batch larger than burst passes on full bucket only
+    assert limiter.acquire("tester4", [], 7) == 0
+    assert limiter.acquire("tester4", [], 1) > 0.2
+    stats = limiter.stats()
+    assert stats["users"] == 3
+    assert stats["allowed"] == 1009
+    assert stats["limited"] == 2
+
+    limiter.reset("tester3")
+    assert limiter.acquire("tester3", ["data_collector"]) == 0
+
+
+def test_recent_keys():
+    keys = RecentKeys(max_size=2)
+    keys.put(("tester1", "key1"), 1)
+    keys.put(("tester1", "key2"), 2)
+    assert keys.get(("tester1", "key1")) == 1
+    keys.put(("tester1", "key3"), 3)
+    # key2 is least recently used and evicted
+    assert ("tester1", "key2") not in keys
+    assert keys.get(("tester2", "key1")) is None
+    assert keys.get(("tester1", "key3")) == 3
+    stats = keys.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evicted"] == 1
+
+
+def test_ingest_spool_quarantine(tmp_path):
+    values = [_values(f"Spooled message {i} from test_ingest_quarantine")
+              for i in range(5)]
+    # DB rejects message 1, and message 3 fails before it reaches DB
+    values[1]["event_on"] = None
+    del values[3]["recorded_by"]
+    spool = IngestSpool(str(tmp_path), MessageService().replay_messages)
+    spool.put_all(values)
+    spool.stop()
+    # damaged record in the middle of segment
+    segment = next(tmp_path.glob("*.spool"))
+    lines = segment.read_bytes().splitlines(keepends=True)
+    segment.write_bytes(b"".join(lines[:1] + [b'{"torn": \n'] + lines[1:]))
+
+    spool = IngestSpool(str(tmp_path), MessageService().replay_messages,
+                        replay_batch_size=2, replay_interval_ms=10)
+    assert spool.pending == 6
+    spool.start()
+    try:
+        assert spool.flush()
+    finally:
+        spool.stop()
+    stats = spool.stats()
+    assert stats["replayed"] == 3
+    assert stats["corrupted"] == 1
+    assert stats["quarantined"] == 2
+    assert stats["pending"] == 0
+
+    failed = next(tmp_path.glob("*.failed")).read_bytes().splitlines()
+    assert failed[0] == b'{"torn": '
+    assert [json.loads(o)["description"] for o in failed[1:]] == [
+        values[1]["description"], values[3]["description"]]
+    lst = [o.description for o in DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None)
+        if o.description.endswith("from test_ingest_quarantine")]
+    assert sorted(lst) == [values[i]["description"] for i in (0, 2, 4)]
+
+
+def test_ingest_spool_recover(tmp_path):
+    def _writer_down(values):
+        raise exc.OperationalError("insert", {}, Exception("DB is down"))
+
+    spool = IngestSpool(str(tmp_path), _writer_down, replay_interval_ms=10)
+    spool.start()
+    try:
+        spool.put_all([_values(f"Spooled message {i} from test_ingest_recover")
+                       for i in range(3)])
+        assert not spool.flush(0.2)
+    finally:
+        spool.stop()
+    stats = spool.stats()
+    assert stats["pending"] == 3
+    assert stats["replay_failed"] >= 3
+    assert stats["last_error"]
+
+    # restart with DB available, spool is recovered from disk
+    spool = IngestSpool(str(tmp_path), MessageService().replay_messages,
+                        replay_interval_ms=10)
+    assert spool.pending == 3
+    spool.start()
+    try:
+        assert spool.flush()
+    finally:
+        spool.stop()
+    assert spool.stats()["replayed"] == 3
+    # replayed segments and checkpoints are removed
+    assert all(f.stat().st_size == 0 for f in tmp_path.iterdir())
+
+
+def test_ingest_spool_replay(tmp_path):
+    registered_on = datetime(2020, 1, 2, 3, 4, 5, 6)
+    spool = IngestSpool(str(tmp_path), MessageService().replay_messages,
+                        segment_max_bytes=512, fsync="always",
+                        replay_batch_size=2, replay_interval_ms=10)
+    values = [_values(f"Spooled message {i} from test_ingest_replay")
+              for i in range(5)]
+    for v in values:
+        v["registered_on"] = registered_on
+        assert len(spool.put_all([v])) == 1
+    stats = spool.stats()
+    assert stats["pending"] == 5
+    assert stats["segments"] > 1
+    assert stats["size_bytes"] > 0
+
+    spool.start()
+    try:
+        assert spool.flush()
+    finally:
+        spool.stop()
+    stats = spool.stats()
+    assert stats["replayed"] == 5
+    assert stats["size_bytes"] == 0
+    assert stats["replay_rate"] > 0
+
+    lst = [o for o in DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, None)
+        if o.description.endswith("from test_ingest_replay")]
+    assert len(lst) == 5
+    assert all(o.registered_on == registered_on for o in lst)
+
+
+def test_ingest_spool_replay_latency(tmp_path, monkeypatch):
+    spool = IngestSpool(str(tmp_path), MessageService().replay_messages)
+    latencies = []
+    monkeypatch.setattr(spool, "observe_latency", latencies.append)
+    monkeypatch.setattr(MessageService, "ingest_spool", spool)
+    try:
+        # replay write time is not ingest latency
+        MessageService().replay_messages(
+            [_values("Replayed message from test_ingest_latency")])
+        assert latencies == []
+        MessageService().write_messages(
+            [_values("Live message from test_ingest_latency")])
+        assert len(latencies) == 1
+    finally:
+        spool.stop()
@@ -0,0 +1,162 @@
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+
+from repromon_app.dao import DAO, MessageDAO
+from repromon_app.maintenance import (INTERVAL_MONTH, INTERVAL_WEEK,
+                                      MessageLogPartitioner,
+                                      RecentMessagesPruner, partition_end,
+                                      partition_name, partition_start)
+from repromon_app.model import (DataProviderId, MessageCategoryId,
+                                MessageLevelId)
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+def test_partition_bounds():
+    ts = datetime(2024, 1, 31, 15, 30)
+    assert partition_start(ts, INTERVAL_MONTH) == datetime(2024, 1, 1)
+    assert partition_end(ts, INTERVAL_MONTH) == datetime(2024, 2, 1)
+    assert partition_end(datetime(2023, 12, 1), INTERVAL_MONTH) == \
+        datetime(2024, 1, 1)
+    # 2024-01-31 is Wednesday
+    assert partition_start(ts, INTERVAL_WEEK) == datetime(2024, 1, 29)
+    assert partition_end(ts, INTERVAL_WEEK) == datetime(2024, 2, 5)
+    # switch from monthly to weekly partitions is aligned to Monday
+    assert partition_end(datetime(2024, 3, 1), INTERVAL_WEEK) == \
+        datetime(2024, 3, 4)
+    assert partition_name(datetime(2024, 3, 4)) == "message_log_p20240304"
+
+
+def test_message_log_partitioner():
+    with pytest.raises(ValueError):
+        MessageLogPartitioner("day")
+
+    # SQLite message_log is not partitioned, so nothing to do
+    assert not DAO.message.is_message_log_partitioned()
+    assert DAO.message.get_message_log_partitions() == []
+    job = MessageLogPartitioner(INTERVAL_WEEK, retention_days=30)
+    assert job.run() == {"created": [], "dropped": [], "deleted": 0}
+    job.start()
+    assert job.is_running()
+    job.stop()
+    assert not job.is_running()
+    stats = job.stats()
+    assert stats["runs"] >= 1
+    assert stats["last_error"] is None
+
+
+def test_message_log_partitioner_partitioned(monkeypatch):
+    calls = []
+    # monthly partitions through 2024-01, 2024-02 one is missing
+    monkeypatch.setattr(DAO.message, "get_message_log_partitions", lambda: [
+        ("message_log_default", None, None),
+        ("message_log_p20231201", datetime(2023, 12, 1), datetime(2024, 1, 1)),
+        ("message_log_p20240101", datetime(2024, 1, 1), datetime(2024, 2, 1)),
+    ])
+    monkeypatch.setattr(DAO.message, "add_message_log_partition",
+                        lambda *args: calls.append(("add",) + args))
+    monkeypatch.setattr(DAO.message, "drop_message_log_partition",
+                        lambda name: calls.append(("drop", name)))
+    monkeypatch.setattr(DAO.message, "delete_message_logs_before",
+                        lambda *args: calls.append(("delete",) + args) or 3)
+    monkeypatch.setattr(DAO.message, "delete_message_log_client_keys_before",
+                        lambda event_on: calls.append(("keys", event_on)))
+    now = datetime(2024, 3, 6)
+
+    # gap is filled from the last range up to premake months after the
+    # current one, rows of new ranges are moved from default partition
+    job = MessageLogPartitioner(INTERVAL_MONTH, premake=1)
+    assert job.run(now) == {
+        "created": ["message_log_p20240201", "message_log_p20240301",
+                    "message_log_p20240401"],
+        "dropped": [], "deleted": 0}
+    assert calls == [
+        ("add", "message_log_p20240201", datetime(2024, 2, 1),
+         datetime(2024, 3, 1), "message_log_default"),
+        ("add", "message_log_p20240301", datetime(2024, 3, 1),
+         datetime(2024, 4, 1), "message_log_default"),
+        ("add", "message_log_p20240401", datetime(2024, 4, 1),
+         datetime(2024, 5, 1), "message_log_default"),
+    ]
+
+    # cutoff 2024-01-01 is the end of 2023-12 partition, so it is dropped
+    calls.clear()
+    job = MessageLogPartitioner(INTERVAL_MONTH, premake=1, retention_days=65)
+    res = job.run(now)
+    assert res["dropped"] == ["message_log_p20231201"]
+    assert res["deleted"] == 3
+    assert calls[3:] == [
+        ("delete", "message_log_default", datetime(2024, 1, 1)),
+        ("drop", "message_log_p20231201"),
+        ("keys", datetime(2024, 1, 1)),
+    ]
+
+    # cutoff 2024-01-26 is within kept 2024-01 partition, so its keys
+    # are kept as well
+    calls.clear()
+    job = MessageLogPartitioner(INTERVAL_MONTH, premake=1, retention_days=40)
+    res = job.run(now)
+    assert res["dropped"] == ["message_log_p20231201"]
+    assert calls[3:] == [
+        ("delete", "message_log_default", datetime(2024, 1, 26)),
+        ("drop", "message_log_p20231201"),
+        ("keys", datetime(2024, 1, 1)),
+    ]
+    assert job.stats()["deleted"] == 3
+
+
+def test_message_log_partitioner_on_removed(monkeypatch):
+    calls = []
+    now = datetime(2024, 3, 6)
+    # only default partition with rows older than retention
+    monkeypatch.setattr(DAO.message, "get_message_log_partitions",
+                        lambda: [("message_log_default", None, None)])
+    monkeypatch.setattr(DAO.message, "add_message_log_partition",
+                        lambda *args: None)
+    monkeypatch.setattr(DAO.message, "delete_message_logs_before",
+                        lambda name, event_on: deleted.pop())
+    deleted = [0, 2]
+    job = MessageLogPartitioner(INTERVAL_MONTH, premake=0,
+                                retention_days=30,
+                                on_removed=lambda: calls.append(1))
+    assert job.run(now)["deleted"] == 2
+    assert calls == [1]
+    assert job.run(now)["deleted"] == 0
+    assert calls == [1]
+
+
+def test_recent_messages_pruner():
+    now = datetime.now()
+    DAO.message.add_message_logs([{
+        "study_name": "Test Study Name",
+        "category_id": MessageCategoryId.FEEDBACK,
+        "level_id": MessageLevelId.INFO,
+        "device_id": 1,
+        "provider_id": DataProviderId.MRI,
+        "description": "Recent message from test_maintenance",
+        "event_on": now,
+        "registered_on": now,
+        "recorded_on": now,
+        "recorded_by": "tester1",
+    }])
+    DAO.message.commit()
+    job = RecentMessagesPruner()
+    assert job.run() == {"pruned": 0, "refreshed": 0}
+
+    MessageDAO.set_recent_hours(1)
+    try:
+        # the first run copies visible rows, later ones only prune
+        res = job.run()
+        assert res["refreshed"] > 0
+        assert job.run() == {"pruned": 0, "refreshed": 0}
+        res = job.run(datetime.now() + timedelta(hours=2))
+        assert res["pruned"] == job.stats()["refreshed"]
+        assert job.stats()["runs"] == 4
+    finally:
+        DAO.message.delete_message_logs_recent_before(
+            datetime.now() + timedelta(hours=2))
+        DAO.message.commit()
+        MessageDAO.set_recent_hours(0)
@@ -1,8 +1,15 @@
 import logging
+from datetime import datetime, timedelta, timezone
 
-from repromon_app.dao import DAO
+import pytest
+from sqlalchemy import text
+
+from repromon_app.cache import LogCache, RecentLogBuffer
+from repromon_app.dao import DAO, MessageDAO
+from repromon_app.ingest import IngestWriteError, RecentKeys
 from repromon_app.model import (DataProviderId, MessageCategoryId,
-                                MessageLevelId)
+                                MessageLevelId, MessageSendDTO,
+                                StudyDataEntity)
 from repromon_app.service import (AccountService, FeedbackService,
                                   MessageService)
 
@@ -59,10 +66,235 @@ def test_feedback_get_message_log():
     assert len(FeedbackService().get_message_log(None, None, None)) > 0
 
 
+def test_feedback_get_message_log_cache(monkeypatch):
+    monkeypatch.setattr(FeedbackService, "log_cache", LogCache())
+    svc = FeedbackService()
+    res = svc.get_message_log(MessageCategoryId.FEEDBACK)
+    assert svc.get_message_log(MessageCategoryId.FEEDBACK) == res
+    assert FeedbackService.log_cache.stats()["hits"] == 1
+
+    msg = MessageService().send_message(
+        "tester1", None, "Test Study Name",
+        MessageCategoryId.FEEDBACK,
+        MessageLevelId.INFO,
+        1,
+        DataProviderId.MRI,
+        "Cached message from test_service",
+        None
+    )
+    res2 = svc.get_message_log(MessageCategoryId.FEEDBACK)
+    assert [o.id for o in res2] == [o.id for o in res] + [msg.id]
+    assert FeedbackService.log_cache.stats()["invalidated"] == 1
+
+
+def test_feedback_get_message_log_buffer(monkeypatch):
+    monkeypatch.setattr(FeedbackService, "log_buffer", RecentLogBuffer())
+    svc = FeedbackService()
+    svc.load_message_log_buffer(900, 1000)
+    msg = MessageService().send_message(
+        "tester1", None, "Test Study Name",
+        MessageCategoryId.FEEDBACK,
+        MessageLevelId.INFO,
+        1,
+        DataProviderId.MRI,
+        "Buffered message from test_service",
+        None
+    )
+    res = svc.get_message_log(MessageCategoryId.FEEDBACK, None, 600)
+    assert res == DAO.message.get_message_log_infos(
+        MessageCategoryId.FEEDBACK, None, 600)
+    assert res[-1] == DAO.message.get_message_log_info(msg.id)
+    assert FeedbackService.log_buffer.stats()["hits"] == 1
+    # longer interval is read from DB
+    assert svc.get_message_log(MessageCategoryId.FEEDBACK, None, 3600)
+    assert FeedbackService.log_buffer.stats()["hits"] == 1
+
+
+def test_feedback_get_message_log_delta(monkeypatch):
+    monkeypatch.setattr(FeedbackService, "delta_overlap_sec", 0)
+    svc = FeedbackService()
+    delta = svc.get_message_log_delta()
+    assert len(delta.items) == len(svc.get_message_log())
+    assert delta.since_id == max(o.id for o in delta.items)
+    assert not delta.hidden_ids
+
+    res = MessageService().send_messages("tester2", [
+        MessageSendDTO(category=MessageCategoryId.FEEDBACK,
+                       level=MessageLevelId.INFO,
+                       provider=DataProviderId.MRI,
+                       description=f"Delta message {i} from test_service")
+        for i in range(2)])
+    delta = svc.get_message_log_delta(since_id=delta.since_id,
+                                      since_recorded_on=delta.since_recorded_on)
+    assert [o.id for o in delta.items] == res.ids
+    assert delta.since_id == res.ids[1]
+
+    DAO.message.update_message_log_visibility_by_ids([res.ids[0]], "N",
+                                                     "tester1")
+    DAO.message.commit()
+    delta = svc.get_message_log_delta(since_id=delta.since_id,
+                                      since_recorded_on=delta.since_recorded_on)
+    assert not delta.items
+    assert delta.hidden_ids == [res.ids[0]]
+    assert delta.since_id == res.ids[1]
+
+    delta2 = svc.get_message_log_delta(
+        since_id=delta.since_id, since_recorded_on=delta.since_recorded_on)
+    assert not delta2.items and not delta2.hidden_ids
+
+
+def test_feedback_get_message_log_delta_out_of_order(monkeypatch):
+    monkeypatch.setattr(FeedbackService, "delta_overlap_sec", 60)
+    svc = FeedbackService()
+    delta = svc.get_message_log_delta()
+    max_id = DAO.message.session().scalar(
+        text("SELECT max(id) FROM message_log")) or 0
+
+    # lower ID of concurrent transaction is committed after higher one
+    t0 = datetime.now()
+    values = [{**MessageService()._message_values(
+        "tester1", None, None, MessageCategoryId.FEEDBACK,
+        MessageLevelId.INFO, 1, DataProviderId.MRI,
+        f"Out of order message {i} from test_service", None),
+        "id": max_id + i, "recorded_on": t0} for i in (1, 2)]
+    try:
+        DAO.message.add_message_logs(values[1:])
+        DAO.message.commit()
+        delta = svc.get_message_log_delta(
+            since_id=delta.since_id, since_recorded_on=delta.since_recorded_on)
+        assert max_id + 2 in [o.id for o in delta.items]
+
+        DAO.message.add_message_logs(values[:1])
+        DAO.message.commit()
+        delta = svc.get_message_log_delta(
+            since_id=delta.since_id, since_recorded_on=delta.since_recorded_on)
+        assert max_id + 1 in [o.id for o in delta.items]
+    finally:
+        DAO.message.delete_message_logs([max_id + 1, max_id + 2])
+        DAO.message.commit()
+
+
+def test_feedback_get_message_log_etag():
+    svc = FeedbackService()
+    etag = svc.get_message_log_etag(MessageCategoryId.FEEDBACK)
+    etag_other = svc.get_message_log_etag(MessageCategoryId.FEEDBACK, -1)
+    assert etag == svc.get_message_log_etag(MessageCategoryId.FEEDBACK)
+    assert etag != svc.get_message_log_etag(MessageCategoryId.FEEDBACK,
+                                            interval_sec=3600)
+
+    MessageService().send_message(
+        "tester1", None, "Test Study Name",
+        MessageCategoryId.FEEDBACK,
+        MessageLevelId.INFO,
+        1,
+        DataProviderId.MRI,
+        "ETag message from test_service",
+        None
+    )
+    etag2 = svc.get_message_log_etag(MessageCategoryId.FEEDBACK)
+    assert etag2 != etag
+    assert etag2 == svc.get_message_log_etag(MessageCategoryId.FEEDBACK)
+    assert etag_other == svc.get_message_log_etag(MessageCategoryId.FEEDBACK,
+                                                  -1)
+
+    FeedbackService.log_versions.bump_category(MessageCategoryId.FEEDBACK)
+    assert etag2 != svc.get_message_log_etag(MessageCategoryId.FEEDBACK)
+    assert etag_other != svc.get_message_log_etag(MessageCategoryId.FEEDBACK,
+                                                  -1)
+
+
+def test_feedback_get_message_log_page():
+    event_on = datetime(2023, 10, 1, 10, 0, 0)
+    MessageService().send_messages("tester2", [
+        MessageSendDTO(category=MessageCategoryId.FEEDBACK,
+                       level=MessageLevelId.INFO,
+                       provider=DataProviderId.MRI,
+                       description=f"Page message {i} from test_service",
+                       event_on=event_on)
+        for i in range(5)])
+    svc = FeedbackService()
+    expected = [o.id for o in svc.get_message_log(None, None, None)]
+
+    ids = []
+    cursors = []
+    page = svc.get_message_log_page(page_size=3)
+    assert page.prev_cursor is None
+    while True:
+        ids += [o.id for o in page.items]
+        cursors.append(page.prev_cursor)
+        if not page.next_cursor:
+            break
+        page = svc.get_message_log_page(cursor=page.next_cursor, page_size=3)
+    assert sorted(ids) == sorted(expected)
+    assert len(ids) == len(set(ids))
+
+    # walk back from the last page
+    ids_back = []
+    page = svc.get_message_log_page(page_size=3, backward=True)
+    assert page.next_cursor is None
+    while True:
+        ids_back = [o.id for o in page.items] + ids_back
+        if not page.prev_cursor:
+            break
+        page = svc.get_message_log_page(cursor=page.prev_cursor,
+                                        page_size=3, backward=True)
+    assert ids_back == ids
+
+    # previous page of the second page is the first one
+    page = svc.get_message_log_page(cursor=cursors[1], page_size=3,
+                                    backward=True)
+    assert [o.id for o in page.items] == ids[:3]
+    assert page.prev_cursor is None
+    with pytest.raises(ValueError):
+        svc.get_message_log_page(cursor="invalid")
+
+
 def test_feedback_get_study_header():
     assert FeedbackService().get_study_header(-1) is None
 
 
+def test_feedback_get_study_header_etag():
+    svc = FeedbackService()
+    o = StudyDataEntity(name="Test ETag Study", start_ts=datetime.now())
+    DAO.study.add(o)
+    DAO.study.commit()
+    etag = svc.get_study_header_etag(svc.get_study_header(o.id))
+    assert etag == svc.get_study_header_etag(svc.get_study_header(o.id))
+    assert etag != svc.get_study_header_etag(None)
+
+    # study change without new messages changes ETag too
+    o.end_ts = datetime.now()
+    DAO.study.commit()
+    assert etag != svc.get_study_header_etag(svc.get_study_header(o.id))
+
+
+def test_feedback_invalidate_message_log(monkeypatch):
+    monkeypatch.setattr(FeedbackService, "log_cache", LogCache())
+    svc = FeedbackService()
+    etag = svc.get_message_log_etag(MessageCategoryId.FEEDBACK, 1)
+    svc.get_message_log(MessageCategoryId.FEEDBACK)
+    assert FeedbackService.log_cache.stats()["size"] == 1
+    svc.invalidate_message_log()
+    assert FeedbackService.log_cache.stats()["size"] == 0
+    assert etag != svc.get_message_log_etag(MessageCategoryId.FEEDBACK, 1)
+
+
+def test_message_get_message_info():
+    msg = MessageService().send_message(
+        "tester1", None, "Test Study Name",
+        MessageCategoryId.FEEDBACK,
+        MessageLevelId.WARNING,
+        1,
+        DataProviderId.DICOM_QA,
+        "Test message info from test_service",
+        None
+    )
+    o = MessageService().get_message_info(msg)
+    assert o.level == "WARNING"
+    assert o.provider == "DICOM/QA"
+    assert o == DAO.message.get_message_log_info(msg.id)
+
+
 def test_message_send_message():
     msg = MessageService().send_message(
         "tester1", None, "Test Study Name",
@@ -76,3 +308,172 @@ def test_message_send_message():
     assert msg
     msg2 = DAO.message.get_message_log_info(msg.id)
     assert msg2
+
+
+def test_message_send_message_client_key():
+    def _send():
+        return MessageService().send_message(
+            "tester1", None, "Test Study Name",
+            MessageCategoryId.FEEDBACK,
+            MessageLevelId.INFO,
+            1,
+            DataProviderId.MRI,
+            "Idempotent message from test_service",
+            None,
+            client_key="test_service_client_key_1"
+        )
+
+    msg = _send()
+    assert msg.client_key == "test_service_client_key_1"
+    assert _send().id == msg.id
+    # key evicted from memory is resolved via DB unique index
+    MessageService.recent_keys = RecentKeys()
+    assert _send().id == msg.id
+    res = MessageService().send_messages("tester1", [
+        MessageSendDTO(category="Feedback", level="INFO", provider="MRI",
+                       description="Idempotent message from test_service",
+                       client_key=key)
+        for key in ["test_service_client_key_1",
+                    "test_service_client_key_2",
+                    "test_service_client_key_2"]
+    ])
+    assert res.ids[0] == msg.id
+    assert res.ids[1] and res.ids[1] == res.ids[2]
+    assert len([o for o in DAO.message.get_message_log_client_keys(
+        ["test_service_client_key_1", "test_service_client_key_2"])]) == 2
+    # not partitioned message_log unique index is enough
+    assert DAO.message.session().execute(text(
+        "select count(*) from message_log_client_key "
+        "where client_key like 'test_service_client_key_%'")).scalar() == 0
+
+
+def test_message_send_message_client_key_partitioned(monkeypatch):
+    # partitioned message_log unique index includes event_on, so only
+    # message_log_client_key table catches retries with new event_on
+    monkeypatch.setattr(MessageDAO, "client_key_table", True)
+    session = DAO.message.session()
+    session.execute(text("drop index idx_message_log_client_key"))
+    session.execute(text(
+        "create unique index idx_message_log_client_key "
+        "on message_log (recorded_by, client_key, event_on)"))
+    session.commit()
+    try:
+        def _send():
+            return MessageService().send_message(
+                "tester1", None, "Test Study Name",
+                MessageCategoryId.FEEDBACK,
+                MessageLevelId.INFO,
+                1,
+                DataProviderId.MRI,
+                "Partitioned idempotent message from test_service",
+                None,
+                client_key="test_service_client_key_3"
+            )
+
+        msg = _send()
+        MessageService.recent_keys = RecentKeys()
+        assert _send().id == msg.id
+        MessageService.recent_keys = RecentKeys()
+        assert MessageService().write_messages([
+            MessageService()._message_values(
+                "tester1", None, None, MessageCategoryId.FEEDBACK,
+                MessageLevelId.INFO, 1, DataProviderId.MRI,
+                "Partitioned idempotent message from test_service", None,
+                client_key="test_service_client_key_3")
+        ]) == [msg.id]
+        assert session.execute(text(
+            "select count(*) from message_log "
+            "where client_key = 'test_service_client_key_3'")).scalar() == 1
+    finally:
+        session.rollback()
+        session.execute(text("drop index idx_message_log_client_key"))
+        session.execute(text(
+            "create unique index idx_message_log_client_key "
+            "on message_log (recorded_by, client_key)"))
+        session.commit()
+
+
+def test_message_send_messages():
+    res = MessageService().send_messages("tester1", [
+        MessageSendDTO(study="Test Study Name", category="Feedback",
+                       level="INFO", provider="MRI",
+                       description="Batch message 1 from test_service"),
+        MessageSendDTO(study="Test Study Name", category="Feedback",
+                       level="BAD_LEVEL", provider="MRI",
+                       description="Batch message 2 from test_service"),
+        MessageSendDTO(study="Test Study Name", category="Feedback",
+                       level="ERROR", provider="MRI",
+                       description="Batch message 3 from test_service"),
+    ])
+    assert len(res.ids) == 3
+    assert res.ids[0] and res.ids[2]
+    assert res.ids[1] is None
+    assert len(res.errors) == 1
+    assert res.errors[0].index == 1
+    assert DAO.message.get_message_log_info(res.ids[2]).level == "ERROR"
+
+
+def test_message_send_messages_device():
+    res = MessageService().send_messages("tester1", [
+        MessageSendDTO(category="Feedback", level="INFO", provider="MRI",
+                       device=device,
+                       description="Device message from test_service")
+        for device in (None, "mri", "1", "BAD_DEVICE")])
+    assert all(res.ids[:3])
+    assert res.ids[3] is None
+    assert [o.index for o in res.errors] == [3]
+    assert "BAD_DEVICE" in res.errors[0].detail
+    assert {DAO.message.get_message_log_info(i).device_id
+            for i in res.ids[:3]} == {1}
+
+
+def test_message_send_messages_event_on_tz():
+    event_on = datetime.now(timezone.utc) - timedelta(minutes=5)
+    MessageDAO.set_recent_hours(1)
+    try:
+        # aware event_on, e.g. MessagePack timestamp, is stored as naive
+        # local time and compared with recent hours start
+        res = MessageService().send_messages("tester1", [
+            MessageSendDTO(category="Feedback", level="INFO",
+                           provider="MRI", event_on=event_on,
+                           description="Aware event_on from test_service")
+        ])
+        assert not res.errors
+        o = DAO.message.get_message_log(res.ids[0])
+        assert o.event_on == event_on.astimezone().replace(tzinfo=None)
+        assert res.ids[0] in {o.id for o in DAO.message.get_message_log_infos(
+            MessageCategoryId.FEEDBACK, None, 600)}
+    finally:
+        DAO.message.delete_message_logs_recent_before(
+            datetime.now() + timedelta(minutes=1))
+        DAO.message.commit()
+        MessageDAO.set_recent_hours(0)
+
+
+def test_message_write_messages_rejected():
+    now = datetime.now()
+    values = [{
+        "study_id": None,
+        "study_name": "Test Study Name",
+        "category_id": MessageCategoryId.FEEDBACK,
+        "level_id": MessageLevelId.INFO,
+        "device_id": 1,
+        "provider_id": DataProviderId.MRI,
+        "is_visible": "Y",
+        "description": f"Write message {i} from test_service",
+        "payload": None,
+        # event_on is not nullable, so DB rejects the second message
+        "event_on": None if i == 1 else now,
+        "registered_on": now,
+        "recorded_on": now,
+        "recorded_by": "tester1",
+    } for i in range(3)]
+    with pytest.raises(IngestWriteError) as e:
+        MessageService().write_messages(values)
+    assert list(e.value.errors) == [1]
+    assert e.value.ids[0] and e.value.ids[2]
+    assert e.value.ids[1] is None
+    assert DAO.message.get_message_log_info(e.value.ids[2]).description == \
+        "Write message 2 from test_service"
+    values[1]["event_on"] = now
+    assert all(MessageService().write_messages(values))
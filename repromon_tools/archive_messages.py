@@ -0,0 +1,82 @@
+import argparse
+import logging.config
+from datetime import datetime, timedelta
+
+from repromon_app.config import app_config, app_config_init
+from repromon_app.dao import DAO, ArchiveDAO
+from repromon_app.db import db_init
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+def archive_messages(age_days: int, batch_size: int,
+                     dry_run: bool = False) -> dict:
+    """ Move message_log rows with event_on older than age_days to
+    archive files, in batches, each batch is written to files first,
+    then archive boundary is moved and rows are deleted from DB, so
+    they are always visible to readers, and rows archived twice after
+    failure are skipped on read by ID
+
+    :return: number of archived rows and written files
+    """
+    logger.debug(f"archive_messages(age_days={age_days}, "
+                 f"batch_size={batch_size}, dry_run={dry_run})")
+    if not DAO.archive.is_enabled():
+        raise ValueError("Archive requires pyarrow and archive_path")
+    cutoff: datetime = datetime.now() - timedelta(days=age_days)
+    res: dict = {"cutoff": cutoff, "rows": 0, "files": 0}
+    boundary: datetime = DAO.archive.get_boundary()
+    while True:
+        rows: list[dict] = \
+            DAO.message.get_message_logs_before(cutoff, batch_size)
+        if not rows:
+            break
+        if dry_run:
+            logger.info(f"Found {len(rows)} rows to archive")
+            res["rows"] += len(rows)
+            break
+        files: list[str] = DAO.archive.add_message_logs(rows)
+        if boundary is None or boundary < cutoff:
+            boundary = cutoff
+            DAO.archive.set_boundary(boundary)
+        try:
+            DAO.message.delete_message_logs([o["id"] for o in rows])
+            DAO.message.commit()
+        except BaseException:
+            DAO.message.rollback()
+            raise
+        res["rows"] += len(rows)
+        res["files"] += len(files)
+        logger.info(f"Archived {len(rows)} rows to {len(files)} files")
+    return res
+
+
+def main():
+    app_config_init()
+    logger.debug("main()")
+    cfg = app_config().maintenance
+    parser = argparse.ArgumentParser(
+        description="Move old message_log rows to Parquet archive "
+                    "partitioned by month and study")
+    parser.add_argument("--age-days", type=int, default=cfg.archive_age_days,
+                        help="archive rows with event_on older than this")
+    parser.add_argument("--batch-size", type=int,
+                        default=cfg.archive_batch_size,
+                        help="rows per batch")
+    parser.add_argument("--path", default=cfg.archive_path,
+                        help="archive folder, archive_path by default")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only count rows to archive in first batch")
+    args = parser.parse_args()
+
+    db_init(app_config().db.dict())
+    ArchiveDAO.set_path(args.path)
+    res: dict = archive_messages(args.age_days, args.batch_size,
+                                 args.dry_run)
+    logger.info(f"Done, archived {res['rows']} rows before "
+                f"{res['cutoff']} to {res['files']} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import logging.config
+import statistics
+import time
+from typing import Any, Callable
+
+from repromon_app.config import app_config, app_config_init
+from repromon_app.dao import DAO, ArchiveDAO, MessageDAO
+from repromon_app.db import db_init, db_session_done
+from repromon_app.service import FeedbackService, SecSysService
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+def _benchmark(call: Callable[[], Any], count: Callable[[Any], int],
+               repeat: int) -> dict:
+    """ Time call with validated and fast row to DTO mapping, the first
+    call of each mode is warm-up and is not measured
+
+    :param count: get number of rows from call result, not measured
+    :return: rows, best and mean ms per mode and speedup of best times
+    """
+    res: dict = {}
+    fast_dto: bool = MessageDAO.fast_dto
+    try:
+        for mode, enabled in (("validated", False), ("fast", True)):
+            MessageDAO.set_fast_dto(enabled)
+            times: list[float] = []
+            for i in range(max(1, repeat) + 1):
+                t0: float = time.perf_counter()
+                rows: Any = call()
+                if i > 0:
+                    times.append((time.perf_counter() - t0) * 1000.0)
+            res[mode] = {
+                "rows": count(rows),
+                "best_ms": round(min(times), 3),
+                "mean_ms": round(statistics.mean(times), 3),
+            }
+    finally:
+        MessageDAO.set_fast_dto(fast_dto)
+    best_ms: float = max(res["fast"]["best_ms"], 0.001)
+    res["speedup"] = round(res["validated"]["best_ms"] / best_ms, 2)
+    return res
+
+
+def benchmark_dto(category_id: int = None,
+                  study_id: int = None,
+                  interval_sec: int = None,
+                  repeat: int = 5) -> dict:
+    """ Compare get_message_log_infos timings with validated and fast
+    row to DTO mapping
+
+    :return: rows, best and mean ms per mode and speedup of best times
+    """
+    logger.debug(f"benchmark_dto(category_id={str(category_id)}, "
+                 f"study_id={str(study_id)}, "
+                 f"interval_sec={str(interval_sec)}, repeat={repeat})")
+    return _benchmark(lambda: DAO.message.get_message_log_infos(
+        category_id, study_id, interval_sec), len, repeat)
+
+
+def benchmark_http(client, headers: dict,
+                   category_id: int = None,
+                   study_id: int = None,
+                   interval_sec: int = None,
+                   repeat: int = 5) -> dict:
+    """ Compare feedback/get_message_log timings end to end through
+    TestClient with validated and fast row to DTO mapping, i.e. with
+    query, DTO mapping, JSON rendering and HTTP handling. Message log
+    cache and recent messages buffer are off while measuring
+
+    :param client: TestClient of the app
+    :param headers: authorization headers
+    :return: rows, best and mean ms per mode and speedup of best times
+    """
+    logger.debug(f"benchmark_http(category_id={str(category_id)}, "
+                 f"study_id={str(study_id)}, "
+                 f"interval_sec={str(interval_sec)}, repeat={repeat})")
+    params: dict = {k: v for k, v in (("category_id", category_id),
+                                      ("study_id", study_id),
+                                      ("interval_sec", interval_sec))
+                    if v is not None}
+
+    def _get():
+        response = client.get("/api/1/feedback/get_message_log",
+                              params=params, headers=headers)
+        response.raise_for_status()
+        return response
+
+    cache, buffer = FeedbackService.log_cache, FeedbackService.log_buffer
+    FeedbackService.log_cache = FeedbackService.log_buffer = None
+    try:
+        return _benchmark(_get, lambda r: len(r.json()), repeat)
+    finally:
+        FeedbackService.log_cache, FeedbackService.log_buffer = \
+            cache, buffer
+
+
+def main():
+    app_config_init()
+    logger.debug("main()")
+    parser = argparse.ArgumentParser(
+        description="Compare message log query timings with validated "
+                    "and fast row to DTO mapping, fill DB with "
+                    "send_message --load first to get realistic sizes")
+    parser.add_argument("--category-id", type=int, default=None,
+                        help="message category ID")
+    parser.add_argument("--study-id", type=int, default=None,
+                        help="study ID")
+    parser.add_argument("--interval-sec", type=int, default=None,
+                        help="query messages of the last seconds, "
+                             "all by default")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="measured calls per mode")
+    parser.add_argument("--http", action="store_true",
+                        help="measure feedback/get_message_log end to "
+                             "end through in-process test client")
+    parser.add_argument("--username", default="admin",
+                        help="user to issue access token for with --http")
+    args = parser.parse_args()
+
+    if args.http:
+        # test client requires httpx of dev dependencies
+        from fastapi.testclient import TestClient
+
+        from repromon_app.srv import create_fastapi_app
+        client = TestClient(create_fastapi_app())
+        token: str = SecSysService().create_access_token(
+            args.username, 3600).access_token
+        try:
+            res: dict = benchmark_http(
+                client, {"Authorization": f"Bearer {token}"},
+                args.category_id, args.study_id, args.interval_sec,
+                args.repeat)
+        finally:
+            db_session_done()
+        print(json.dumps(res, indent=2))
+        return
+
+    db_init(app_config().db.dict())
+    ArchiveDAO.set_path(app_config().maintenance.archive_path)
+    try:
+        res = benchmark_dto(args.category_id, args.study_id,
+                            args.interval_sec, args.repeat)
+    finally:
+        db_session_done()
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
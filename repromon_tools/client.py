@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""ReproMon producer client library
+
+Sample usage:
+
+    from repromon_tools.client import RepromonClient
+
+    with RepromonClient("https://localhost:9095/api/1",
+                        api_key="***",
+                        buffer_path="/var/tmp/repromon.buf") as client:
+        # synchronous call, returns MessageLogInfoDTO dict
+        client.send_message(category="Feedback", level="INFO",
+                            provider="ReproStim",
+                            description="stimuli display connected")
+
+        # background batching, messages are sent via send_messages
+        # endpoint in batches up to batch_max_size or after
+        # batch_linger_ms, and buffered on disk if server is unreachable
+        for i in range(1000):
+            client.submit(category="Feedback", level="INFO",
+                          provider="ReproEvents",
+                          description=f"MRI trigger event #{i}")
+
+Async variant is AsyncRepromonClient with the same API as coroutines,
+it requires httpx package.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+############################################
+# Client
+
+
+class RepromonClientError(Exception):
+    """Raised when message can't be sent after all retries"""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message, status_code)
+        self.status_code = status_code
+
+    def __str__(self):
+        return self.args[0]
+
+
+class LocalBuffer:
+    """ Append-only NDJSON file to keep messages while server
+    is unreachable, messages are replayed in the same order. Taken
+    messages stay in in-flight file until they are sent, so they
+    survive crash and are taken again """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.inflight_path: str = f"{path}.inflight"
+        self._lock: threading.Lock = threading.Lock()
+
+    def append(self, messages: list[dict]):
+        data: str = "".join(json.dumps(m) + "\n" for m in messages)
+        with self._lock:
+            self._append(self.path, data)
+
+    def done(self):
+        """ Remove taken messages once they are sent or appended back """
+        with self._lock:
+            if os.path.exists(self.inflight_path):
+                os.remove(self.inflight_path)
+
+    def is_empty(self) -> bool:
+        return all(not os.path.exists(o) or os.path.getsize(o) == 0
+                   for o in (self.path, self.inflight_path))
+
+    def take(self) -> list[dict]:
+        """ Move buffered messages to in-flight file and read them,
+        caller must call done() after they are sent or appended back """
+        with self._lock:
+            if os.path.exists(self.path):
+                if os.path.exists(self.inflight_path):
+                    # left after crash, newer messages go after them
+                    with open(self.path) as f:
+                        self._append(self.inflight_path, f.read())
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, self.inflight_path)
+            if not os.path.exists(self.inflight_path):
+                return []
+            with open(self.inflight_path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+
+    def _append(self, path: str, data: str):
+        with open(path, "a") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class _BaseClient:
+    RETRY_STATUS_CODES: tuple = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url: str,
+                 api_key: str = None,
+                 access_token: str = None,
+                 verify: bool = True,
+                 timeout: float = 10.0,
+                 pool_size: int = 10,
+                 max_retries: int = 5,
+                 backoff_base_ms: int = 100,
+                 backoff_max_ms: int = 10000,
+                 batch_max_size: int = 500,
+                 batch_linger_ms: int = 50,
+                 buffer_path: str = None):
+        """ Create client
+
+        :param base_url: API base URL, e.g. https://localhost:9095/api/1
+        :param api_key: API key, used as X-Api-Key header
+        :param access_token: OAuth2 JWT access token, used when no API key
+        :param verify: verify server TLS certificate
+        :param timeout: request timeout in seconds
+        :param pool_size: max number of keep-alive connections
+        :param max_retries: max number of retries per request
+        :param backoff_base_ms: first retry delay upper bound, doubled
+                                on every next retry
+        :param backoff_max_ms: max retry delay
+        :param batch_max_size: max number of messages per batch
+        :param batch_linger_ms: time to wait for more messages
+                                before batch is sent
+        :param buffer_path: optional file to keep messages in when
+                            server is unreachable
+        """
+        self.base_url: str = base_url.rstrip("/")
+        self.verify: bool = verify
+        self.timeout: float = timeout
+        self.pool_size: int = max(1, pool_size)
+        self.max_retries: int = max(0, max_retries)
+        self.backoff_base_ms: int = backoff_base_ms
+        self.backoff_max_ms: int = backoff_max_ms
+        self.batch_max_size: int = max(1, batch_max_size)
+        self.batch_linger_sec: float = max(0, batch_linger_ms) / 1000.0
+        self.buffer: LocalBuffer = LocalBuffer(buffer_path) \
+            if buffer_path else None
+        self.headers: dict = {}
+        if api_key:
+            self.headers["X-Api-Key"] = api_key
+        elif access_token:
+            self.headers["Authorization"] = f"Bearer {access_token}"
+        self.count_sent: int = 0
+        self.count_rejected: int = 0
+        self.count_buffered: int = 0
+        self.count_dropped: int = 0
+        self.count_retries: int = 0
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.count_sent,
+            "rejected": self.count_rejected,
+            "buffered": self.count_buffered,
+            "dropped": self.count_dropped,
+            "retries": self.count_retries,
+        }
+
+    def _message(self, study: str = None,
+                 category: str = None,
+                 level: str = None,
+                 device: str = None,
+                 provider: str = None,
+                 description: str = None,
+                 payload: str = None,
+                 event_on: datetime = None,
+                 registered_on: datetime = None,
+                 client_key: str = None) -> dict:
+        # client_key makes retries idempotent on server side,
+        # registered_on is set here to keep it when message is buffered
+        m: dict = {
+            "study": study,
+            "category": category,
+            "level": level,
+            "device": device,
+            "provider": provider,
+            "description": description,
+            "payload": json.dumps(payload)
+            if isinstance(payload, (dict, list)) else payload,
+            "event_on": event_on,
+            "registered_on": registered_on or datetime.now(),
+            "client_key": client_key or str(uuid.uuid4()),
+        }
+        return {k: v.isoformat() if isinstance(v, datetime) else v
+                for k, v in m.items() if v is not None}
+
+    def _retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        """ Exponential backoff with full jitter, Retry-After
+        header is used as lower bound when specified """
+        cap: float = min(self.backoff_max_ms,
+                         self.backoff_base_ms * (2 ** attempt)) / 1000.0
+        delay: float = random.uniform(0, cap)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def _result(self, messages: list[dict], res: dict):
+        errors: list[dict] = res.get("errors") or []
+        for e in errors:
+            logger.error(f"Message rejected: {e.get('detail')}, "
+                         f"message={messages[e.get('index')]}")
+        self.count_rejected += len(errors)
+        self.count_sent += len(messages) - len(errors)
+
+
+class RepromonClient(_BaseClient):
+    """ Thread-safe synchronous client with pooled keep-alive session
+    and optional background batching """
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.session: requests.Session = requests.Session()
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=self.pool_size,
+                                           pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.verify = self.verify
+        self.session.headers.update(self.headers)
+        self._queue: queue.Queue = queue.Queue()
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: threading.Thread = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Send pending messages and release connections """
+        if self._thread is not None:
+            self.flush()
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.session.close()
+
+    def flush(self):
+        """ Block until all submitted messages are sent or buffered """
+        self._queue.join()
+
+    def send_message(self, **kwargs) -> dict:
+        """ Send single message synchronously, returns message info """
+        return self._post("/message/send_message",
+                          params=self._message(**kwargs))
+
+    def send_messages(self, messages: list[dict]) -> dict:
+        """ Send batch of messages synchronously in single request,
+        returns MessageSendResultDTO dict """
+        messages = [self._message(**m) for m in messages]
+        res: dict = self._post("/message/send_messages", json=messages)
+        self._result(messages, res)
+        return res
+
+    def submit(self, **kwargs):
+        """ Queue message to be sent in background batch """
+        self._queue.put(self._message(**kwargs))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="RepromonClientSender",
+                        daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self) -> list[dict]:
+        try:
+            batch: list[dict] = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline: float = time.monotonic() + self.batch_linger_sec
+        while len(batch) < self.batch_max_size:
+            timeout: float = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout)
+                             if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _post(self, path: str, **kwargs) -> dict:
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.count_retries += 1
+            try:
+                response = self.session.post(f"{self.base_url}{path}",
+                                             timeout=self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.max_retries:
+                    raise RepromonClientError(f"Request failed: {str(e)}")
+                time.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code in (200, 202):
+                return response.json()
+            if response.status_code not in _BaseClient.RETRY_STATUS_CODES \
+                    or attempt >= self.max_retries:
+                raise RepromonClientError(
+                    f"Request failed, {response.status_code}: "
+                    f"{response.text}", response.status_code)
+            time.sleep(self._retry_delay(attempt,
+                                         response.headers.get("Retry-After")))
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch: list[dict] = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                # e.g. non-JSON response or buffer file error, sender
+                # must keep running, so flush() and close() don't block
+                logger.error(f"Failed send {len(batch)} messages: {str(e)}")
+                self.count_dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send_batch(self, batch: list[dict]):
+        # buffered messages go first to keep the order
+        taken: bool = bool(self.buffer) and not self.buffer.is_empty()
+        if taken:
+            batch = self.buffer.take() + batch
+        self._send_chunks(batch)
+        if taken:
+            self.buffer.done()
+
+    def _send_chunks(self, batch: list[dict]):
+        for i in range(0, len(batch), self.batch_max_size):
+            chunk: list[dict] = batch[i:i + self.batch_max_size]
+            try:
+                self._result(chunk, self._post("/message/send_messages",
+                                               json=chunk))
+            except RepromonClientError as e:
+                rest: list[dict] = batch[i:]
+                # 4xx other than 429 won't succeed on retry
+                retryable: bool = e.status_code is None or \
+                    e.status_code >= 429
+                if self.buffer and retryable:
+                    logger.warning(f"Buffer {len(rest)} messages: {str(e)}")
+                    self.buffer.append(rest)
+                    self.count_buffered += len(rest)
+                else:
+                    logger.error(f"Drop {len(rest)} messages: {str(e)}")
+                    self.count_dropped += len(rest)
+                return
+
+
+class AsyncRepromonClient(_BaseClient):
+    """ Asyncio client with pooled keep-alive connections and
+    optional background batching, requires httpx package """
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(base_url, **kwargs)
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("AsyncRepromonClient requires httpx package")
+        self._httpx = httpx
+        self.session = httpx.AsyncClient(
+            headers=self.headers,
+            verify=self.verify,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.pool_size,
+                                max_keepalive_connections=self.pool_size))
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """ Send pending messages and release connections """
+        if self._task is not None:
+            await self.flush()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.session.aclose()
+
+    async def flush(self):
+        """ Wait until all submitted messages are sent or buffered """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def send_message(self, **kwargs) -> dict:
+        """ Send single message, returns message info """
+        return await self._post("/message/send_message",
+                                params=self._message(**kwargs))
+
+    async def send_messages(self, messages: list[dict]) -> dict:
+        """ Send batch of messages in single request,
+        returns MessageSendResultDTO dict """
+        messages = [self._message(**m) for m in messages]
+        res: dict = await self._post("/message/send_messages", json=messages)
+        self._result(messages, res)
+        return res
+
+    async def submit(self, **kwargs):
+        """ Queue message to be sent in background batch """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        await self._queue.put(self._message(**kwargs))
+
+    async def _next_batch(self) -> list[dict]:
+        batch: list[dict] = [await self._queue.get()]
+        deadline: float = time.monotonic() + self.batch_linger_sec
+        while len(batch) < self.batch_max_size:
+            timeout: float = deadline - time.monotonic()
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout)
+                             if timeout > 0 else self._queue.get_nowait())
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _post(self, path: str, **kwargs) -> dict:
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.count_retries += 1
+            try:
+                response = await self.session.post(f"{self.base_url}{path}",
+                                                   **kwargs)
+            except self._httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise RepromonClientError(f"Request failed: {str(e)}")
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code in (200, 202):
+                return response.json()
+            if response.status_code not in _BaseClient.RETRY_STATUS_CODES \
+                    or attempt >= self.max_retries:
+                raise RepromonClientError(
+                    f"Request failed, {response.status_code}: "
+                    f"{response.text}", response.status_code)
+            await asyncio.sleep(self._retry_delay(
+                attempt, response.headers.get("Retry-After")))
+
+    async def _run(self):
+        while True:
+            batch: list[dict] = await self._next_batch()
+            try:
+                await self._send_batch(batch)
+            except Exception as e:
+                logger.error(f"Failed send {len(batch)} messages: {str(e)}")
+                self.count_dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _send_batch(self, batch: list[dict]):
+        # buffered messages go first to keep the order
+        taken: bool = bool(self.buffer) and not self.buffer.is_empty()
+        if taken:
+            batch = await asyncio.to_thread(self.buffer.take) + batch
+        await self._send_chunks(batch)
+        if taken:
+            await asyncio.to_thread(self.buffer.done)
+
+    async def _send_chunks(self, batch: list[dict]):
+        for i in range(0, len(batch), self.batch_max_size):
+            chunk: list[dict] = batch[i:i + self.batch_max_size]
+            try:
+                self._result(chunk, await self._post("/message/send_messages",
+                                                     json=chunk))
+            except RepromonClientError as e:
+                rest: list[dict] = batch[i:]
+                # 4xx other than 429 won't succeed on retry
+                retryable: bool = e.status_code is None or \
+                    e.status_code >= 429
+                if self.buffer and retryable:
+                    logger.warning(f"Buffer {len(rest)} messages: {str(e)}")
+                    await asyncio.to_thread(self.buffer.append, rest)
+                    self.count_buffered += len(rest)
+                else:
+                    logger.error(f"Drop {len(rest)} messages: {str(e)}")
+                    self.count_dropped += len(rest)
+                return
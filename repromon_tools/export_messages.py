@@ -0,0 +1,105 @@
+import argparse
+import logging.config
+from datetime import datetime
+from typing import Iterator
+
+from repromon_app.codec import export_arrow
+from repromon_app.config import app_config, app_config_init
+from repromon_app.dao import DAO, ArchiveDAO, message_log_schema
+from repromon_app.db import db_init
+
+logger = logging.getLogger(__name__)
+logger.debug(f"name={__name__}")
+
+
+def export_messages(path: str, fmt: str = "parquet",
+                    columns: list[str] = None,
+                    category_id: int = None,
+                    study_id: int = None,
+                    start_event_on: datetime = None,
+                    end_event_on: datetime = None,
+                    visible_only: bool = True,
+                    batch_size: int = 50000) -> dict:
+    """ Write message_log rows to Arrow IPC stream or Parquet file for
+    analytics, e.g. with pandas or polars, rows are read from DB cursor
+    in record batches with projection and event_on range in SQL
+
+    :return: number of exported rows and record batches
+    """
+    logger.debug(f"export_messages(path={path}, fmt={fmt}, "
+                 f"columns={str(columns)}, category_id={str(category_id)}, "
+                 f"study_id={str(study_id)}, "
+                 f"start_event_on={str(start_event_on)}, "
+                 f"end_event_on={str(end_event_on)}, "
+                 f"visible_only={visible_only}, batch_size={batch_size})")
+    res: dict = {"rows": 0, "batches": 0}
+
+    def _count(batches: Iterator) -> Iterator:
+        for batch in batches:
+            res["rows"] += batch.num_rows
+            res["batches"] += 1
+            yield batch
+
+    chunks: Iterator[bytes] = export_arrow(
+        _count(DAO.message.iter_message_log_batches(
+            columns, category_id, study_id, start_event_on, end_event_on,
+            visible_only, batch_size)),
+        message_log_schema(columns), fmt)
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return res
+
+
+def main():
+    app_config_init()
+    logger.debug("main()")
+    parser = argparse.ArgumentParser(
+        description="Export message_log rows to Arrow IPC stream or "
+                    "Parquet file for analytics")
+    parser.add_argument("path",
+                        help="output file, .arrow or .parquet")
+    parser.add_argument("--format", dest="fmt",
+                        choices=["arrow", "parquet"], default=None,
+                        help="output format, by output file extension "
+                             "and parquet by default")
+    parser.add_argument("--columns", default=None,
+                        help="comma separated message_log columns, "
+                             "all by default")
+    parser.add_argument("--category-id", type=int, default=None,
+                        help="message category ID")
+    parser.add_argument("--study-id", type=int, default=None,
+                        help="study ID")
+    parser.add_argument("--start", type=datetime.fromisoformat,
+                        default=None,
+                        help="export rows with event_on at or after, "
+                             "ISO format")
+    parser.add_argument("--end", type=datetime.fromisoformat,
+                        default=None,
+                        help="export rows with event_on before, ISO format")
+    parser.add_argument("--all", action="store_true",
+                        help="export hidden rows too")
+    parser.add_argument("--batch-size", type=int,
+                        default=app_config().feedback.export_arrow_batch_size,
+                        help="rows per record batch and Parquet row group")
+    args = parser.parse_args()
+
+    db_init(app_config().db.dict())
+    ArchiveDAO.set_path(app_config().maintenance.archive_path)
+    fmt: str = args.fmt or \
+        ("arrow" if args.path.endswith(".arrow") else "parquet")
+    res: dict = export_messages(
+        args.path, fmt,
+        columns=args.columns.split(",") if args.columns else None,
+        category_id=args.category_id,
+        study_id=args.study_id,
+        start_event_on=args.start,
+        end_event_on=args.end,
+        visible_only=not args.all,
+        batch_size=args.batch_size)
+    logger.info(f"Done, exported {res['rows']} rows in "
+                f"{res['batches']} batches to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
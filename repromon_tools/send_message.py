@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
+import argparse
 import copy
 import json
 import logging.config
+import math
 import os
 import random
 import sys
+import threading
 import time
+import uuid
+from collections import Counter
 from datetime import datetime, timedelta
 
 import requests
@@ -20,6 +25,7 @@ logger.debug(f"name={__name__}")
 API_BASE_URL = os.environ.get('REPROMON_API_URL', "https://localhost:9095/api/1")
 ACCESS_TOKEN = os.environ.get('REPROMON_ACCESS_TOKEN')
 API_KEY = os.environ.get('REPROMON_API_KEY')
+MAX_RETRIES = int(os.environ.get('REPROMON_MAX_RETRIES', "3"))
 
 
 class DataProviderId:
@@ -141,52 +147,70 @@ count_all: int = 0
 count_success: int = 0
 
 
+def auth_headers(auth: str = None) -> dict:
+    """ Build auth headers, auth is "jwt" or "apikey", by default
+    JWT access token is used first and API key next if any """
+    if auth == "jwt" or (auth is None and ACCESS_TOKEN):
+        # sample for OAuth2+JWT access token
+        return {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+    if auth == "apikey" or (auth is None and API_KEY):
+        # sample for API Key auth
+        return {"X-Api-Key": API_KEY}
+    return {}
+
+
+def random_message() -> dict:
+    params = copy.copy(random.choice(SAMPLE_MESSAGES))
+
+    # set sporadically event_on/registered_on time manually
+    if random.choice([False, True, False]):
+        dt_sec = random.randint(10, 600)
+        params["event_on"] = (datetime.now() - timedelta(seconds=dt_sec)).isoformat()
+        if random.choice([True, False, True]):
+            params["registered_on"] = \
+                (datetime.now() - timedelta(seconds=int(dt_sec / 2))).isoformat()
+
+    # idempotency key, so retries never record the same message twice
+    params["client_key"] = str(uuid.uuid4())
+    return params
+
+
 def send_message():
     print("send_message()")
     global count_all, count_success
     count_all += 1
     try:
         # Define your query parameters
-        params = copy.copy(random.choice(SAMPLE_MESSAGES))
-
-        # set sporadically event_on/registered_on time manually
-        if random.choice([False, True, False]):
-            dt_sec = random.randint(10, 600)
-            params["event_on"] = (datetime.now() - timedelta(seconds=dt_sec)).isoformat()
-            if random.choice([True, False, True]):
-                params["registered_on"] = \
-                    (datetime.now() - timedelta(seconds=int(dt_sec / 2))).isoformat()
-
+        params = random_message()
         logger.debug(f"params={json.dumps(params, indent=4)}")
-
-        if ACCESS_TOKEN:
-            # sample for OAuth2+JWT access token
-            logger.debug("use OAuth2+JWT access token auth")
-            headers = {
-                "Authorization": f"Bearer {ACCESS_TOKEN}"
-            }
-        elif API_KEY:
-            # sample for API Key auth
-            logger.debug("use API Key auth")
-            headers = {
-                "X-Api-Key": API_KEY
-            }
-        else:
-            logger.debug("use no auth")
-            headers = {}
-
+        headers = auth_headers()
         logger.debug(f"API_BASE_URL={API_BASE_URL}")
 
-        response = requests.post(f"{API_BASE_URL}/message/send_message",
-                                 params=params,
-                                 headers=headers,
-                                 verify=False  # NOTE: This should be only used
-                                               # with local self-signed
-                                               # certificates and not in
-                                               # production environment
-                                 )
+        response = None
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt > 0:
+                logger.debug(f"retry #{attempt}, "
+                             f"client_key={params['client_key']}")
+                time.sleep(min(2 ** attempt, 10))
+            try:
+                response = requests.post(
+                    f"{API_BASE_URL}/message/send_message",
+                    params=params,
+                    headers=headers,
+                    verify=False  # NOTE: This should be only used
+                                  # with local self-signed
+                                  # certificates and not in
+                                  # production environment
+                )
+            except requests.exceptions.ConnectionError as ex:
+                logger.error(f"Connection failed: {str(ex)}")
+                continue
+            if response.status_code != 429 and response.status_code < 500:
+                break
 
-        if response.status_code == 200:
+        if response is None:
+            logger.error("Message sending failed, no connection")
+        elif response.status_code in (200, 202):
             logger.debug("Message sent successfully")
             count_success += 1
         else:
@@ -199,10 +223,231 @@ def send_message():
                 f"error_count: {str(count_all-count_success)}")
 
 
-def main():
+############################################
+# Load generator
+
+# latency histogram bucket upper bounds in ms
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500,
+                        1000, 2000, 5000, 10000, math.inf]
+
+
+class LoadStats:
+    """ Thread-safe collector of request latencies and errors """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies_ms: list[float] = []
+        self.errors: Counter = Counter()
+        self.requests: int = 0
+        self.messages: int = 0
+        self.first_ts: float = None
+        self.last_ts: float = None
+
+    def add(self, t0: float, t1: float, messages: int, error: str = None):
+        with self._lock:
+            self.requests += 1
+            self.latencies_ms.append((t1 - t0) * 1000.0)
+            if error:
+                self.errors[error] += 1
+            else:
+                self.messages += messages
+            self.first_ts = t0 if self.first_ts is None \
+                else min(self.first_ts, t0)
+            self.last_ts = t1 if self.last_ts is None \
+                else max(self.last_ts, t1)
+
+    def results(self) -> dict:
+        lst: list[float] = sorted(self.latencies_ms)
+        elapsed: float = (self.last_ts - self.first_ts) \
+            if self.requests else 0
+
+        def _pct(p: float) -> float:
+            # nearest-rank percentile
+            if not lst:
+                return 0
+            return round(lst[max(0, math.ceil(p / 100.0 * len(lst)) - 1)], 3)
+
+        histogram: list[dict] = []
+        start: int = 0
+        for le in HISTOGRAM_BUCKETS_MS:
+            end: int = start
+            while end < len(lst) and lst[end] <= le:
+                end += 1
+            histogram.append({"le": le if le != math.inf else "inf",
+                              "count": end - start})
+            start = end
+
+        return {
+            "requests": self.requests,
+            "messages": self.messages,
+            "errors": sum(self.errors.values()),
+            "errors_by_kind": dict(self.errors),
+            "elapsed_sec": round(elapsed, 3),
+            "throughput_rps": round(self.requests / elapsed, 3)
+            if elapsed else 0,
+            "throughput_mps": round(self.messages / elapsed, 3)
+            if elapsed else 0,
+            "latency_ms": {
+                "min": round(lst[0], 3) if lst else 0,
+                "mean": round(sum(lst) / len(lst), 3) if lst else 0,
+                "p50": _pct(50),
+                "p95": _pct(95),
+                "p99": _pct(99),
+                "max": round(lst[-1], 3) if lst else 0,
+            },
+            "histogram": histogram,
+        }
+
+
+def _load_worker(args, stats: LoadStats, schedule, t_measure: float,
+                 t_end: float):
+    # one keep-alive session per worker thread
+    session = requests.Session()
+    session.verify = False  # NOTE: local self-signed certificates only
+    auths: list[str] = ["jwt", "apikey"] if args.auth == "mix" else [args.auth]
     while True:
-        send_message()
-        time.sleep(random.randint(1, 5))
+        n, t_start = schedule()
+        # stop also when workers can't keep up with target rate
+        if t_start >= t_end or time.monotonic() >= t_end:
+            break
+        delay: float = t_start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        headers: dict = auth_headers(auths[n % len(auths)])
+        error: str = None
+        t0: float = time.monotonic()
+        try:
+            if args.batch_size > 1:
+                response = session.post(
+                    f"{args.url}/message/send_messages",
+                    json=[random_message() for _ in range(args.batch_size)],
+                    headers=headers)
+            else:
+                response = session.post(f"{args.url}/message/send_message",
+                                        params=random_message(),
+                                        headers=headers)
+            if response.status_code not in (200, 202):
+                error = f"HTTP {response.status_code}"
+            elif args.batch_size > 1 and response.json().get("errors"):
+                error = "rejected messages"
+        except requests.exceptions.RequestException as ex:
+            error = type(ex).__name__
+        t1: float = time.monotonic()
+        # requests started in warm-up phase are not measured
+        if t0 >= t_measure:
+            stats.add(t0, t1, args.batch_size, error)
+    session.close()
+
+
+def run_load(args) -> dict:
+    """ Send messages with target rate and concurrency for
+    warm-up and measured duration, returns results dict """
+    logger.info(f"Load: url={args.url}, rate={args.rate}/s, "
+                f"concurrency={args.concurrency}, "
+                f"warmup={args.warmup}s, duration={args.duration}s, "
+                f"auth={args.auth}, batch_size={args.batch_size}")
+    started_on: datetime = datetime.now()
+    stats: LoadStats = LoadStats()
+    lock = threading.Lock()
+    count: int = 0
+    t_begin: float = time.monotonic()
+    t_measure: float = t_begin + args.warmup
+    t_end: float = t_measure + args.duration
+
+    def _schedule() -> tuple[int, float]:
+        # next request number and start time, open loop with
+        # fixed inter-arrival time when rate is set
+        nonlocal count
+        with lock:
+            n: int = count
+            count += 1
+        if args.rate > 0:
+            return n, t_begin + n / args.rate
+        return n, time.monotonic()
+
+    threads: list[threading.Thread] = [
+        threading.Thread(target=_load_worker,
+                         args=(args, stats, _schedule, t_measure, t_end),
+                         name=f"LoadWorker-{i}", daemon=True)
+        for i in range(max(1, args.concurrency))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return {
+        "started_on": started_on.isoformat(),
+        "config": {
+            "url": args.url,
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "warmup_sec": args.warmup,
+            "duration_sec": args.duration,
+            "auth": args.auth,
+            "batch_size": args.batch_size,
+        },
+        "results": stats.results(),
+    }
+
+
+def print_results(res: dict):
+    r: dict = res["results"]
+    lat: dict = r["latency_ms"]
+    print(f"requests: {r['requests']}, messages: {r['messages']}, "
+          f"errors: {r['errors']} {r['errors_by_kind'] or ''}")
+    print(f"throughput: {r['throughput_rps']} req/s, "
+          f"{r['throughput_mps']} msg/s")
+    print(f"latency ms: min={lat['min']} mean={lat['mean']} "
+          f"p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} "
+          f"max={lat['max']}")
+    top: int = max([b["count"] for b in r["histogram"]] + [1])
+    for b in r["histogram"]:
+        print(f"  <= {str(b['le']):>6} ms | {b['count']:>8} | "
+              f"{'#' * round(40 * b['count'] / top)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send sample ReproMon messages, one every 1-5 seconds "
+                    "by default, or generate load with --load option")
+    parser.add_argument("--load", action="store_true",
+                        help="run load generator and print results")
+    parser.add_argument("--url", default=API_BASE_URL,
+                        help="API base URL, REPROMON_API_URL by default")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="target requests per second, "
+                             "0 for as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="number of worker threads")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="warm-up phase in seconds, not measured")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="measured phase in seconds")
+    parser.add_argument("--auth", choices=["jwt", "apikey", "mix"],
+                        default="apikey" if API_KEY else "jwt",
+                        help="auth mode, mix alternates JWT and API key")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="messages per request, more than 1 "
+                             "uses send_messages endpoint")
+    parser.add_argument("--results", default=None,
+                        help="path to JSON results file")
+    args = parser.parse_args()
+
+    if not args.load:
+        while True:
+            send_message()
+            time.sleep(random.randint(1, 5))
+
+    # per request logging is too noisy under load
+    logger.setLevel(logging.INFO)
+    res: dict = run_load(args)
+    print_results(res)
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump(res, f, indent=4)
+        logger.info(f"Results saved to {args.results}")
 
 
 if __name__ == "__main__":